@@ -0,0 +1,59 @@
+"""
+Compares the fixed-size per-page chunker with the structure-aware chunker.
+
+Usage:
+    python benchmarks/chunker_benchmark.py data/proposal1.pdf data/proposal2.pdf
+
+For each PDF, prints the number of chunks and estimated embedding tokens each
+chunker produces, so the effect on Jina cost and vector store size can be tracked.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.utils import (
+    recursive_chunking,
+    structure_aware_chunking,
+    estimate_tokens,
+    iter_pdf_pages,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+)
+
+def benchmark_pdf(pdf_path: str, max_tokens: int, overlap_tokens: int) -> dict:
+    pages = list(iter_pdf_pages(pdf_path))
+
+    recursive = [chunk for _, text in pages if text for chunk in recursive_chunking(text)]
+    structured = [c["text"] for c in structure_aware_chunking(pages, max_tokens=max_tokens, overlap_tokens=overlap_tokens)]
+
+    return {
+        "pages": len(pages),
+        "recursive_chunks": len(recursive),
+        "recursive_tokens": sum(estimate_tokens(c) for c in recursive),
+        "structured_chunks": len(structured),
+        "structured_tokens": sum(estimate_tokens(c) for c in structured),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+", help="PDF files to chunk")
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    header = f"{'document':<40} {'pages':>6} {'recursive chunks':>17} {'tokens':>9} {'structured chunks':>18} {'tokens':>9} {'token saving':>13}"
+    print(header)
+    print("-" * len(header))
+    for pdf_path in args.pdfs:
+        r = benchmark_pdf(pdf_path, args.max_tokens, args.overlap_tokens)
+        saving = 1 - r["structured_tokens"] / r["recursive_tokens"] if r["recursive_tokens"] else 0.0
+        print(
+            f"{os.path.basename(pdf_path)[:40]:<40} {r['pages']:>6} "
+            f"{r['recursive_chunks']:>17} {r['recursive_tokens']:>9} "
+            f"{r['structured_chunks']:>18} {r['structured_tokens']:>9} {saving:>12.1%}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures import time and cold start of the pipeline entry points.
+
+Usage:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 10 --lifespan --record benchmarks/startup_history.jsonl
+
+Each target is imported in a fresh interpreter (so nothing is cached in
+sys.modules) and timed; the median over --runs is reported together with
+the heavy dependencies the import pulled in. With --lifespan, the FastAPI
+cold start also runs the app's startup hook (opening the vector store).
+--record appends the results as one JSON line so startup can be tracked
+over time.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry points and the modules behind them, cheapest first
+TARGETS = ["modules.utils", "modules.kimi_client", "modules.proposal_ingestor", "main", "fast_api_app"]
+HEAVY_MODULES = ["pandas", "numpy", "fitz", "groq", "pymilvus", "fastapi"]
+
+_IMPORT_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_LIFESPAN_SNIPPET = """
+import sys, time, json, asyncio
+start = time.perf_counter()
+import fast_api_app
+imported = time.perf_counter() - start
+
+async def startup():
+    async with fast_api_app.lifespan(fast_api_app.app):
+        pass
+
+asyncio.run(startup())
+print(json.dumps({"seconds": time.perf_counter() - start, "import_seconds": imported, "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+def run_snippet(code: str) -> dict:
+    """Runs code in a fresh interpreter from the repo root and returns its JSON output plus wall time."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall_seconds"] = wall
+    return result
+
+def benchmark(code: str, runs: int) -> dict:
+    samples = [run_snippet(code) for _ in range(runs)]
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "wall_seconds": statistics.median(s["wall_seconds"] for s in samples),
+        "heavy": samples[-1]["heavy"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target (median is reported)")
+    parser.add_argument("--lifespan", action="store_true", help="also time FastAPI import + startup hook")
+    parser.add_argument("--record", help="append results as a JSON line to this file")
+    args = parser.parse_args()
+
+    baseline = benchmark('import json; print(json.dumps({"seconds": 0.0, "heavy": []}))', args.runs)["wall_seconds"]
+    results = {}
+
+    header = f"{'target':<28} {'import (s)':>11} {'process (s)':>12}  heavy modules loaded"
+    print(f"Interpreter start-up: {baseline:.3f}s (median of {args.runs})")
+    print(header)
+    print("-" * len(header))
+    targets = [(t, _IMPORT_SNIPPET.format(target=t, heavy=HEAVY_MODULES)) for t in TARGETS]
+    if args.lifespan:
+        targets.append(("fast_api_app + lifespan", _LIFESPAN_SNIPPET % (HEAVY_MODULES,)))
+    for name, code in targets:
+        try:
+            r = benchmark(code, args.runs)
+        except RuntimeError as e:
+            print(f"{name:<28} failed: {e}")
+            continue
+        results[name] = r
+        print(f"{name:<28} {r['seconds']:>11.3f} {r['wall_seconds']:>12.3f}  {', '.join(r['heavy']) or '-'}")
+
+    if args.record:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        with open(args.record, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "commit": commit,
+                "python": sys.version.split()[0],
+                "runs": args.runs,
+                "interpreter_seconds": baseline,
+                "results": results,
+            }) + "\n")
+        print(f"\nRecorded to {args.record}")
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,585 @@
 import os
-import uvicorn
-import pandas as pd
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from main import main, RFP_PATH, PROPOSALS_PATHS
-from typing import Dict
+import glob
+import json
+import time
+import uuid
+import asyncio
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from python_multipart.multipart import MultipartParser, parse_options_header
+from main import main, OUTPUT_BASE_DIR
+from modules.checkpoint import RunCheckpoint
+from modules.jobs import JobManager, Job
+from modules.vector_store import initialize_vector_store, ensure_vector_store_ready, VectorStore
+from modules.proposal_ingestor import remove_proposals
+from typing import Any, Dict, List, Optional, Tuple
 
 # Define the root directory for file storage
 DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
-
-app = FastAPI()
-
-@app.post("/upload_and_evaluate/")
-async def upload_and_evaluate(
-    rfp_file: UploadFile = File(...),
-    proposal1_file: UploadFile = File(...),
-    proposal2_file: UploadFile = File(...),
-    rfp_page_number: int = Form(...)
-):
-    """Handles file uploads and triggers the main evaluation pipeline."""
+# Uploads of each job are saved under data/jobs/<job_id>/
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+os.makedirs(JOBS_DIR, exist_ok=True)
+# Delete a job's uploads and vectors once it finishes (results stay in OUTPUT_BASE_DIR);
+# failed or incomplete jobs keep their uploads so they can be resumed
+JOB_CLEANUP = os.getenv("JOB_CLEANUP", "1").lower() not in ("0", "false", "no")
+# Kept uploads of failed or incomplete jobs are deleted once untouched for this long (0 keeps them)
+JOB_UPLOAD_TTL_HOURS = float(os.getenv("JOB_UPLOAD_TTL_HOURS", "72"))
+# Seconds between sweeps for expired job uploads
+JOB_UPLOAD_SWEEP_INTERVAL = int(os.getenv("JOB_UPLOAD_SWEEP_INTERVAL", "3600"))
+
+# Uploads are parsed from the request stream and written to disk in blocks of this size
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Largest accepted PDF; requests declaring more than MAX_PROPOSALS + 1 of these are rejected before parsing
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "500")) * 1024 * 1024
+# Most proposals accepted in one evaluation
+MAX_PROPOSALS = int(os.getenv("MAX_PROPOSALS", "20"))
+UPLOAD_ENDPOINTS = ("/jobs", "/upload_and_evaluate/")
+# File fields holding proposals, in the order they are numbered
+PROPOSAL_FIELDS = ("proposal_files", "proposal1_file", "proposal2_file")
+# Combined size allowed for the non-file form fields
+MAX_FORM_FIELD_BYTES = 64 * 1024
+# Request body of the upload endpoints for the API docs, as they read the multipart stream themselves
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["rfp_file", "rfp_page_number"],
+            "properties": {
+                "rfp_file": {"type": "string", "format": "binary"},
+                "proposal_files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                "proposal1_file": {"type": "string", "format": "binary"},
+                "proposal2_file": {"type": "string", "format": "binary"},
+                "rfp_page_number": {"type": "integer"},
+            },
+        }}},
+    }
+}
+
+# Seconds between background health checks of the shared vector store
+VECTOR_STORE_HEALTH_INTERVAL = int(os.getenv("VECTOR_STORE_HEALTH_INTERVAL", "60"))
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+def get_shared_vector_store() -> Optional[VectorStore]:
+    """
+    Returns the app-wide vector store opened at startup, so jobs don't pay
+    for connecting and loading the collection. It is health-checked (and
+    reconnected if needed) before each use, and opened lazily if startup
+    couldn't reach it.
+    """
+    global _vector_store
+    with _vector_store_lock:
+        if _vector_store is None:
+            _vector_store = initialize_vector_store()
+            return _vector_store
+        return _vector_store if ensure_vector_store_ready(_vector_store) else None
+
+async def _monitor_vector_store():
+    """Periodically health-checks the shared store so a dropped connection is restored between jobs."""
+    while True:
+        await asyncio.sleep(VECTOR_STORE_HEALTH_INTERVAL)
+        try:
+            await asyncio.to_thread(get_shared_vector_store)
+        except Exception as e:
+            print(f"⚠️ Vector store health check failed: {e}")
+
+def sweep_job_uploads(ttl_hours: float = None) -> int:
+    """
+    Deletes upload directories under JOBS_DIR that no queued or running job
+    uses and that haven't changed for ttl_hours (default JOB_UPLOAD_TTL_HOURS).
+    These are the uploads kept so failed or incomplete jobs can be resumed;
+    resuming an expired job answers 409. Returns the number deleted.
+    """
+    ttl_hours = JOB_UPLOAD_TTL_HOURS if ttl_hours is None else ttl_hours
+    if ttl_hours <= 0 or not os.path.isdir(JOBS_DIR):
+        return 0
+    cutoff = time.time() - ttl_hours * 3600
+    removed = 0
+    for job_id in os.listdir(JOBS_DIR):
+        job_dir = os.path.join(JOBS_DIR, job_id)
+        job = job_manager.get(job_id)
+        if job is not None and job.status in ("queued", "running"):
+            continue
+        try:
+            if os.path.isdir(job_dir) and os.path.getmtime(job_dir) < cutoff:
+                shutil.rmtree(job_dir)
+                removed += 1
+        except OSError as e:
+            print(f"⚠️ Could not delete expired uploads {job_dir}: {e}")
+    if removed:
+        print(f"♻️ Deleted the uploads of {removed} jobs untouched for over {ttl_hours:g} hours.")
+    return removed
+
+async def _sweep_job_uploads():
+    """Expires kept job uploads at startup and then every JOB_UPLOAD_SWEEP_INTERVAL seconds."""
+    while True:
+        try:
+            await asyncio.to_thread(sweep_job_uploads)
+        except Exception as e:
+            print(f"⚠️ Sweeping job uploads failed: {e}")
+        await asyncio.sleep(JOB_UPLOAD_SWEEP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect and load the collection once, before the first request
+    await asyncio.to_thread(get_shared_vector_store)
+    monitor = asyncio.create_task(_monitor_vector_store())
+    sweeper = asyncio.create_task(_sweep_job_uploads())
+    try:
+        yield
+    finally:
+        monitor.cancel()
+        sweeper.cancel()
+        job_manager.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
+
+# Background workers running the evaluation pipeline (see JOB_WORKERS)
+job_manager = JobManager()
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_HEARTBEAT_SECONDS = 15
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuses uploads whose declared size is over the limit before the body is read."""
+    if request.method == "POST" and request.url.path in UPLOAD_ENDPOINTS:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > (MAX_PROPOSALS + 1) * MAX_UPLOAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload too large: at most {MAX_UPLOAD_BYTES // (1024 * 1024)} MB per PDF."}
+            )
+    return await call_next(request)
+
+class _UploadFile:
+    """A file part of a multipart upload, hashed and written to disk as it arrives."""
+
+    def __init__(self, field: str, filename: str, path: str):
+        self.field = field
+        self.filename = filename
+        self.path = path
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._pending = bytearray()
+        self._file = None
+
+    def _write(self, block: bytearray):
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        self._digest.update(block)
+        self._file.write(block)
+
+    async def feed(self, data: memoryview, max_bytes: int):
+        """Buffers the next bytes, refusing the file as soon as it is too large or not a PDF."""
+        self.size += len(data)
+        if self.size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"{self.filename} is larger than {max_bytes // (1024 * 1024)} MB.")
+        if len(self._head) < 5:
+            self._head += bytes(data[:5 - len(self._head)])
+            if len(self._head) == 5 and self._head != b"%PDF-":
+                raise HTTPException(status_code=415, detail=f"{self.filename} is not a PDF file.")
+        self._pending += data
+        if len(self._pending) >= UPLOAD_CHUNK_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        # Hashing and disk writes run on a worker thread so the event loop keeps serving requests
+        block, self._pending = self._pending, bytearray()
+        await asyncio.to_thread(self._write, block)
+
+    async def finish(self) -> Dict[str, Any]:
+        if self._head != b"%PDF-":
+            raise HTTPException(status_code=415, detail=f"{self.filename} is not a PDF file.")
+        await self.flush()
+        await self.close()
+        return {"filename": self.filename, "path": self.path, "sha256": self._digest.hexdigest(), "size": self.size}
+
+    async def close(self):
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+async def receive_uploads(request: Request, job_dir: str, max_bytes: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, List[Dict[str, Any]]]]:
+    """
+    Parses a multipart upload straight from the request stream, without
+    spooling it first. Files are hashed and written to job_dir block by
+    block as they arrive; a file over max_bytes (default MAX_UPLOAD_BYTES)
+    is refused with 413 as soon as it passes the limit, and one that isn't a
+    PDF with 415 after its first bytes. Returns the form fields and, per
+    file field, the saved files ({"filename", "path", "sha256", "size"}).
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data upload.")
+
+    # The parser's callbacks only queue events; they are handled between reads, where awaiting is allowed
+    events: List[Tuple[str, Any]] = []
+    headers: Dict[bytes, bytes] = {}
+    header = {"field": b"", "value": b""}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"], header["value"] = b"", b""
+
+    def on_headers_finished():
+        events.append(("part", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", memoryview(data)[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    fields: Dict[str, str] = {}
+    files: Dict[str, List[Dict[str, Any]]] = {}
+    current: Any = None
+    field_bytes = 0
+    proposal_count = 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "part":
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    filename = disposition.get(b"filename")
+                    if filename is None:
+                        current = [name, b""]
+                    elif not filename:
+                        # An empty file input of a browser form
+                        current = None
+                    elif name == "rfp_file":
+                        if "rfp_file" in files:
+                            raise HTTPException(status_code=422, detail="Upload exactly one rfp_file.")
+                        current = _UploadFile(name, filename.decode("utf-8", "replace"), os.path.join(job_dir, "rfp.pdf"))
+                    elif name in PROPOSAL_FIELDS:
+                        proposal_count += 1
+                        if proposal_count > MAX_PROPOSALS:
+                            raise HTTPException(status_code=422, detail=f"At most {MAX_PROPOSALS} proposals can be evaluated at once.")
+                        current = _UploadFile(name, filename.decode("utf-8", "replace"), os.path.join(job_dir, f"upload{proposal_count}.pdf"))
+                    else:
+                        raise HTTPException(status_code=422, detail=f"Unexpected file field: {name}")
+                elif kind == "data" and current is not None:
+                    if isinstance(current, _UploadFile):
+                        await current.feed(value, max_bytes)
+                    else:
+                        field_bytes += len(value)
+                        if field_bytes > MAX_FORM_FIELD_BYTES:
+                            raise HTTPException(status_code=413, detail="Form fields are too large.")
+                        current[1] += value
+                elif kind == "end" and current is not None:
+                    if isinstance(current, _UploadFile):
+                        files.setdefault(current.field, []).append(await current.finish())
+                    else:
+                        fields[current[0]] = current[1].decode("utf-8", "replace")
+                    current = None
+            events.clear()
+        parser.finalize()
+    finally:
+        if isinstance(current, _UploadFile):
+            await current.close()
+    return fields, files
+
+def cleanup_job(job_id: str, proposal_ids, keep_uploads: bool = False):
+    """Releases the job's shared documents in the vector store and, unless keep_uploads, removes its upload directory."""
+    if not keep_uploads:
+        shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+    vector_store = get_shared_vector_store()
+    if vector_store is not None:
+        remove_proposals(list(proposal_ids), vector_store, namespace=job_id)
+
+def run_pipeline(rfp_path: str, proposals_paths: Dict[str, str], rfp_page_number: int, job_id: str, output_dir: str, file_hashes: Optional[Dict[str, str]] = None, proposal_names: Optional[Dict[str, str]] = None, resume: bool = False, progress_callback=None) -> Optional[Dict[str, Any]]:
+    """
+    Runs main() in the job's own output directory and vector namespace and
+    packs its output into the API result payload; None on failure. With
+    resume=True, main() continues from the checkpoint in output_dir.
+    """
+    result = None
+    run_status = None
     try:
-        # Save uploaded files
-        rfp_path = os.path.join(DATA_DIR, "rfp.pdf")
-        proposal1_path = os.path.join(DATA_DIR, "proposal1.pdf")
-        proposal2_path = os.path.join(DATA_DIR, "proposal2.pdf")
-
-        # Build paths dict for this request
-        proposals_paths = {
-            "Prop_1": proposal1_path,
-            "Prop_2": proposal2_path
-        }
-        
-        # Write files to disk
-        for file, path in [(rfp_file, rfp_path), (proposal1_file, proposal1_path), (proposal2_file, proposal2_path)]:
-            content = await file.read()
-            with open(path, "wb") as f:
-                f.write(content)
-        
-        # Run the full evaluation pipeline with request-specific params
         result = main(
             rfp_path=rfp_path,
             proposals_paths=proposals_paths,
-            rfp_page_number=rfp_page_number
+            rfp_page_number=rfp_page_number,
+            progress_callback=progress_callback,
+            output_dir=output_dir,
+            namespace=job_id,
+            file_hashes=file_hashes,
+            vector_store=get_shared_vector_store(),
+            resume=resume
         )
+    finally:
+        run_status = RunCheckpoint(output_dir).manifest.get("status")
+        if JOB_CLEANUP:
+            try:
+                cleanup_job(job_id, proposals_paths.keys(), keep_uploads=run_status != "succeeded")
+            except Exception as e:
+                print(f"⚠️ Cleanup of job {job_id} failed: {e}")
+    if result is None:
+        return None
 
-        if result is None:
-            raise HTTPException(status_code=500, detail="Evaluation pipeline failed or returned no results.")
-        
-        df, output_path = result
-        if df is None or df.empty:
-            raise HTTPException(status_code=500, detail="Evaluation pipeline produced no results.")
+    df, output_path = result
+    if df is None or df.empty:
+        return None
 
-        # Extract output directory from output_path
-        output_dir = os.path.dirname(output_path)
+    # Extract output directory from output_path
+    output_dir = os.path.dirname(output_path)
 
-        # Attempt to load raw_results.json for UI references
-        raw_results_path = os.path.join(output_dir, "raw_results.json")
+    # Attempt to load raw_results.json for UI references
+    raw_results_path = os.path.join(output_dir, "raw_results.json")
+    raw_results = []
+    try:
+        if os.path.exists(raw_results_path):
+            with open(raw_results_path, "r", encoding="utf-8") as jf:
+                raw_results = json.load(jf)
+    except Exception as _:
         raw_results = []
-        try:
-            if os.path.exists(raw_results_path):
-                import json as _json
-                with open(raw_results_path, "r", encoding="utf-8") as jf:
-                    raw_results = _json.load(jf)
-        except Exception as _:
-            raw_results = []
-
-        # Convert DataFrame to JSON for API response
-        return JSONResponse(content={
-            "status": "success",
-            "output_directory": output_dir,
-            "output_path": output_path,
-            "results": df.to_dict(orient="records"),
-            "raw_results": raw_results
-        })
 
+    return {
+        "status": "success",
+        # "incomplete" when some criteria could not be scored; POST /jobs/{id}/resume finishes them
+        "run_status": run_status,
+        "output_directory": output_dir,
+        "output_path": output_path,
+        "proposals": proposal_names or {p_id: os.path.basename(path) for p_id, path in proposals_paths.items()},
+        "results": df.to_dict(orient="records"),
+        "raw_results": raw_results
+    }
+
+def _collect_proposal_files(files: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Returns the uploaded proposals in order: the repeated proposal_files field,
+    or the legacy proposal1_file/proposal2_file pair.
+    """
+    proposals = [upload for field in PROPOSAL_FIELDS for upload in files.get(field, [])]
+    if not proposals:
+        raise HTTPException(status_code=422, detail="Upload at least one proposal PDF (proposal_files).")
+    return proposals
+
+def _page_number_field(fields: Dict[str, str]) -> int:
+    try:
+        return int(fields["rfp_page_number"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=422, detail="rfp_page_number must be an integer.")
+
+async def _submit_job(request: Request) -> Job:
+    """Streams the uploads into a fresh job directory and queues the pipeline."""
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    output_dir = os.path.join(OUTPUT_BASE_DIR, f"{timestamp}_{job_id}")
+
+    try:
+        fields, files = await receive_uploads(request, job_dir)
+        if not files.get("rfp_file"):
+            raise HTTPException(status_code=422, detail="Upload the RFP PDF (rfp_file).")
+        rfp_path = files["rfp_file"][0]["path"]
+        rfp_page_number = _page_number_field(fields)
+        proposal_files = _collect_proposal_files(files)
+
+        # Prop_1 .. Prop_N in upload order; the hashes computed while receiving spare ingestion a re-read
+        proposals_paths = {}
+        proposal_names = {}
+        file_hashes = {}
+        for i, upload in enumerate(proposal_files, start=1):
+            prop_id = f"Prop_{i}"
+            proposals_paths[prop_id] = os.path.join(job_dir, f"proposal{i}.pdf")
+            os.replace(upload["path"], proposals_paths[prop_id])
+            proposal_names[prop_id] = upload["filename"]
+            file_hashes[prop_id] = upload["sha256"]
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    return job_manager.submit(
+        run_pipeline,
+        {
+            "rfp_path": rfp_path,
+            "proposals_paths": proposals_paths,
+            "rfp_page_number": rfp_page_number,
+            "job_id": job_id,
+            "output_dir": output_dir,
+            "file_hashes": file_hashes,
+            "proposal_names": proposal_names
+        },
+        job_id=job_id
+    )
+
+def _load_job_params(job_id: str) -> Optional[Dict[str, Any]]:
+    """Rebuilds a job's parameters from its run checkpoint, e.g. after a server restart."""
+    for output_dir in sorted(glob.glob(os.path.join(OUTPUT_BASE_DIR, f"*_{job_id}")), reverse=True):
+        if RunCheckpoint.exists(output_dir):
+            params = RunCheckpoint(output_dir).params
+            return {
+                "rfp_path": params["rfp_path"],
+                "proposals_paths": params["proposals_paths"],
+                "rfp_page_number": params["rfp_page_number"],
+                "job_id": job_id,
+                "output_dir": output_dir,
+                "file_hashes": params.get("file_hashes"),
+                "proposal_names": None
+            }
+    return None
+
+def _job_links(job: Job) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "proposals": job.params["proposal_names"] or {p_id: os.path.basename(path) for p_id, path in job.params["proposals_paths"].items()},
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "result_url": f"/jobs/{job.id}/result"
+    }
+
+def _get_job_or_404(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+@app.post("/jobs", status_code=202, openapi_extra=UPLOAD_FORM_SCHEMA)
+async def create_job(request: Request):
+    """
+    Queues an evaluation and returns its job id immediately. Proposals are
+    sent as a repeated proposal_files field (Prop_1 .. Prop_N in order);
+    proposal1_file/proposal2_file are still accepted.
+    """
+    job = await _submit_job(request)
+    return _job_links(job)
+
+@app.post("/jobs/{job_id}/resume", status_code=202)
+async def resume_job(job_id: str):
+    """
+    Re-queues a failed or incomplete job under the same id. It continues
+    from its run checkpoint: the rubric and every criterion already scored
+    are reused, so only the remaining work is done. The event log starts over.
+    """
+    job = job_manager.get(job_id)
+    if job is not None:
+        if job.status in ("queued", "running"):
+            raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}.")
+        params = dict(job.params)
+    else:
+        params = _load_job_params(job_id)
+        if params is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+
+    if not RunCheckpoint.exists(params["output_dir"]):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has no checkpoint to resume from.")
+    if RunCheckpoint(params["output_dir"]).manifest.get("status") == "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already finished every criterion.")
+    missing = [path for path in [params["rfp_path"], *params["proposals_paths"].values()] if not os.path.exists(path)]
+    if missing:
+        raise HTTPException(status_code=409, detail=f"Uploads of job {job_id} are no longer available; submit it again.")
+
+    # Resuming restarts the job's upload TTL (see sweep_job_uploads)
+    if os.path.isdir(os.path.join(JOBS_DIR, job_id)):
+        os.utime(os.path.join(JOBS_DIR, job_id))
+    job = job_manager.submit(run_pipeline, {**params, "resume": True}, job_id=job_id)
+    return _job_links(job)
+
+@app.get("/jobs")
+async def list_jobs():
+    """Lists known jobs (most recent first) with their status and stage progress."""
+    jobs = sorted(job_manager.list(), key=lambda j: j.created_at, reverse=True)
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the job's status and per-stage progress."""
+    return _get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, after: int = 0, last_event_id: Optional[str] = Header(None)):
+    """
+    Streams the job's events as Server-Sent Events: stage changes, progress
+    and each criterion's scored rows as soon as it is done. Starts from the
+    first event (or after Last-Event-ID / ?after= when reconnecting) and
+    closes once the job has succeeded or failed.
+    """
+    job = _get_job_or_404(job_id)
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def event_stream():
+        seq = after
+        while True:
+            # Waiting happens on a worker thread so the event loop stays free
+            events = await asyncio.to_thread(job_manager.wait_for_events, job, seq, SSE_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                seq = event["seq"]
+                yield f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+                if event["type"] == "job" and event["status"] in ("succeeded", "failed"):
+                    return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Returns the evaluation results; 409 while the job is still queued or running."""
+    job = _get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"An error occurred during evaluation: {job.error}")
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job {job.id} is {job.status}.")
+    return JSONResponse(content=job.result)
+
+@app.get("/health")
+async def health():
+    vector_store = _vector_store
+    healthy = vector_store is not None and await asyncio.to_thread(vector_store.health_check)
+    return {
+        "status": "ok" if healthy else "degraded",
+        "vector_store": {"backend": vector_store.name if vector_store else None, "healthy": healthy},
+        "workers": job_manager.workers,
+        "active_jobs": job_manager.active_count()
+    }
+
+@app.post("/upload_and_evaluate/", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_and_evaluate(request: Request):
+    """
+    Handles file uploads and waits for the evaluation to finish. The pipeline
+    runs as a background job, so the event loop keeps serving other requests.
+    """
+    job = await _submit_job(request)
+    try:
+        await asyncio.wrap_future(job.future)
     except Exception as e:
-        # Clean up files in case of error (optional but recommended)
-        # os.remove(rfp_path)
-        # os.remove(proposal1_path)
-        # os.remove(proposal2_path)
         raise HTTPException(status_code=500, detail=f"An error occurred during evaluation: {str(e)}")
 
-# To run FastAPI: uvicorn fast_api_app:app --reload
\ No newline at end of file
+    if job.status != "succeeded":
+        raise HTTPException(status_code=500, detail=job.error or "Evaluation pipeline failed or returned no results.")
+
+    # Convert DataFrame to JSON for API response
+    return JSONResponse(content={"job_id": job.id, **job.result})
+
+# To run FastAPI: uvicorn fast_api_app:app --reload
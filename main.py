@@ -1,14 +1,18 @@
 import os
-import fitz 
-import pandas as pd
+import queue
+import threading
 from datetime import datetime
+from typing import Any, Callable, Dict, Optional
 from dotenv import load_dotenv
 
 # Import modules
-from modules.proposal_ingestor import initialize_milvus, ingest_proposal
-from modules.kimi_client import extract_table_from_kimi
-from modules.evaluator import run_evaluation_loop
-from modules.utils import extract_text_from_pdf_page, extract_criteria_from_rubric 
+from modules.proposal_ingestor import ingest_proposals
+from modules.vector_store import initialize_vector_store, VectorStore, VECTOR_BACKEND
+from modules.kimi_client import extract_table_from_kimi, stream_table_from_kimi, KIMI_STREAMING
+from modules.utils import extract_text_from_pdf_page, extract_criteria_from_rubric, iter_rubric_rows
+from modules.embedding_cache import get_embedding_cache
+from modules.llm_cache import get_llm_cache
+from modules.checkpoint import RunCheckpoint
 
 load_dotenv()
 
@@ -21,69 +25,193 @@ PROPOSALS_PATHS = {
 RFP_PAGE_NUMBER = 5 # Default page number
 OUTPUT_BASE_DIR = "outputs"
 
-def main(rfp_path: str = RFP_PATH, proposals_paths: dict = PROPOSALS_PATHS, rfp_page_number: int = RFP_PAGE_NUMBER):
+def _stream_rubric(rfp_text: str, rubric_file_path: str, report: Callable[[str, str], None]):
+    """
+    Generates the rubric on a background thread while the caller goes on
+    (e.g. ingesting proposals). Returns (rows, thread, result): rows yields
+    (index, row) pairs as soon as Kimi finishes each table row and ends with
+    the stream; result holds the number of rows and whether the table was
+    completed, in which case the raw markdown has been saved.
+    """
+    rows_queue: "queue.Queue" = queue.Queue()
+    end = object()
+    result = {"count": 0, "ok": False}
+
+    def produce():
+        parts = []
+
+        def chunks():
+            for chunk in stream_table_from_kimi(rfp_text):
+                parts.append(chunk)
+                yield chunk
+
+        try:
+            for item in iter_rubric_rows(chunks()):
+                result["count"] += 1
+                rows_queue.put(item)
+            if not result["count"]:
+                raise ValueError("no criteria found in the rubric table")
+            # Save the raw rubric for review/debugging
+            with open(rubric_file_path, "w", encoding="utf-8") as f:
+                f.write("".join(parts))
+            print(f"✅ Kimi Rubric saved to: {rubric_file_path} ({result['count']} sub-criteria)")
+            result["ok"] = True
+            report("rubric", "finished")
+        except Exception as e:
+            print(f"🔴 ERROR: Kimi failed to generate the evaluation rubric: {e}")
+            report("rubric", "failed")
+        finally:
+            rows_queue.put(end)
+
+    def rows():
+        while True:
+            item = rows_queue.get()
+            if item is end:
+                return
+            yield item
+
+    thread = threading.Thread(target=produce, name="rubric-stream", daemon=True)
+    thread.start()
+    return rows(), thread, result
+
+def main(rfp_path: str = RFP_PATH, proposals_paths: dict = PROPOSALS_PATHS, rfp_page_number: int = RFP_PAGE_NUMBER, progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None, output_dir: Optional[str] = None, namespace: Optional[str] = None, file_hashes: Optional[Dict[str, str]] = None, vector_store: Optional[VectorStore] = None, resume: bool = False):
+    """
+    Runs the full pipeline: rubric, ingestion, evaluation and output (see
+    FLOW_EXPLANATION.md). With resume=True, continues the run in output_dir.
+    """
+    # pandas (via the evaluator) is only needed once a run starts; keep importing main cheap
+    from modules.evaluator import run_evaluation_loop
+
     # Create timestamped output directory for this run
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, timestamp)
+    if output_dir is None:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_dir = os.path.join(OUTPUT_BASE_DIR, timestamp)
+    OUTPUT_DIR = output_dir
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    print(f"📁 Output directory created: {OUTPUT_DIR}")
+    print(f"📁 Output directory {'resumed' if resume else 'created'}: {OUTPUT_DIR}")
+
+    checkpoint = RunCheckpoint(OUTPUT_DIR)
+    checkpoint.start({
+        "rfp_path": rfp_path,
+        "proposals_paths": dict(proposals_paths),
+        "rfp_page_number": rfp_page_number,
+        "namespace": namespace,
+        "file_hashes": file_hashes,
+    }, resume=resume)
+    resume_stages = {stage for stage in ("rubric", "ingestion") if resume and checkpoint.stage_finished(stage)}
+
+    def report(stage: str, status: str, **details):
+        checkpoint.mark_stage(stage, status)
+        if progress_callback is not None:
+            progress_callback({"type": "stage", "stage": stage, "status": status, **details})
     
     # --------------------------------
     # 1. RFP Rubric Creation (Your existing, slightly refactored logic)
     # --------------------------------
     print("\n\n--- Step 1: RFP Rubric Creation ---")
-    
-    # 1a. Extract text from RFP page
-    rfp_text = extract_text_from_pdf_page(rfp_path, rfp_page_number)
-    if not rfp_text:
-        print("🔴 ERROR: Failed to extract RFP text. Exiting.")
-        return
+    report("rubric", "started")
+    rubric_file_path = os.path.join(OUTPUT_DIR, "rfp_rubric_raw.md")
+    rubric_markdown = None
+    rubric_rows = None
 
-    # 1b. Send to Kimi for rubric generation
-    print("🔍 Sending RFP text to Kimi to generate the Evaluation Rubric...")
-    rubric_markdown = extract_table_from_kimi(rfp_text)
-    
-    if not rubric_markdown:
-        print("🔴 ERROR: Kimi failed to generate the evaluation rubric. Exiting.")
-        return
+    if "rubric" in resume_stages and os.path.exists(rubric_file_path):
+        # Resumed run: the criteria must match the scores already checkpointed
+        with open(rubric_file_path, "r", encoding="utf-8") as f:
+            rubric_markdown = f.read()
+        print(f"♻️ Reusing the rubric from {rubric_file_path}")
+    else:
+        # 1a. Extract text from RFP page
+        rfp_text = extract_text_from_pdf_page(rfp_path, rfp_page_number)
+        if not rfp_text:
+            print("🔴 ERROR: Failed to extract RFP text. Exiting.")
+            report("rubric", "failed")
+            return
 
-    # Save the raw rubric for review/debugging
-    rubric_file_path = os.path.join(OUTPUT_DIR, "rfp_rubric_raw.md")
-    with open(rubric_file_path, "w", encoding="utf-8") as f:
-        f.write(rubric_markdown)
-    print(f"✅ Kimi Rubric saved to: {rubric_file_path}")
+        # 1b. Send to Kimi for rubric generation
+        print("🔍 Sending RFP text to Kimi to generate the Evaluation Rubric...")
+        if KIMI_STREAMING:
+            # Rows are parsed as they stream; ingestion runs meanwhile
+            rubric_rows, rubric_thread, rubric_result = _stream_rubric(rfp_text, rubric_file_path, report)
+        else:
+            rubric_markdown = extract_table_from_kimi(rfp_text)
+
+            if not rubric_markdown:
+                print("🔴 ERROR: Kimi failed to generate the evaluation rubric. Exiting.")
+                report("rubric", "failed")
+                return
+
+            # Save the raw rubric for review/debugging
+            with open(rubric_file_path, "w", encoding="utf-8") as f:
+                f.write(rubric_markdown)
+            print(f"✅ Kimi Rubric saved to: {rubric_file_path}")
 
     # 1c. Parse the markdown table into a DataFrame for the evaluation loop
-    rubric_df = extract_criteria_from_rubric(rubric_markdown)
-    if rubric_df.empty:
-        print("🔴 ERROR: Failed to parse the rubric into a DataFrame. Exiting.")
-        return
-    print(f"✅ Parsed {len(rubric_df)} sub-criteria for evaluation.")
+    rubric_df = None
+    if rubric_rows is None:
+        rubric_df = extract_criteria_from_rubric(rubric_markdown)
+        if rubric_df.empty:
+            print("🔴 ERROR: Failed to parse the rubric into a DataFrame. Exiting.")
+            report("rubric", "failed")
+            return
+        print(f"✅ Parsed {len(rubric_df)} sub-criteria for evaluation.")
+        report("rubric", "finished")
 
 
     # --------------------------------
     # 2. Proposal Ingestion (Chunk, Embed, Store)
     # --------------------------------
-    print("\n\n--- Step 2: Proposal Ingestion into Zilliz Cloud ---")
-    milvus_collection = initialize_milvus()
-    if milvus_collection is None:
-        print("🔴 ERROR: Milvus initialization failed. Cannot ingest.")
+    print(f"\n\n--- Step 2: Proposal Ingestion into the {VECTOR_BACKEND} vector store ---")
+    report("ingestion", "started")
+    if vector_store is None:
+        vector_store = initialize_vector_store()
+    if vector_store is None:
+        print("🔴 ERROR: Vector store initialization failed. Cannot ingest.")
+        report("ingestion", "failed")
         return
 
-    for prop_id, prop_path in proposals_paths.items():
-        ingest_proposal(prop_path, prop_id, milvus_collection)
+    # Proposals are extracted and ingested concurrently. A resumed run whose
+    # ingestion was cut short re-ingests, as partly stored documents look unchanged
+    force = resume and "ingestion" not in resume_stages
+    failed = ingest_proposals(proposals_paths, vector_store, force=force, progress_callback=progress_callback, namespace=namespace, file_hashes=file_hashes)
+    if failed:
+        # Scoring them on empty context would give silent zeros; resuming retries their ingestion
+        print(f"🔴 ERROR: Ingestion failed for {', '.join(failed)}. Exiting.")
+        vector_store.finalize()
+        report("ingestion", "failed", failed_proposals=failed)
+        return
+
+    # Flush/persist and size the index to the number of chunks now stored
+    vector_store.finalize()
+    report("ingestion", "finished")
 
     
     # --------------------------------
     # 3. RAG-Based Evaluation Loop
     # --------------------------------
     print("\n\n--- Step 3: Running RAG Evaluation Loop ---")
+    report("evaluation", "started")
     
-    final_scores_df = run_evaluation_loop(rubric_df, num_proposals=len(proposals_paths), output_dir=OUTPUT_DIR)
-    
+    final_scores_df = run_evaluation_loop(rubric_df, num_proposals=len(proposals_paths), output_dir=OUTPUT_DIR, vector_store=vector_store, progress_callback=progress_callback, namespace=namespace, proposal_ids=list(proposals_paths), checkpoint=checkpoint, rubric_rows=rubric_rows)
+
+    if rubric_rows is not None:
+        rubric_thread.join()
+        if not rubric_result["ok"]:
+            # Criteria scored before the stream broke off stay checkpointed
+            print("🔴 ERROR: The rubric stream did not complete. Exiting.")
+            report("evaluation", "failed")
+            return
+    criteria_count = len(rubric_df) if rubric_df is not None else rubric_result["count"]
+
     if final_scores_df.empty:
         print("🔴 WARNING: No final scores were generated.")
+        report("evaluation", "failed")
         return
+    report("evaluation", "finished")
+    # Criteria that errored out (e.g. rate limits) are missing from the checkpoint
+    unscored = criteria_count - len(checkpoint.completed_criteria())
+    if unscored > 0:
+        print(f"🔴 WARNING: {unscored} of {criteria_count} criteria were not scored for every proposal. "
+              f"Resume with: python main.py --resume {OUTPUT_DIR}")
     # Also save raw, long-form results for downstream UIs (includes References_File paths)
     try:
         raw_csv_path = os.path.join(OUTPUT_DIR, "raw_results.csv")
@@ -101,6 +229,7 @@ def main(rfp_path: str = RFP_PATH, proposals_paths: dict = PROPOSALS_PATHS, rfp_
     # 4. Final Output and Presentation
     # --------------------------------
     print("\n\n--- Step 4: Final Output ---")
+    report("output", "started")
     
     # Pivot the table for the final user-facing format (robust to missing columns)
     value_candidates = ['Score (0-5)', 'Reasoning (Arabic)', 'Reasoning (English)']
@@ -146,9 +275,46 @@ def main(rfp_path: str = RFP_PATH, proposals_paths: dict = PROPOSALS_PATHS, rfp_
     print(f"   - Rubric: {os.path.join(OUTPUT_DIR, 'rfp_rubric_raw.md')}")
     print(f"   - Excel Results: {output_path}")
     print(f"   - Kimi Scores: {os.path.join(OUTPUT_DIR, 'kimi_scores')}")
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        stats = embedding_cache.stats()
+        print(f"   - Embedding cache: {stats['hits']} hits / {stats['misses']} misses ({stats['entries']} entries)")
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        print(f"   - Kimi response cache: {stats['hits']} hits / {stats['misses']} misses ({stats['entries']} entries)")
+    report("output", "finished")
+    checkpoint.finish("incomplete" if unscored > 0 else "succeeded")
     return pivot_df, output_path
 
+def resume_run(output_dir: str, progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None, vector_store: Optional[VectorStore] = None):
+    """
+    Continues an interrupted or failed run from the checkpoint in its output
+    directory, with the parameters it was started with. Returns what main()
+    returns, or None when there is no checkpoint to resume.
+    """
+    if not RunCheckpoint.exists(output_dir):
+        print(f"🔴 ERROR: No run checkpoint found in {output_dir}.")
+        return None
+    params = RunCheckpoint(output_dir).params
+    print(f"♻️ Resuming run in {output_dir}...")
+    return main(
+        **params,
+        progress_callback=progress_callback,
+        output_dir=output_dir,
+        vector_store=vector_store,
+        resume=True
+    )
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Runs the RFP proposal evaluation pipeline.")
+    parser.add_argument("--resume", metavar="OUTPUT_DIR", help="continue an interrupted run from its output directory")
+    args = parser.parse_args()
+    if args.resume:
+        resume_run(args.resume)
+        raise SystemExit
+
     # Ensure placeholder data files exist for the demo to run without error
     for f in [RFP_PATH] + list(PROPOSALS_PATHS.values()):
         if not os.path.exists(f):
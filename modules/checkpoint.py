@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+# Files kept in a run's output directory so an interrupted run can be resumed
+RUN_MANIFEST = "run.json"
+SCORES_LOG = "scores.jsonl"
+
+def criterion_key(index, main_criterion: str, sub_criterion: str) -> str:
+    """Identifies a rubric row across runs of the same rubric."""
+    return f"{index}:{main_criterion} - {sub_criterion}"
+
+class RunCheckpoint:
+    """
+    Durable progress of one run in its output directory: run.json holds the
+    run parameters and the status of each stage, scores.jsonl one line per
+    fully scored criterion. Both are written as each unit completes (the
+    manifest is replaced atomically, log lines are flushed and fsynced), so a
+    crashed or failed run can pick up where it stopped.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, RUN_MANIFEST)
+        self.scores_path = os.path.join(output_dir, SCORES_LOG)
+        self._lock = threading.Lock()
+        self.manifest: Dict[str, Any] = self._load_manifest() or {}
+
+    @staticmethod
+    def exists(output_dir: str) -> bool:
+        return os.path.exists(os.path.join(output_dir, RUN_MANIFEST))
+
+    def _load_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Unreadable run manifest {self.manifest_path}: {e}")
+            return None
+
+    def _write_manifest(self):
+        self.manifest["updated_at"] = time.time()
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.manifest.get("params", {})
+
+    def start(self, params: Dict[str, Any], resume: bool = False):
+        """Records the run parameters; on resume, keeps the stages already finished."""
+        with self._lock:
+            if resume and self.manifest:
+                self.manifest["resumes"] = self.manifest.get("resumes", 0) + 1
+            else:
+                self.manifest = {"params": params, "stages": {}, "created_at": time.time(), "resumes": 0}
+                # A fresh run must not pick up scores left by an earlier run in this folder
+                if os.path.exists(self.scores_path):
+                    os.remove(self.scores_path)
+            self.manifest["status"] = "running"
+            self._write_manifest()
+
+    def mark_stage(self, stage: str, status: str):
+        with self._lock:
+            self.manifest.setdefault("stages", {})[stage] = {"status": status, "time": time.time()}
+            if status == "failed":
+                self.manifest["status"] = "failed"
+            self._write_manifest()
+
+    def stage_finished(self, stage: str) -> bool:
+        return self.manifest.get("stages", {}).get(stage, {}).get("status") == "finished"
+
+    def finish(self, status: str = "succeeded"):
+        with self._lock:
+            self.manifest["status"] = status
+            self._write_manifest()
+
+    def record_criterion(self, key: str, rows: List[Dict[str, Any]]):
+        """Appends one scored criterion to the scores log and syncs it to disk."""
+        line = json.dumps({"key": key, "rows": rows, "time": time.time()}, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.scores_path, "a+b") as f:
+                # Start a new line after a torn last line, or this record would be joined onto it
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write((line + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def completed_criteria(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Returns the scored rows of every criterion in the log; a torn last line is ignored."""
+        completed: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            with open(self.scores_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    completed[entry["key"]] = entry["rows"]
+        except FileNotFoundError:
+            pass
+        return completed
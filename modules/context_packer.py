@@ -0,0 +1,99 @@
+import os
+from typing import Any, Dict, List
+
+from .utils import estimate_tokens
+
+# Retrieved context sent to Kimi per proposal, in estimated tokens (see estimate_tokens)
+CONTEXT_TOKENS_PER_PROPOSAL = int(os.getenv("CONTEXT_TOKENS_PER_PROPOSAL", "1500"))
+CONTEXT_MIN_PARTIAL_TOKENS = 64   # a chunk that doesn't fit is cut to the remaining budget only if this much is left
+CONTEXT_MIN_OVERLAP_WORDS = 6     # shorter shared runs between chunks are left alone
+CONTEXT_MAX_OVERLAP_WORDS = 200   # longest run checked; chunker overlap is far below this
+CONTEXT_SEPARATOR = "\n---\n"
+
+def _overlap_words(left: List[str], right: List[str]) -> int:
+    """Returns how many trailing words of left repeat as the leading words of right."""
+    longest = min(len(left), len(right), CONTEXT_MAX_OVERLAP_WORDS)
+    for n in range(longest, CONTEXT_MIN_OVERLAP_WORDS - 1, -1):
+        if left[-n:] == right[:n]:
+            return n
+    return 0
+
+def _trim_overlap(words: List[str], packed_words: List[List[str]]) -> List[str]:
+    """
+    Drops the words a chunk shares with chunks already packed: a prefix that
+    continues an earlier chunk's tail, or a tail that leads into an earlier
+    chunk's start (the chunker repeats trailing sentences between neighbours).
+    """
+    for other in packed_words:
+        n = _overlap_words(other, words)
+        if n:
+            words = words[n:]
+        n = _overlap_words(words, other)
+        if n:
+            words = words[:-n]
+        if not words:
+            break
+    return words
+
+def _truncate_words(words: List[str], max_tokens: int) -> List[str]:
+    """Keeps the leading words of a chunk that fit in max_tokens."""
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return words[:low]
+
+def pack_context(chunks: List[Dict[str, Any]], budget_tokens: int = CONTEXT_TOKENS_PER_PROPOSAL) -> Dict[str, Any]:
+    """
+    Packs retrieved chunks (most relevant first) into one context string that
+    fits budget_tokens. Overlap with chunks already packed is trimmed, chunks
+    that no longer fit are skipped in favour of smaller, less relevant ones,
+    and a chunk is cut short only to fill a sizeable remainder.
+
+    Returns the context dict used by the evaluator ({"text", "chunks"}) plus
+    "tokens", "dropped" (chunks left out) and "trimmed_tokens" (overlap removed).
+    """
+    separator_tokens = estimate_tokens(CONTEXT_SEPARATOR)
+    packed: List[Dict[str, Any]] = []
+    packed_words: List[List[str]] = []
+    used = 0
+    trimmed_tokens = 0
+    dropped = 0
+
+    for chunk in chunks:
+        words = (chunk.get("text") or "").split()
+        kept = _trim_overlap(words, packed_words)
+        if not kept:
+            dropped += 1
+            continue
+        if len(kept) < len(words):
+            trimmed_tokens += estimate_tokens(" ".join(words)) - estimate_tokens(" ".join(kept))
+
+        remaining = budget_tokens - used - (separator_tokens if packed else 0)
+        text = " ".join(kept)
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if remaining < CONTEXT_MIN_PARTIAL_TOKENS:
+                dropped += 1
+                continue
+            kept = _truncate_words(kept, remaining)
+            if not kept:
+                dropped += 1
+                continue
+            text = " ".join(kept)
+            tokens = estimate_tokens(text)
+
+        packed.append({**chunk, "text": text})
+        packed_words.append(kept)
+        used += tokens + (separator_tokens if len(packed) > 1 else 0)
+
+    return {
+        "text": CONTEXT_SEPARATOR.join(c["text"] for c in packed),
+        "chunks": packed,
+        "tokens": used,
+        "dropped": dropped,
+        "trimmed_tokens": trimmed_tokens,
+    }
@@ -0,0 +1,184 @@
+import os
+import re
+import hashlib
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+# Page furniture (running headers/footers) detection
+FURNITURE_EDGE_LINES = 3      # lines at the top and bottom of a page that can be furniture
+FURNITURE_MIN_PAGES = 3       # a line repeated on this many pages is furniture
+FURNITURE_WARMUP_PAGES = 8    # pages buffered to learn furniture before the first page is released
+FURNITURE_MIN_LETTERS = 3     # letters a repeated edge line needs to be furniture (bare page numbers aside)
+
+# Near-duplicate chunk detection (64-bit SimHash over word bigrams)
+SIMHASH_MAX_DISTANCE = 3      # Hamming distance at or below which chunks are duplicate candidates
+SIMHASH_BANDS = 4             # 4 x 16-bit bands: any pair within distance 3 shares a band
+SIMHASH_MIN_WORDS = 8         # shorter chunks are only deduped on exact normalized text
+
+DEDUP_ENABLED = os.getenv("DEDUP_CHUNKS", "1").lower() not in ("0", "false", "no")
+
+# (page_number, chunk_index) identifies a chunk within one document
+ChunkKey = Tuple[int, int]
+
+_DIGITS = re.compile(r"\d+")
+_WORD = re.compile(r"\w+", re.UNICODE)
+_LETTER = re.compile(r"[^\W\d_]", re.UNICODE)
+# A normalized line holding nothing but a page number, e.g. "#", "- # -" or "#/#"
+_PAGE_NUMBER = re.compile(r"^[-–—|()\[\] ]*#( ?/ ?#)?[-–—|()\[\] ]*$")
+
+def _normalize_line(line: str) -> str:
+    """Lowercases, masks numbers and collapses spaces so 'Page 3 of 40' matches 'Page 4 of 40'."""
+    return " ".join(_DIGITS.sub("#", line.lower()).split())
+
+def _furniture_keys(line: str, page_num: int, outermost: bool) -> List[tuple]:
+    """
+    Keys under which an edge line is counted across pages. A line is furniture
+    when one of its keys reaches FURNITURE_MIN_PAGES: the same text repeated, or
+    the same text with a number that advances with the page (running page
+    numbers). Lines with fewer than FURNITURE_MIN_LETTERS letters never are,
+    except a bare page number on the first or last line, so figures such as
+    "Total 1,250" / "Total 3,400" or table-of-contents numbers are kept.
+    """
+    normalized = _normalize_line(line)
+    if not normalized:
+        return []
+    numbers = _DIGITS.findall(line)
+    # Offset between the printed number and the page; constant for page numbers
+    offset = int(numbers[0][:9]) - page_num if numbers else None
+    if _PAGE_NUMBER.match(normalized):
+        return [("page", normalized, offset)] if outermost else []
+    if len(_LETTER.findall(normalized)) < FURNITURE_MIN_LETTERS:
+        return []
+    keys = [("line", " ".join(line.lower().split()))]
+    if numbers:
+        keys.append(("running", normalized, offset))
+    return keys
+
+def _edge_keys(page_num: int, text: str) -> Dict[int, List[tuple]]:
+    """Furniture keys of the edge lines of a page, by line number."""
+    lines = text.split("\n")
+    non_empty = [i for i, ln in enumerate(lines) if ln.strip()]
+    edges = sorted(set(non_empty[:FURNITURE_EDGE_LINES] + non_empty[-FURNITURE_EDGE_LINES:]))
+    outermost = {non_empty[0], non_empty[-1]} if non_empty else set()
+    return {i: _furniture_keys(lines[i], page_num, i in outermost) for i in edges}
+
+def strip_page_furniture(pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+    """
+    Removes running headers/footers from a stream of (page_num, text) pages.
+
+    A line near the top or bottom of a page is furniture once it has appeared
+    at a page edge on FURNITURE_MIN_PAGES pages (see _furniture_keys). The first
+    FURNITURE_WARMUP_PAGES pages are buffered so furniture is already known
+    when they are released; later pages are filtered as they stream through.
+    """
+    counts: Counter = Counter()
+    buffer: deque = deque()
+    stripped_lines = 0
+
+    def clean(page_num: int, text: str) -> Tuple[int, str]:
+        nonlocal stripped_lines
+        edge_keys = _edge_keys(page_num, text)
+        kept = []
+        for i, ln in enumerate(text.split("\n")):
+            if any(counts[key] >= FURNITURE_MIN_PAGES for key in edge_keys.get(i, [])):
+                stripped_lines += 1
+                continue
+            kept.append(ln)
+        return page_num, "\n".join(kept).strip()
+
+    for page_num, text in pages:
+        counts.update({key for keys in _edge_keys(page_num, text or "").values() for key in keys})
+        buffer.append((page_num, text or ""))
+        if len(buffer) > FURNITURE_WARMUP_PAGES:
+            yield clean(*buffer.popleft())
+    while buffer:
+        yield clean(*buffer.popleft())
+
+    if stripped_lines:
+        print(f"  - 🧹 Stripped {stripped_lines} repeated header/footer lines.")
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the word bigrams of text."""
+    words = _WORD.findall(text.lower())
+    shingles = [" ".join(words[i:i + 2]) for i in range(max(1, len(words) - 1))]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+class ChunkDeduplicator:
+    """
+    Drops near-duplicate chunks from a chunk stream so each distinct chunk is
+    embedded once. Kept chunks carry page_refs: every page the content was
+    seen on.
+
+    Duplicates of a chunk that is still waiting to be embedded are merged into
+    its page_refs directly. Duplicates of a chunk that was already stored (see
+    mark_stored) are collected in late_refs, keyed by (page_number,
+    chunk_index), so the caller can update the store once ingestion finishes.
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.dropped = 0
+        self.late_refs: Dict[ChunkKey, List[int]] = {}
+        self._bands: List[Dict[int, List[Tuple[int, ChunkKey, Tuple[str, ...]]]]] = [{} for _ in range(SIMHASH_BANDS)]
+        self._exact: Dict[bytes, ChunkKey] = {}  # digest of normalized text -> chunk key
+        self._refs: Dict[ChunkKey, List[int]] = {}
+        self._pending: Set[ChunkKey] = set()
+
+    def _find(self, chunk: Dict[str, Any]):
+        """
+        Returns (key of the earlier duplicate or None, simhash, text digest,
+        numbers). A SimHash match only counts when both chunks contain the same
+        sequence of numbers, so clauses differing in amounts, days or
+        percentages are both kept.
+        """
+        words = _WORD.findall(chunk["text"].lower())
+        digest = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+        numbers = tuple(_DIGITS.findall(chunk["text"]))
+        if digest in self._exact:
+            return self._exact[digest], None, digest, numbers
+        if len(words) < SIMHASH_MIN_WORDS:
+            return None, None, digest, numbers
+        fingerprint = simhash(chunk["text"])
+        width = 64 // SIMHASH_BANDS
+        for b in range(SIMHASH_BANDS):
+            band = (fingerprint >> (b * width)) & ((1 << width) - 1)
+            for other, key, other_numbers in self._bands[b].get(band, []):
+                if other_numbers == numbers and bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return key, fingerprint, digest, numbers
+        return None, fingerprint, digest, numbers
+
+    def filter(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Yields only the first occurrence of each (near-)duplicate chunk."""
+        for chunk in chunks:
+            original, fingerprint, digest, numbers = self._find(chunk)
+            page = chunk["page_number"]
+            if original is not None:
+                self.dropped += 1
+                refs = self._refs[original]
+                if page not in refs:
+                    refs.append(page)
+                    if original not in self._pending:
+                        self.late_refs[original] = refs
+                continue
+
+            key = (chunk["page_number"], chunk["chunk_index"])
+            chunk["page_refs"] = [page]
+            self._refs[key] = chunk["page_refs"]
+            self._pending.add(key)
+            self._exact[digest] = key
+            if fingerprint is not None:
+                width = 64 // SIMHASH_BANDS
+                for b in range(SIMHASH_BANDS):
+                    band = (fingerprint >> (b * width)) & ((1 << width) - 1)
+                    self._bands[b].setdefault(band, []).append((fingerprint, key, numbers))
+            yield chunk
+
+    def mark_stored(self, chunks: List[Dict[str, Any]]):
+        """Records that chunks were written; later duplicates become late_refs."""
+        for chunk in chunks:
+            self._pending.discard((chunk["page_number"], chunk["chunk_index"]))
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+
+# Which shared documents are fully ingested and which job maps its proposals to them
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", os.path.join(".cache", "documents.json"))
+
+def shared_document_id(doc_hash: str) -> str:
+    """Id that namespaced proposals with identical content (and chunking) are stored under."""
+    return f"doc/{doc_hash}"
+
+class DocumentRegistry:
+    """
+    Reference-counted documents shared by namespaced runs (API jobs). Each
+    document is stored once under shared_document_id(doc_hash); a namespace
+    only keeps its {proposal id: stored id} mapping, and a document is
+    deleted when no namespace maps to it any more. A document is complete
+    once ingestion has finished, so chunks left by a crashed ingestion are
+    never taken for a finished document. Mutations of one document should
+    hold document_lock(stored id).
+    """
+
+    def __init__(self, path: Optional[str] = DOCUMENT_REGISTRY_PATH):
+        self.path = path or None
+        self._lock = threading.Lock()
+        self._document_locks: Dict[str, threading.Lock] = {}
+        self._data = {"documents": {}, "namespaces": {}}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except Exception as e:
+                print(f"⚠️ Unreadable document registry {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def document_lock(self, store_id: str) -> threading.Lock:
+        with self._lock:
+            return self._document_locks.setdefault(store_id, threading.Lock())
+
+    def is_complete(self, store_id: str) -> bool:
+        with self._lock:
+            return store_id in self._data["documents"]
+
+    def mark_complete(self, store_id: str, doc_hash: str):
+        with self._lock:
+            self._data["documents"][store_id] = {"doc_hash": doc_hash, "time": time.time()}
+            self._save()
+
+    def assign(self, namespace: str, proposal_id: str, store_id: str):
+        with self._lock:
+            self._data["namespaces"].setdefault(namespace, {})[proposal_id] = store_id
+            self._save()
+
+    def lookup(self, namespace: str, proposal_id: str) -> Optional[str]:
+        with self._lock:
+            return self._data["namespaces"].get(namespace, {}).get(proposal_id)
+
+    def mapped_documents(self, namespace: str) -> List[str]:
+        with self._lock:
+            return sorted(set(self._data["namespaces"].get(namespace, {}).values()))
+
+    def release(self, namespace: str, store_id: str) -> bool:
+        """Drops the namespace's references to store_id; True when no namespace references it any more."""
+        with self._lock:
+            mapping = self._data["namespaces"].get(namespace, {})
+            for proposal_id in [p for p, s in mapping.items() if s == store_id]:
+                del mapping[proposal_id]
+            if not mapping:
+                self._data["namespaces"].pop(namespace, None)
+            self._save()
+            return not any(store_id in m.values() for m in self._data["namespaces"].values())
+
+    def forget(self, store_id: str):
+        """Removes a deleted document."""
+        with self._lock:
+            self._data["documents"].pop(store_id, None)
+            self._save()
+
+_registry: Optional[DocumentRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_document_registry() -> DocumentRegistry:
+    """Returns the process-wide document registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DocumentRegistry()
+        return _registry
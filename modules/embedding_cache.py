@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+# On-disk cache for Jina embeddings, keyed by (model, sha256(text))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1 GiB of vectors
+EMBEDDING_CACHE_EVICT_TO = 0.9  # eviction frees down to this fraction of max_bytes, so it runs rarely
+EMBEDDING_CACHE_DISABLED = os.getenv("EMBEDDING_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+def text_hash(text: str) -> str:
+    """Returns the sha256 hex digest used as the content key for a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding store backed by SQLite.
+    Vectors are stored as float32 blobs; least recently used rows are
+    evicted once the total blob size exceeds max_bytes.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+        # Running size estimate; replaced rows are counted again, so it is recounted before evicting
+        self._total_bytes = self._size()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Bulk lookup; returns {text_hash: embedding} for the hashes that are cached."""
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), _LOOKUP_BATCH):
+                part = unique[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """Stores {text_hash: embedding} pairs and evicts old rows if over budget."""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for h, vector in items.items():
+            blob = array("f", vector).tobytes()  # float32, same layout as numpy's
+            rows.append((model, h, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, nbytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._total_bytes += sum(row[3] for row in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self):
+        """Deletes least recently used rows until the cache fits in EMBEDDING_CACHE_EVICT_TO of max_bytes."""
+        self._total_bytes = self._size()
+        if self._total_bytes <= self.max_bytes:
+            return
+        excess = self._total_bytes - int(self.max_bytes * EMBEDDING_CACHE_EVICT_TO)
+        freed = 0
+        victims = []
+        for model, h, nbytes in self._conn.execute(
+            "SELECT model, text_hash, nbytes FROM embeddings ORDER BY last_access ASC"
+        ):
+            victims.append((model, h))
+            freed += nbytes
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims)
+        self._total_bytes -= freed
+        print(f"🧹 Embedding cache evicted {len(victims)} entries ({freed / 1e6:.1f} MB).")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters for this process plus current cache size."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings"
+            ).fetchone()
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the process-wide embedding cache, or None when caching is disabled."""
+    global _cache
+    if EMBEDDING_CACHE_DISABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = EmbeddingCache()
+            except Exception as e:
+                print(f"⚠️ Embedding cache unavailable ({e}); continuing without it.")
+                return None
+        return _cache
@@ -1,225 +1,819 @@
 import pandas as pd
 import numpy as np
 import os
-from typing import Dict, List, Any
-from pymilvus import Collection, connections
+import re
+import json
+import math
+import threading
+from typing import Dict, Iterable, List, Any
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
-from .kimi_client import score_proposals_with_rag
-from .utils import EMBEDDING_DIM
+from .kimi_client import score_proposals, build_scoring_messages, score_criteria_batch, stream_criteria_batch, build_batch_scoring_messages, KIMI_STREAMING
+from .stream_parser import JsonItemStream
+from .utils import EMBEDDING_DIM, estimate_tokens
+from .context_packer import pack_context, CONTEXT_TOKENS_PER_PROPOSAL
+from .checkpoint import RunCheckpoint, criterion_key
+from .vector_store import VectorStore, get_vector_store, namespaced_id
+from .lexical_index import get_lexical_index, document_hash, reciprocal_rank_fusion
 
 load_dotenv()
 
 from .utils import get_jina_embeddings
 
-# Milvus/Zilliz Cloud Connection
-COLLECTION_NAME = "proposal_chunks"
+# Proposal ids searched when the caller doesn't pass its own
+DEFAULT_PROPOSAL_IDS = ["Prop_1", "Prop_2"]
 
-def get_milvus_collection() -> Collection:
-    """Connects and returns the loaded Milvus collection."""
-    try:
-        connections.connect(alias="default", uri=os.getenv("ZILLIZ_ENDPOINT"), token=os.getenv("ZILLIZ_TOKEN"), secure=True)
-        collection = Collection(COLLECTION_NAME)
-        collection.load()
-        return collection
-    except Exception as e:
-        print(f"❌ Failed to connect to or load Milvus collection: {e}")
-        return None
+# "hybrid": vector search fused with the BM25 lexical index (lexical alone if embedding fails);
+# "vector": embeddings only; "lexical": BM25 only, no Jina call per query (see _search_hits)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Hits taken from each ranking before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
 
-def retrieve_context(milvus_collection: Collection, criterion_text: str, k_chunks: int = 5) -> Dict[str, Any]:
-    """
-    Embeds the criterion and retrieves up to the top K relevant chunks per proposal.
-    Returns both concatenated context strings and chunk metadata for references.
-    """
-    print(f"  - ⏳ Embedding criterion: '{criterion_text[:50]}...'")
-    # 1. Embed the criterion
-    try:
-        embeddings = get_jina_embeddings([criterion_text], model="jina-embeddings-v2-base-en")
-        query_vector = embeddings[0]
-    except Exception as e:
-        print(f"  - ❌ Jina embedding failed: {e}")
-        return {
-            "Prop_1": {"text": "", "chunks": []},
-            "Prop_2": {"text": "", "chunks": []},
-        }
+# Number of criteria scored by Kimi in parallel
+SCORING_CONCURRENCY = int(os.getenv("SCORING_CONCURRENCY", "4"))
 
-    # 2. Search Milvus
-    print(f"  - ⏳ Searching Milvus for relevant chunks...")
-    search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
-    
-    # Search the entire collection
-    results = milvus_collection.search(
-        data=[query_vector], 
-        anns_field="embedding", 
-        param=search_params, 
-        # Retrieve more overall, then cap per proposal
-        limit=max(k_chunks * 6, 10),
-        output_fields=["proposal_id", "text_content", "page_number"]
-    )
+# Proposals scored together in one Kimi call: bounded by prompt size and by how many
+# bilingual reasoning rows one answer has to hold (see plan_scoring_groups)
+SCORING_MAX_PROMPT_TOKENS = int(os.getenv("SCORING_MAX_PROMPT_TOKENS", "24000"))
+SCORING_MAX_PROPOSALS_PER_CALL = int(os.getenv("SCORING_MAX_PROPOSALS_PER_CALL", "6"))
 
-    # 3. Aggregate hits by proposal and retain distance to rank
-    hits_by_proposal: Dict[str, List[Dict[str, Any]]] = {"Prop_1": [], "Prop_2": []}
-    
-    for hit in results[0]:
-        proposal_id = hit.entity.get('proposal_id')
-        text = hit.entity.get('text_content')
-        page_number = hit.entity.get('page_number')
-        distance = getattr(hit, "distance", None)  # for COSINE, lower is better
-        
-        if proposal_id in hits_by_proposal:
-            hits_by_proposal[proposal_id].append({
-                "proposal_id": proposal_id,
-                "page_number": int(page_number) if page_number is not None else None,
-                "text": text,
-                "distance": float(distance) if distance is not None else None
-            })
-    
-    # 4. For each proposal: sort by similarity, dedupe by text, cap at k_chunks
+# "json": several sub-criteria per Kimi call, answered as validated JSON;
+# "markdown": one criterion per call, answered as a markdown table
+SCORING_OUTPUT = os.getenv("SCORING_OUTPUT", "json").lower()
+SCORING_CRITERIA_PER_CALL = int(os.getenv("SCORING_CRITERIA_PER_CALL", "4"))
+
+def _empty_context(proposal_ids: List[str] = DEFAULT_PROPOSAL_IDS) -> Dict[str, Dict[str, Any]]:
+    return {p_id: pack_context([]) for p_id in proposal_ids}
+
+def _build_context_from_hits(hits_by_proposal: Dict[str, Any], k_chunks: int, budget_tokens: int = CONTEXT_TOKENS_PER_PROPOSAL) -> Dict[str, Dict[str, Any]]:
+    """
+    Converts the per-proposal vector store hits of one query into context dicts:
+    keeps the store's relevance order, dedupes by text, caps at k_chunks and
+    packs the chunks into budget_tokens per proposal (see pack_context).
+    """
     final_context: Dict[str, Dict[str, Any]] = {}
-    for p_id, items in hits_by_proposal.items():
-        # Sort by distance (None last)
-        items_sorted = sorted(
-            items,
-            key=lambda x: (x["distance"] is None, x["distance"] if x["distance"] is not None else 1e9)
-        )
+    for p_id, hits in hits_by_proposal.items():
         seen_texts = set()
         topk: List[Dict[str, Any]] = []
-        for it in items_sorted:
-            txt = it.get("text", "")
+        for hit in hits:
+            txt = hit.get('text') or ""
             if txt in seen_texts:
                 continue
             seen_texts.add(txt)
-            # Drop distance from public references (keep if needed for debugging)
-            topk.append({k: v for k, v in it.items() if k != "distance"})
+            page_number = hit.get('page_number')
+            page_end = hit.get('page_end')
+            topk.append({
+                "proposal_id": p_id,
+                "page_number": int(page_number) if page_number is not None else None,
+                "page_end": int(page_end) if page_end is not None else None,
+                "page_refs": hit.get('page_refs') or [],
+                "text": txt
+            })
             if len(topk) >= k_chunks:
                 break
-        final_context[p_id] = {
-            "text": "\n---\n".join([c["text"] for c in topk]),
-            "chunks": topk
+        final_context[p_id] = pack_context(topk, budget_tokens)
+    return final_context
+
+def _search_namespace(vector_store: VectorStore, query_vectors, proposal_ids: List[str], k_chunks: int, namespace: str = None):
+    """Searches the proposals' namespaced ids and keys the hits by the plain proposal ids."""
+    store_ids = [namespaced_id(p_id, namespace) for p_id in proposal_ids]
+    hits = vector_store.search(query_vectors, store_ids, k_chunks)
+    return [
+        {p_id: hits_by_proposal.get(store_id, []) for p_id, store_id in zip(proposal_ids, store_ids)}
+        for hits_by_proposal in hits
+    ]
+
+def _lexical_search(vector_store: VectorStore, criterion_texts: List[str], proposal_ids: List[str], k: int, namespace: str = None):
+    """
+    BM25 counterpart of _search_namespace over the proposals' lexical indexes.
+    Returns None when none of the proposals has an index; a proposal without
+    one gets no hits.
+    """
+    indexes = {}
+    for p_id in proposal_ids:
+        store_id = namespaced_id(p_id, namespace)
+        try:
+            doc_hash = document_hash(store_id, vector_store)
+        except Exception as e:
+            print(f"  - ⚠️ Could not look up the document of {store_id}: {e}")
+            doc_hash = None
+        indexes[p_id] = get_lexical_index(doc_hash) if doc_hash else None
+    if not any(indexes.values()):
+        return None
+    return [
+        {
+            p_id: [index.hit(row, p_id, score) for row, score in index.search(text, k)] if index is not None else []
+            for p_id, index in indexes.items()
         }
-    print(f"  - ✅ Retrieved context from Prop_1 and Prop_2.")
+        for text in criterion_texts
+    ]
+
+def _search_hits(vector_store: VectorStore, criterion_texts: List[str], proposal_ids: List[str], k_chunks: int, namespace: str = None, retrieval_mode: str = RETRIEVAL_MODE):
+    """
+    Returns {proposal id: hits} per criterion text for the retrieval mode:
+    "vector" embeds the criteria and searches the vector store; "lexical"
+    searches only the BM25 indexes built at ingestion (no embedding call);
+    "hybrid" does both and fuses the two rankings per proposal with
+    reciprocal_rank_fusion, falling back to the lexical hits alone when
+    embedding or the vector search fails. Raises when no search could run.
+    """
+    lexical = None
+    if retrieval_mode != "vector":
+        candidates = max(k_chunks, HYBRID_CANDIDATES)
+        lexical = _lexical_search(vector_store, criterion_texts, proposal_ids, candidates, namespace)
+        if lexical is None:
+            print("  - ⚠️ No lexical index for these proposals; using vector search only.")
+    if retrieval_mode == "lexical" and lexical is not None:
+        return lexical
+
+    try:
+        query_vectors = get_jina_embeddings(criterion_texts, model="jina-embeddings-v2-base-en")
+        hits = _search_namespace(vector_store, query_vectors, proposal_ids, candidates if lexical else k_chunks, namespace)
+    except Exception as e:
+        if lexical is None:
+            raise
+        print(f"  - ⚠️ Vector retrieval failed ({e}); using the lexical index only.")
+        return lexical
+    if lexical is None:
+        return hits
+    return [
+        {p_id: reciprocal_rank_fusion([vector_hits.get(p_id, []), lexical_hits.get(p_id, [])]) for p_id in proposal_ids}
+        for vector_hits, lexical_hits in zip(hits, lexical)
+    ]
+
+def retrieve_context(vector_store: VectorStore, criterion_text: str, k_chunks: int = 5, proposal_ids: List[str] = DEFAULT_PROPOSAL_IDS, namespace: str = None) -> Dict[str, Any]:
+    """
+    Retrieves the top K relevant chunks per proposal for the criterion (see
+    _search_hits for the RETRIEVAL_MODE used).
+    Returns both concatenated context strings and chunk metadata for references.
+    """
+    print(f"  - ⏳ Retrieving ({RETRIEVAL_MODE}) for criterion: '{criterion_text[:50]}...'")
+    try:
+        hits = _search_hits(vector_store, [criterion_text], proposal_ids, k_chunks, namespace)
+    except Exception as e:
+        print(f"  - ❌ Retrieval failed: {e}")
+        return _empty_context(proposal_ids)
+
+    final_context = _build_context_from_hits(hits[0], k_chunks)
+    print(f"  - ✅ Retrieved context from {', '.join(proposal_ids)}.")
     return final_context
 
-def run_evaluation_loop(rubric_df: pd.DataFrame, num_proposals: int, output_dir: str = "outputs") -> pd.DataFrame:
+def retrieve_contexts_batch(vector_store: VectorStore, criterion_texts: List[str], k_chunks: int = 5, proposal_ids: List[str] = DEFAULT_PROPOSAL_IDS, namespace: str = None) -> List[Dict[str, Any]]:
+    """
+    Batched variant of retrieve_context: embeds all criteria in one Jina call and
+    issues one vector store search with nq = len(criterion_texts) (BM25
+    searches are in-process, one per criterion and proposal). Returns
+    one context dict per criterion, in input order, built with the same rules.
+    """
+    if not criterion_texts:
+        return []
+
+    print(f"⏳ Retrieving context ({RETRIEVAL_MODE}) for {len(criterion_texts)} criteria in one batch...")
+    try:
+        hits = _search_hits(vector_store, criterion_texts, proposal_ids, k_chunks, namespace)
+    except Exception as e:
+        print(f"❌ Batch retrieval failed: {e}")
+        return [_empty_context(proposal_ids) for _ in criterion_texts]
+
+    contexts = [_build_context_from_hits(hits_by_proposal, k_chunks) for hits_by_proposal in hits]
+    print(f"✅ Retrieved context for {len(contexts)} criteria from {', '.join(proposal_ids)}.")
+    return contexts
+
+def plan_scoring_groups(context_tokens: Dict[str, int], fixed_tokens: int, max_prompt_tokens: int = SCORING_MAX_PROMPT_TOKENS, max_per_call: int = SCORING_MAX_PROPOSALS_PER_CALL) -> List[List[str]]:
+    """
+    Splits proposals (in order) into Kimi scoring calls. Each call's prompt,
+    fixed_tokens for criterion, rubric and instructions plus the proposals'
+    contexts, stays within max_prompt_tokens and holds at most max_per_call
+    proposals. Group sizes are balanced so concurrent calls finish at about the
+    same time; a proposal whose context alone exceeds the budget gets its own call.
+    """
+    proposal_ids = list(context_tokens)
+    if not proposal_ids:
+        return []
+    target = math.ceil(len(proposal_ids) / math.ceil(len(proposal_ids) / max(1, max_per_call)))
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = fixed_tokens
+    for p_id in proposal_ids:
+        tokens = context_tokens[p_id]
+        if current and (len(current) >= target or current_tokens + tokens > max_prompt_tokens):
+            groups.append(current)
+            current, current_tokens = [], fixed_tokens
+        current.append(p_id)
+        current_tokens += tokens
+    groups.append(current)
+    return groups
+
+def plan_criteria_batches(main_criteria: List[str], chunk_keys: List[set], max_per_call: int = SCORING_CRITERIA_PER_CALL) -> List[List[int]]:
+    """
+    Groups consecutive rubric rows into JSON scoring calls of at most
+    max_per_call rows. Rows under the same main criterion go together (a long
+    run is split into balanced batches); neighbouring batches that still have
+    room are merged when they retrieved any of the same chunks (chunk_keys),
+    since shared excerpts are sent only once per call.
+    """
+    runs: List[List[int]] = []
+    for i, main in enumerate(main_criteria):
+        if runs and main_criteria[runs[-1][-1]] == main:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+
+    max_per_call = max(1, max_per_call)
+    batches: List[List[int]] = []
+    for run in runs:
+        count = math.ceil(len(run) / max_per_call)
+        size = math.ceil(len(run) / count)
+        batches.extend(run[start:start + size] for start in range(0, len(run), size))
+
+    merged: List[List[int]] = []
+    for batch in batches:
+        if merged and len(merged[-1]) + len(batch) <= max_per_call:
+            previous = set().union(*(chunk_keys[i] for i in merged[-1]))
+            if any(previous & chunk_keys[i] for i in batch):
+                merged[-1].extend(batch)
+                continue
+        merged.append(batch)
+    return merged
+
+def _messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimated prompt tokens of a chat request."""
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+def _normalize_proposal_name(proposal_name: str, proposal_ids: List[str]) -> str:
+    """Maps the model's proposal label ("Prop_3", "Proposal 3", ...) back to a proposal id."""
+    name_lower = proposal_name.lower().strip("*` ")
+    for p_id in proposal_ids:
+        if re.search(rf"\b{re.escape(p_id.lower())}\b", name_lower):
+            return p_id
+    number = re.search(r"\d+", name_lower)
+    if number:
+        for p_id in proposal_ids:
+            if re.search(rf"(?<!\d){number.group()}$", p_id):
+                return p_id
+    return proposal_name
+
+def _parse_scoring_table(scoring_table_markdown: str, row, proposal_ids: List[str], references_path: str) -> List[Dict[str, Any]]:
+    """Parses Kimi's markdown scoring table into one result row per proposal."""
+    criterion_results: List[Dict[str, Any]] = []
+    lines = [ln for ln in scoring_table_markdown.strip().split('\n') if ln.strip()]
+    # Find header and separator lines dynamically
+    header_idx = next((i for i, ln in enumerate(lines) if ln.strip().startswith('|')), None)
+    sep_idx = None
+    if header_idx is not None:
+        for j in range(header_idx + 1, min(header_idx + 4, len(lines))):
+            if set(lines[j].replace('|','').strip()) <= set('-: '):
+                sep_idx = j
+                break
+    if header_idx is None or sep_idx is None:
+        raise ValueError("Markdown table header/separator not found")
+
+    data_started = False
+    for ln in lines[sep_idx + 1:]:
+        if not ln.strip().startswith('|'):
+            if data_started:
+                break
+            else:
+                continue
+        data_started = True
+        cells = [p.strip() for p in ln.split('|') if p.strip()]
+        if len(cells) < 3:
+            continue
+        if len(cells) >= 4:
+            proposal_name, score, reason_ar, reason_en = cells[0], cells[1], cells[2], cells[3]
+        else:
+            proposal_name, score, reason_ar = cells[0], cells[1], cells[2]
+            reason_en = ""
+
+        criterion_results.append({
+            'Main_Criterion': row['Main_Criterion'],
+            'Sub_Criterion': row['Sub_Criterion'],
+            # Normalize proposal names to match PROPOSALS_PATHS keys for pivot step
+            'Proposal': _normalize_proposal_name(proposal_name, proposal_ids),
+            'Score (0-5)': score,
+            'Reasoning (Arabic)': reason_ar,
+            'Reasoning (English)': reason_en,
+            'References_File': references_path
+        })
+    return criterion_results
+
+def _validate_score_entry(entry: Any, criterion_ids: List[str], proposal_ids: List[str]):
+    """
+    Checks one entry of Kimi's JSON scores against the expected schema and
+    returns ((criterion id, proposal id), normalized entry), or None for an
+    unknown id, a score outside 0-5 or empty reasoning, so callers can retry
+    exactly the pairs that are missing.
+    """
+    if not isinstance(entry, dict):
+        return None
+    c_id = str(entry.get("criterion", "")).strip()
+    p_id = _normalize_proposal_name(str(entry.get("proposal", "")), proposal_ids)
+    if c_id not in criterion_ids or p_id not in proposal_ids:
+        return None
+    score = entry.get("score")
+    if isinstance(score, str):
+        try:
+            score = float(score.strip())
+        except ValueError:
+            return None
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 5:
+        return None
+    reasoning = [entry.get("reasoning_ar"), entry.get("reasoning_en")]
+    if not all(isinstance(r, str) and r.strip() for r in reasoning):
+        return None
+    return (c_id, p_id), {
+        "score": int(score) if float(score).is_integer() else score,
+        "reasoning_ar": reasoning[0].strip(),
+        "reasoning_en": reasoning[1].strip(),
+    }
+
+def _prepare_criterion(vector_store: VectorStore, index, row, context, proposal_ids: List[str], output_dir: str, namespace: str = None) -> Dict[str, Any]:
+    """
+    Retrieves context for one rubric row (unless already batched) and saves
+    its references.
+    """
+    criterion = f"{row['Main_Criterion']} - {row['Sub_Criterion']}"
+    rubric = row['Rubric']
+    
+    print(f"\n--- 🎯 Evaluating Criterion: {criterion} ---")
+    
+    # 1. Retrieval (RAG)
+    if context is None:
+        context = retrieve_context(vector_store, criterion_text=f"{criterion}. {rubric}", proposal_ids=proposal_ids, namespace=namespace)
+    
+    texts = {p_id: context.get(p_id, {}).get('text') or "No relevant content found." for p_id in proposal_ids}
+    chunk_texts = {p_id: [c["text"] for c in context.get(p_id, {}).get('chunks', [])] for p_id in proposal_ids}
+
+    # Save references (retrieved chunk metadata) for this criterion
+    references_dir = os.path.join(output_dir, "references")
+    os.makedirs(references_dir, exist_ok=True)
+    safe_name = f"{index:03d}_" + "".join(c if c.isalnum() or c in (" ", "-", "_") else "_" for c in criterion)[:120]
+    references_path = os.path.join(references_dir, f"{safe_name}.json")
+    try:
+        with open(references_path, "w", encoding="utf-8") as rf:
+            json.dump({
+                "criterion": criterion,
+                "rubric": rubric,
+                **{p_id: context.get(p_id, {}).get('chunks', []) for p_id in proposal_ids},
+                "packing": {
+                    p_id: {key: context.get(p_id, {}).get(key, 0) for key in ("tokens", "dropped", "trimmed_tokens")}
+                    for p_id in proposal_ids
+                }
+            }, rf, ensure_ascii=False, indent=2)
+    except Exception as _:
+        references_path = ""
+
+    return {
+        "index": index,
+        "row": row,
+        "criterion": criterion,
+        "rubric": rubric,
+        "texts": texts,
+        "chunk_texts": chunk_texts,
+        "safe_name": safe_name,
+        "references_path": references_path,
+    }
+
+def _batch_inputs(batch_plans: List[Dict[str, Any]], proposal_ids: List[str]):
+    """
+    Builds the criteria and shared excerpt pools for build_batch_scoring_messages:
+    a chunk retrieved for several criteria of the batch is listed once per proposal.
+    """
+    excerpts: Dict[str, List[str]] = {p_id: [] for p_id in proposal_ids}
+    criteria = []
+    for number, plan in enumerate(batch_plans, start=1):
+        refs = {}
+        for p_id in proposal_ids:
+            pool = excerpts[p_id]
+            refs[p_id] = []
+            for text in plan["chunk_texts"].get(p_id, []):
+                if text not in pool:
+                    pool.append(text)
+                refs[p_id].append(pool.index(text) + 1)
+        criteria.append({"id": f"C{number}", "criterion": plan["criterion"], "rubric": plan["rubric"], "excerpts": refs})
+    return criteria, excerpts
+
+def _plan_calls(plans: Dict[int, Dict[str, Any]], proposal_ids: List[str], scoring_output: str, criteria_per_call: int, batches: List[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    Turns the prepared criteria (plans by rubric position, None when skipped)
+    into Kimi calls: criteria are batched by plan_criteria_batches, or as given
+    in batches (position lists), with one per call for markdown output; each
+    batch's proposals are split by plan_scoring_groups using the real prompt size.
+    """
+    if batches is None:
+        positions = [position for position in sorted(plans) if plans[position] is not None]
+        if scoring_output == "json":
+            batches = [[positions[i] for i in batch] for batch in plan_criteria_batches(
+                [plans[p]["row"]['Main_Criterion'] for p in positions],
+                [{(p_id, text) for p_id, texts in plans[p]["chunk_texts"].items() for text in texts} for p in positions],
+                criteria_per_call,
+            )]
+        else:
+            batches = [[p] for p in positions]
+    else:
+        batches = [[p for p in batch if plans.get(p) is not None] for batch in batches]
+        if scoring_output != "json":
+            batches = [[p] for batch in batches for p in batch]
+        batches = [batch for batch in batches if batch]
+
+    calls = []
+    for batch_positions in batches:
+        batch_plans = [plans[p] for p in batch_positions]
+        # Size the actual prompt: instructions, criteria and rubrics once, then each proposal's block
+        if scoring_output == "json":
+            def prompt_tokens(group):
+                return _messages_tokens(build_batch_scoring_messages(*_batch_inputs(batch_plans, group)))
+        else:
+            plan = batch_plans[0]
+            def prompt_tokens(group):
+                return _messages_tokens(build_scoring_messages(plan["criterion"], plan["rubric"], {p_id: plan["texts"][p_id] for p_id in group}))
+        fixed_tokens = prompt_tokens([])
+        groups = plan_scoring_groups({p_id: prompt_tokens([p_id]) - fixed_tokens for p_id in proposal_ids}, fixed_tokens)
+        for group_number, group in enumerate(groups):
+            calls.append({
+                "positions": batch_positions,
+                "group": group,
+                "group_number": group_number,
+                "group_count": len(groups),
+                "prompt_tokens": [],
+            })
+    return calls
+
+def _call_label(call: Dict[str, Any]) -> str:
+    return f" (proposals {', '.join(call['group'])})" if call["group_count"] > 1 else ""
+
+def _artifact_name(call: Dict[str, Any], plans: Dict[int, Dict[str, Any]]) -> str:
+    name = plans[call["positions"][0]]["safe_name"]
+    if len(call["positions"]) > 1:
+        name = f"{name}_batch{len(call['positions'])}"
+    if call["group_count"] > 1:
+        name = f"{name}_group{call['group_number'] + 1}"
+    return name
+
+def _score_group(call: Dict[str, Any], plans: Dict[int, Dict[str, Any]], artifacts_dir: str) -> Dict[int, List[Dict[str, Any]]]:
+    """Runs one markdown Kimi scoring call for one criterion and a group of proposals and parses its table."""
+    position = call["positions"][0]
+    plan = plans[position]
+    group = call["group"]
+    label = _call_label(call)
+    proposal_contexts = {p_id: plan["texts"][p_id] for p_id in group}
+
+    # 2. Generation (Kimi Scoring)
+    prompt_tokens = _messages_tokens(build_scoring_messages(plan["criterion"], plan["rubric"], proposal_contexts))
+    call["prompt_tokens"].append(prompt_tokens)
+    print(f"  - ⏳ Sending context to Kimi for scoring{label} (~{prompt_tokens} prompt tokens)...")
+    scoring_table_markdown = score_proposals(
+        criterion=plan["criterion"],
+        rubric=plan["rubric"],
+        proposal_contexts=proposal_contexts
+    )
+
+    # 3. Parse Scoring Table
+    if not scoring_table_markdown:
+        print(f"  - ❌ Kimi returned no scoring table{label}.")
+        return {}
+
+    print("  - ✅ Kimi scoring complete. Parsing results...")
+    # Save raw Kimi markdown for auditing
+    try:
+        with open(os.path.join(artifacts_dir, f"{_artifact_name(call, plans)}.md"), "w", encoding="utf-8") as f:
+            f.write(scoring_table_markdown)
+    except Exception as _:
+        pass
+
+    # Robust parsing of the returned markdown table
+    try:
+        return {position: _parse_scoring_table(scoring_table_markdown, plan["row"], group, plan["references_path"])}
+    except Exception as e:
+        print(f"  - ❌ Failed to parse Kimi scoring table: {e}")
+        return {}
+
+def _request_json_scores(batch_plans: List[Dict[str, Any]], group: List[str], call: Dict[str, Any], artifact_path: str, use_cache: bool = True, on_entry=None) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Sends one batch JSON scoring request and returns its valid entries keyed
+    by (criterion id, proposal id). With KIMI_STREAMING, entries are parsed
+    and handed to on_entry(key, entry) while Kimi is still writing the rest;
+    entries received before a stream breaks off are kept.
+    """
+    criteria, excerpts = _batch_inputs(batch_plans, group)
+    criterion_ids = [c["id"] for c in criteria]
+    call["prompt_tokens"].append(_messages_tokens(build_batch_scoring_messages(criteria, excerpts)))
+
+    parser = JsonItemStream()
+    parts: List[str] = []
+    scores: Dict[tuple, Dict[str, Any]] = {}
+    try:
+        if KIMI_STREAMING:
+            chunks = stream_criteria_batch(criteria, excerpts, use_cache=use_cache)
+        else:
+            chunks = [score_criteria_batch(criteria, excerpts, use_cache=use_cache) or ""]
+        for chunk in chunks:
+            parts.append(chunk)
+            for item in parser.feed(chunk):
+                validated = _validate_score_entry(item, criterion_ids, group)
+                if validated is None or validated[0] in scores:
+                    continue
+                scores[validated[0]] = validated[1]
+                if on_entry is not None:
+                    on_entry(*validated)
+    except Exception as e:
+        print(f"  - ❌ Kimi scoring stopped after {len(scores)} valid entries: {e}")
+
+    if parts:
+        try:
+            with open(artifact_path, "w", encoding="utf-8") as f:
+                f.write("".join(parts))
+        except Exception as _:
+            pass
+    if parser.invalid:
+        print(f"  - ⚠️ Skipped {parser.invalid} malformed JSON entries.")
+    return scores
+
+def _score_row(plan: Dict[str, Any], p_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'Main_Criterion': plan["row"]['Main_Criterion'],
+        'Sub_Criterion': plan["row"]['Sub_Criterion'],
+        'Proposal': p_id,
+        'Score (0-5)': entry["score"],
+        'Reasoning (Arabic)': entry["reasoning_ar"],
+        'Reasoning (English)': entry["reasoning_en"],
+        'References_File': plan["references_path"]
+    }
+
+def _score_batch(call: Dict[str, Any], plans: Dict[int, Dict[str, Any]], artifacts_dir: str, on_row=None) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Scores a batch of criteria for a group of proposals in one JSON call. Every
+    criterion left with missing or invalid entries is retried on its own for
+    just those proposals; whatever still fails is reported and left out.
+    on_row(position, row), if given, receives each result row as soon as
+    its entry has been parsed from the stream.
+    """
+    positions = call["positions"]
+    batch_plans = [plans[p] for p in positions]
+    group = call["group"]
+    label = _call_label(call)
+    artifact_name = _artifact_name(call, plans)
+
+    def entry_handler(criterion_positions: List[int]):
+        if on_row is None:
+            return None
+        def on_entry(key, entry):
+            position = criterion_positions[int(key[0][1:]) - 1]
+            on_row(position, _score_row(plans[position], key[1], entry))
+        return on_entry
+
+    print(f"  - ⏳ Scoring {len(positions)} criteria{label} in one Kimi call...")
+    scores = _request_json_scores(batch_plans, group, call, os.path.join(artifacts_dir, f"{artifact_name}.json"), on_entry=entry_handler(positions))
+
+    results: Dict[int, List[Dict[str, Any]]] = {}
+    for number, (position, plan) in enumerate(zip(positions, batch_plans), start=1):
+        entries = {p_id: scores.get((f"C{number}", p_id)) for p_id in group}
+        missing = [p_id for p_id, entry in entries.items() if entry is None]
+        if missing:
+            # Retries skip the response cache, which may hold the invalid answer
+            print(f"  - 🔁 Retrying '{plan['criterion'][:50]}' for {', '.join(missing)}...")
+            retried = _request_json_scores(
+                [plan], missing, call,
+                os.path.join(artifacts_dir, f"{artifact_name}_retry{number}.json"),
+                use_cache=False,
+                on_entry=entry_handler([position])
+            )
+            for p_id in missing:
+                entries[p_id] = retried.get(("C1", p_id))
+        failed = [p_id for p_id, entry in entries.items() if entry is None]
+        if failed:
+            print(f"  - ❌ No valid score for '{plan['criterion'][:50]}' from {', '.join(failed)}.")
+        results[position] = [_score_row(plan, p_id, entry) for p_id, entry in entries.items() if entry is not None]
+    print(f"  - ✅ Kimi batch scoring complete{label}.")
+    return results
+
+def _event_index(index):
+    return int(index) if isinstance(index, (int, np.integer)) else str(index)
+
+def run_evaluation_loop(rubric_df: pd.DataFrame, num_proposals: int, output_dir: str = "outputs", batch_retrieval: bool = True, scoring_concurrency: int = SCORING_CONCURRENCY, vector_store: VectorStore = None, progress_callback=None, namespace: str = None, proposal_ids: List[str] = None, scoring_output: str = SCORING_OUTPUT, criteria_per_call: int = SCORING_CRITERIA_PER_CALL, checkpoint: RunCheckpoint = None, rubric_rows: Iterable = None) -> pd.DataFrame:
     """
     Iterates through each criterion, retrieves context, and scores proposals.
     
     Args:
-        rubric_df: DataFrame with evaluation criteria
+        rubric_df: DataFrame with evaluation criteria; may be None with rubric_rows
         num_proposals: Number of proposals being evaluated
         output_dir: Directory to save output files (default: "outputs")
+        batch_retrieval: Embed and search all criteria in one round-trip each
+        scoring_concurrency: Number of Kimi scoring calls run in parallel
+        vector_store: Store the proposals were ingested into (default: configured backend)
+        progress_callback: Receives "criterion", "score" and "progress" events
+        namespace: Namespace the proposals were ingested under (see namespaced_id)
+        proposal_ids: Proposals to score (default: Prop_1 .. Prop_<num_proposals>)
+        scoring_output: "json" (several criteria per call) or "markdown" (one per call)
+        criteria_per_call: Sub-criteria per JSON scoring call
+        checkpoint: RunCheckpoint to restore scored criteria from and append to
+        rubric_rows: Streamed (index, row) pairs, scored as they arrive
     """
-    milvus_collection = get_milvus_collection()
-    if milvus_collection is None:
+    if vector_store is None:
+        vector_store = get_vector_store()
+    if vector_store is None:
         return pd.DataFrame()
+    if proposal_ids is None:
+        proposal_ids = [f"Prop_{i}" for i in range(1, num_proposals + 1)]
 
     final_evaluation_results = []
     # Ensure output dir for Kimi scoring artifacts (within the timestamped folder)
     artifacts_dir = os.path.join(output_dir, "kimi_scores")
     os.makedirs(artifacts_dir, exist_ok=True)
 
-    for index, row in rubric_df.iterrows():
-        criterion = f"{row['Main_Criterion']} - {row['Sub_Criterion']}"
-        rubric = row['Rubric']
-        
-        print(f"\n--- 🎯 Evaluating Criterion: {criterion} ---")
-        
-        # 1. Retrieval (RAG)
-        context = retrieve_context(milvus_collection, criterion_text=f"{criterion}. {rubric}")
-        
-        context_p1_text = context.get('Prop_1', {}).get('text', "No relevant content found.")
-        context_p2_text = context.get('Prop_2', {}).get('text', "No relevant content found.")
-
-        # Save references (retrieved chunk metadata) for this criterion
-        references_dir = os.path.join(output_dir, "references")
-        os.makedirs(references_dir, exist_ok=True)
-        safe_name = f"{index:03d}_" + "".join(c if c.isalnum() or c in (" ", "-", "_") else "_" for c in criterion)[:120]
-        references_path = os.path.join(references_dir, f"{safe_name}.json")
+    # Rubric rows by position, in arrival order; total stays None while rows are still streaming
+    rows: List[tuple] = []
+    keys: List[str] = []
+    total = None
+    completed = checkpoint.completed_criteria() if checkpoint is not None else {}
+    restored: Dict[int, List[Dict[str, Any]]] = {}
+
+    def register(index, row) -> int:
+        position = len(rows)
+        rows.append((index, row))
+        keys.append(criterion_key(index, row['Main_Criterion'], row['Sub_Criterion']))
+        if keys[position] in completed:
+            restored[position] = completed[keys[position]]
+        return position
+
+    def query_text(position: int) -> str:
+        row = rows[position][1]
+        return f"{row['Main_Criterion']} - {row['Sub_Criterion']}. {row['Rubric']}"
+
+    done = 0
+    lock = threading.Lock()
+    if progress_callback is not None:
+        progress_callback({"type": "progress", "stage": "evaluation", "done": 0, "total": len(rubric_df) if rubric_rows is None else None})
+
+    def report_done(position: int, criterion_results: List[Dict[str, Any]]):
+        nonlocal done
+        if progress_callback is None:
+            return
+        index, row = rows[position]
+        with lock:
+            done += 1
+            progress_callback({
+                "type": "criterion",
+                "stage": "evaluation",
+                "index": _event_index(index),
+                "main_criterion": row['Main_Criterion'],
+                "sub_criterion": row['Sub_Criterion'],
+                "rows": criterion_results,
+                "prompt_tokens": [t for call_number in calls_by_position.get(position, []) for t in calls[call_number]["prompt_tokens"]]
+            })
+            progress_callback({"type": "progress", "stage": "evaluation", "done": done, "total": total})
+
+    def report_row(position: int, row: Dict[str, Any]):
+        if progress_callback is None:
+            return
+        with lock:
+            progress_callback({"type": "score", "stage": "evaluation", "index": _event_index(rows[position][0]), "row": row})
+
+    contexts: Dict[int, Dict[str, Any]] = {}
+    plans: Dict[int, Dict[str, Any]] = {}
+
+    def prepare(position: int):
+        if position in restored:
+            return None
+        index, row = rows[position]
         try:
-            import json
-            with open(references_path, "w", encoding="utf-8") as rf:
-                json.dump({
-                    "criterion": criterion,
-                    "rubric": rubric,
-                    "Prop_1": context.get('Prop_1', {}).get('chunks', []),
-                    "Prop_2": context.get('Prop_2', {}).get('chunks', [])
-                }, rf, ensure_ascii=False, indent=2)
-        except Exception as _:
-            references_path = ""
-        
-        # 2. Generation (Kimi Scoring)
-        print("  - ⏳ Sending context to Kimi for scoring...")
-        scoring_table_markdown = score_proposals_with_rag(
-            criterion=criterion,
-            rubric=rubric,
-            proposal_1_context=context_p1_text,
-            proposal_2_context=context_p2_text,
-            num_proposals=num_proposals
-        )
-
-        # 3. Parse Scoring Table
-        if scoring_table_markdown:
-            print("  - ✅ Kimi scoring complete. Parsing results...")
-            # Save raw Kimi markdown for auditing
+            return _prepare_criterion(vector_store, index, row, contexts.get(position), proposal_ids, output_dir, namespace)
+        except Exception as e:
+            print(f"  - ❌ Evaluation failed for criterion {index}: {e}")
+            return None
+
+    # Every (criteria batch, proposal group) pair is one Kimi call; all of them share one pool
+    calls: List[Dict[str, Any]] = []
+    per_call: Dict[tuple, List[Dict[str, Any]]] = {}
+    calls_by_position: Dict[int, List[int]] = {}
+    remaining: Dict[int, int] = {}
+    futures = []
+
+    def score(call_number: int) -> None:
+        call = calls[call_number]
+        try:
+            if scoring_output == "json":
+                results = _score_batch(call, plans, artifacts_dir, on_row=report_row)
+            else:
+                results = _score_group(call, plans, artifacts_dir)
+        except Exception as e:
+            print(f"  - ❌ Evaluation failed for criteria {[rows[p][0] for p in call['positions']]}: {e}")
+            results = {}
+        finished = []
+        with lock:
+            for position in call["positions"]:
+                per_call[(position, call_number)] = results.get(position, [])
+                remaining[position] -= 1
+                if remaining[position] == 0:
+                    finished.append(position)
+        for position in finished:
+            results = collect(position)
+            if checkpoint is not None and {r['Proposal'] for r in results} >= set(proposal_ids):
+                try:
+                    checkpoint.record_criterion(keys[position], results)
+                except Exception as e:
+                    print(f"  - ⚠️ Failed to checkpoint criterion {rows[position][0]}: {e}")
+            report_done(position, results)
+
+    def collect(position: int) -> List[Dict[str, Any]]:
+        if position in restored:
+            return restored[position]
+        results = [r for call_number in calls_by_position.get(position, []) for r in per_call.get((position, call_number), [])]
+        order = {p_id: i for i, p_id in enumerate(proposal_ids)}
+        return sorted(results, key=lambda r: order.get(r['Proposal'], len(order)))
+
+    def submit_calls(positions: List[int], new_calls: List[Dict[str, Any]]):
+        with lock:
+            first = len(calls)
+            calls.extend(new_calls)
+            for call_number in range(first, len(calls)):
+                for position in calls[call_number]["positions"]:
+                    calls_by_position.setdefault(position, []).append(call_number)
+            for position in positions:
+                remaining[position] = len(calls_by_position.get(position, []))
+        for position in positions:
+            if not remaining[position]:
+                report_done(position, collect(position))
+        with lock:
+            futures.extend(executor.submit(score, call_number) for call_number in range(first, first + len(new_calls)))
+
+    def schedule(positions: List[int]):
+        """Retrieves, prepares and submits one batch of streamed rubric rows."""
+        if batch_retrieval:
             try:
-                with open(os.path.join(artifacts_dir, f"{safe_name}.md"), "w", encoding="utf-8") as f:
-                    f.write(scoring_table_markdown)
-            except Exception as _:
-                pass
-            
-            # Robust parsing of the returned markdown table
+                for position, context in zip(positions, retrieve_contexts_batch(vector_store, [query_text(p) for p in positions], proposal_ids=proposal_ids, namespace=namespace)):
+                    contexts[position] = context
+            except Exception as e:
+                print(f"  - ⚠️ Batched retrieval failed, retrieving per criterion: {e}")
+        for position in positions:
+            plans[position] = prepare(position)
+        try:
+            new_calls = _plan_calls(plans, proposal_ids, scoring_output, criteria_per_call, batches=[positions])
+        except Exception as e:
+            print(f"  - ❌ Evaluation failed for criteria {[rows[p][0] for p in positions]}: {e}")
+            new_calls = []
+        submit_calls(positions, new_calls)
+
+    workers = max(1, scoring_concurrency)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if rubric_rows is None:
+            for index, row in rubric_df.iterrows():
+                register(index, row)
+            total = len(rows)
+            pending = [position for position in range(total) if position not in restored]
+            if restored:
+                print(f"♻️ Restored {len(restored)} of {total} criteria from the run checkpoint.")
+            if batch_retrieval and pending:
+                for position, context in zip(pending, retrieve_contexts_batch(vector_store, [query_text(p) for p in pending], proposal_ids=proposal_ids, namespace=namespace)):
+                    contexts[position] = context
+            # executor.map yields in submission order, so plans keep rubric order
+            plans.update(zip(range(total), executor.map(prepare, range(total))))
+            new_calls = _plan_calls(plans, proposal_ids, scoring_output, criteria_per_call)
+            print(f"⏳ Scoring {len(proposal_ids)} proposals x {len(pending)} criteria in {len(new_calls)} Kimi calls ({min(workers, max(1, len(new_calls)))} concurrent, {scoring_output} output)...")
+            submit_calls(list(range(total)), new_calls)
+        else:
+            # Rows under one main criterion are batched until the batch is full or the
+            # main criterion changes, then retrieved and scored while more rows stream in
+            batch_size = max(1, criteria_per_call) if scoring_output == "json" else 1
+            batch: List[int] = []
+            print(f"⏳ Scoring {len(proposal_ids)} proposals as rubric rows stream in ({workers} concurrent, {scoring_output} output)...")
             try:
-                lines = [ln for ln in scoring_table_markdown.strip().split('\n') if ln.strip()]
-                # Find header and separator lines dynamically
-                header_idx = next((i for i, ln in enumerate(lines) if ln.strip().startswith('|')), None)
-                sep_idx = None
-                if header_idx is not None:
-                    for j in range(header_idx + 1, min(header_idx + 4, len(lines))):
-                        if set(lines[j].replace('|','').strip()) <= set('-: '):
-                            sep_idx = j
-                            break
-                if header_idx is None or sep_idx is None:
-                    raise ValueError("Markdown table header/separator not found")
-
-                data_started = False
-                for ln in lines[sep_idx + 1:]:
-                    if not ln.strip().startswith('|'):
-                        if data_started:
-                            break
-                        else:
-                            continue
-                    data_started = True
-                    cells = [p.strip() for p in ln.split('|') if p.strip()]
-                    if len(cells) < 3:
+                for index, row in rubric_rows:
+                    position = register(index, row)
+                    if position in restored:
+                        report_done(position, restored[position])
                         continue
-                    if len(cells) >= 4:
-                        proposal_name, score, reason_ar, reason_en = cells[0], cells[1], cells[2], cells[3]
-                    else:
-                        proposal_name, score, reason_ar = cells[0], cells[1], cells[2]
-                        reason_en = ""
-
-                    # Normalize proposal names to match PROPOSALS_PATHS keys for pivot step
-                    name_lower = proposal_name.lower()
-                    if 'prop_1' in name_lower or 'proposal 1' in name_lower or 'proposal1' in name_lower:
-                        normalized_proposal = 'Prop_1'
-                    elif 'prop_2' in name_lower or 'proposal 2' in name_lower or 'proposal2' in name_lower:
-                        normalized_proposal = 'Prop_2'
-                    else:
-                        normalized_proposal = proposal_name
-
-                    final_evaluation_results.append({
-                        'Main_Criterion': row['Main_Criterion'],
-                        'Sub_Criterion': row['Sub_Criterion'],
-                        'Proposal': normalized_proposal,
-                        'Score (0-5)': score,
-                        'Reasoning (Arabic)': reason_ar,
-                        'Reasoning (English)': reason_en,
-                        'References_File': references_path
-                    })
+                    if batch and rows[batch[-1]][1]['Main_Criterion'] != row['Main_Criterion']:
+                        futures.append(executor.submit(schedule, batch))
+                        batch = []
+                    batch.append(position)
+                    if len(batch) >= batch_size:
+                        futures.append(executor.submit(schedule, batch))
+                        batch = []
             except Exception as e:
-                print(f"  - ❌ Failed to parse Kimi scoring table: {e}")
-                
-        else:
-            print("  - ❌ Kimi returned no scoring table.")
+                print(f"❌ Rubric stream failed after {len(rows)} criteria: {e}")
+            if batch:
+                futures.append(executor.submit(schedule, batch))
+            total = len(rows)
+            if restored:
+                print(f"♻️ Restored {len(restored)} of {total} criteria from the run checkpoint.")
+
+        # Scheduled batches submit their own scoring calls, so wait until no new work appears
+        while True:
+            with lock:
+                waiting = list(futures)
+            wait(waiting)
+            with lock:
+                if len(futures) == len(waiting):
+                    break
+
+    for position in range(len(rows)):
+        final_evaluation_results.extend(collect(position))
+
+    call_tokens = [t for call in calls for t in call["prompt_tokens"] if t]
+    if call_tokens:
+        print(f"📏 Scoring prompts: {len(call_tokens)} calls, ~{sum(call_tokens)} tokens total "
+              f"(min {min(call_tokens)}, mean {sum(call_tokens) // len(call_tokens)}, max {max(call_tokens)}).")
 
-    return pd.DataFrame(final_evaluation_results)
\ No newline at end of file
+    return pd.DataFrame(final_evaluation_results)
@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# Evaluations run concurrently in the background (each job has its own workspace and vector namespace)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs kept in memory for status/result lookups
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "100"))
+
+# Pipeline stages reported by main(), in execution order
+PIPELINE_STAGES = ["rubric", "ingestion", "evaluation", "output"]
+
+class Job:
+    """State of one background evaluation: status, per-stage progress, result or error."""
+
+    def __init__(self, job_id: str, params: Dict[str, Any]):
+        self.id = job_id
+        self.params = params
+        self.status = "queued"  # queued -> running -> succeeded | failed
+        self.stages: Dict[str, Dict[str, Any]] = {
+            stage: {"status": "pending", "done": 0, "total": None} for stage in PIPELINE_STAGES
+        }
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.future: Optional[Future] = None
+        # Every pipeline/job event in order; an event's "seq" is its position + 1
+        self.events: List[Dict[str, Any]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stages": self.stages,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+class JobManager:
+    """
+    Runs evaluation pipelines on a thread pool so API handlers return at once.
+    The pipeline reports progress through a callback taking event dicts:
+    {"type": "stage", "stage": ..., "status": "started" | "finished" | "failed"},
+    {"type": "progress", "stage": ..., "done": n, "total": m} and
+    {"type": "criterion", "index": ..., "rows": [...]} per scored criterion.
+    The manager adds {"type": "job", "status": ...} when a job starts and
+    ends. Every event is kept on the job so clients can stream them (see
+    wait_for_events).
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, history_limit: int = JOB_HISTORY_LIMIT):
+        self.workers = max(1, workers)
+        self.history_limit = history_limit
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, fn: Callable[..., Optional[Dict[str, Any]]], params: Dict[str, Any], job_id: Optional[str] = None) -> Job:
+        """
+        Queues fn(progress_callback=..., **params). fn returns the job result
+        dict, or None when the pipeline failed without raising.
+        """
+        job = Job(job_id or uuid.uuid4().hex, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            self._append(job, {"type": "job", "status": "queued"})
+        job.future = self._executor.submit(self._run, job, fn)
+        print(f"📥 Job {job.id} queued.")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+
+    def wait_for_events(self, job: Job, after: int = 0, timeout: float = 15.0) -> List[Dict[str, Any]]:
+        """
+        Returns the job's events with seq > after, blocking up to timeout
+        seconds for new ones. An empty list means nothing happened yet.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: len(job.events) > after, timeout=timeout)
+            return job.events[after:]
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _prune(self):
+        """Drops the oldest finished jobs beyond history_limit (caller holds the lock)."""
+        finished = [job for job in self._jobs.values() if job.status in ("succeeded", "failed")]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(0, len(finished) - self.history_limit)]:
+            del self._jobs[job.id]
+
+    def _append(self, job: Job, event: Dict[str, Any]):
+        """Stores an event on the job and wakes up streaming readers (caller holds the lock)."""
+        job.events.append({**event, "seq": len(job.events) + 1, "time": time.time()})
+        self._changed.notify_all()
+
+    def _record(self, job: Job, event: Dict[str, Any]):
+        """Applies one pipeline event to the job's stage table and event log."""
+        with self._lock:
+            self._append(job, event)
+            stage = job.stages.setdefault(event.get("stage", ""), {"status": "pending", "done": 0, "total": None})
+            if event.get("type") == "stage":
+                stage["status"] = {"started": "running", "finished": "done"}.get(event["status"], event["status"])
+                # Details such as failed_proposals stay visible in the job's status
+                stage.update({k: v for k, v in event.items() if k not in ("type", "stage", "status")})
+            elif event.get("type") == "progress":
+                stage["done"] = event.get("done", stage["done"])
+                stage["total"] = event.get("total", stage["total"])
+
+    def _failure_message(self, job: Job) -> str:
+        with self._lock:
+            failed = [p for stage in job.stages.values() for p in stage.get("failed_proposals", [])]
+        if failed:
+            return f"Ingestion failed for {', '.join(failed)}; resume the job to retry."
+        return "Evaluation pipeline failed or returned no results."
+
+    def _run(self, job: Job, fn: Callable[..., Optional[Dict[str, Any]]]):
+        with self._lock:
+            job.status = "running"
+            job.started_at = time.time()
+            self._append(job, {"type": "job", "status": "running"})
+        print(f"🚀 Job {job.id} started.")
+        try:
+            result = fn(progress_callback=lambda event: self._record(job, event), **job.params)
+            error = None if result is not None else self._failure_message(job)
+        except Exception as e:
+            traceback.print_exc()
+            result, error = None, str(e)
+        with self._lock:
+            job.finished_at = time.time()
+            job.result = result
+            job.error = error
+            job.status = "succeeded" if error is None else "failed"
+            for stage in job.stages.values():
+                if stage["status"] == "running":
+                    stage["status"] = "done" if error is None else "failed"
+            self._append(job, {"type": "job", "status": job.status, "error": error})
+        print(f"{'✅' if error is None else '❌'} Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s.")
+        return job
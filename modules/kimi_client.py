@@ -1,18 +1,88 @@
 import os
-from groq import Client
+import threading
+from typing import Any, Dict, Iterator, List
 from dotenv import load_dotenv
+from .llm_cache import get_llm_cache, make_cache_key
 
 load_dotenv()
 
-# Initialize Kimi client (using Groq SDK for Moonshot/Kimi model)
-client = Client(api_key=os.getenv("KIMI_API_KEY"))
+# Kimi client (using Groq SDK for Moonshot/Kimi model), created on first use by get_client()
+client = None
+_client_lock = threading.Lock()
 KIMI_MODEL = "moonshotai/kimi-k2-instruct-0905"
+# Stream completions so rubric rows and scores can be used while Kimi is still writing
+KIMI_STREAMING = os.getenv("KIMI_STREAMING", "1").lower() not in ("0", "false", "no")
 
-def extract_table_from_kimi(text: str) -> str:
+def get_client():
     """
-    Generates an evaluation parameter table/rubric from the RFP text.
-    
+    Returns the Kimi client, importing the Groq SDK and creating the client on
+    first use; importing this module needs neither the SDK nor KIMI_API_KEY.
+    """
+    global client
+    with _client_lock:
+        if client is None:
+            from groq import Client
+            client = Client(api_key=os.getenv("KIMI_API_KEY"))
+        return client
+
+def _chat_completion(messages, temperature: float, use_cache: bool = True) -> str:
+    """
+    Runs a Kimi chat completion, serving identical (model, messages, temperature)
+    requests from the persistent response cache unless use_cache is False.
+    """
+    cache = get_llm_cache() if use_cache else None
+    cache_key = make_cache_key(KIMI_MODEL, messages, temperature)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("  - 🗄️ Served Kimi response from cache.")
+            return cached
+
+    completion = get_client().chat.completions.create(
+        model=KIMI_MODEL,
+        messages=messages,
+        temperature=temperature,
+    )
+    content = completion.choices[0].message.content
+
+    if cache is not None and content:
+        cache.put(cache_key, KIMI_MODEL, content)
+    return content
+
+def _chat_completion_stream(messages, temperature: float, use_cache: bool = True) -> Iterator[str]:
     """
+    Streaming form of _chat_completion: yields the answer's text as it is
+    generated; only a completed stream is cached. Errors propagate.
+    """
+    cache = get_llm_cache() if use_cache else None
+    cache_key = make_cache_key(KIMI_MODEL, messages, temperature)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("  - 🗄️ Served Kimi response from cache.")
+            yield cached
+            return
+
+    stream = get_client().chat.completions.create(
+        model=KIMI_MODEL,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    content = "".join(parts)
+    if cache is not None and content:
+        cache.put(cache_key, KIMI_MODEL, content)
+
+def _rubric_messages(text: str) -> List[Dict[str, str]]:
     prompt = f"""
     You are an AI proposal evaluator assistant.
 
@@ -41,42 +111,44 @@ def extract_table_from_kimi(text: str) -> str:
     -------------------------------
     """
 
+    return [
+        {"role": "system", "content": "You are a bilingual proposal evaluation expert skilled in Arabic-English analysis."},
+        {"role": "user", "content": prompt}
+    ]
+
+def extract_table_from_kimi(text: str, use_cache: bool = True) -> str:
+    """
+    Generates an evaluation parameter table/rubric from the RFP text.
+    """
     try:
-        completion = client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a bilingual proposal evaluation expert skilled in Arabic-English analysis."},
-                {"role": "user", "content": prompt}
-            ],
+        return _chat_completion(
+            messages=_rubric_messages(text),
             temperature=0.2,
+            use_cache=use_cache,
         )
 
-        return completion.choices[0].message.content
-
     except Exception as e:
         print(f"❌ Kimi error during table extraction: {e}")
         return None
 
-def score_proposals_with_rag(
-    criterion: str, 
-    rubric: str, 
-    proposal_1_context: str, 
-    proposal_2_context: str, 
-    num_proposals: int
-) -> str:
-    """
-    Uses the Kimi model to compare proposals against a rubric and provide a score/reason.
-    """
-    
-    # Construct proposal context strings dynamically
-    proposal_contexts = {
-        1: f"**PROPOSAL 1 CONTEXT:**\n{proposal_1_context}",
-        2: f"**PROPOSAL 2 CONTEXT:**\n{proposal_2_context}"
-    }
+def stream_table_from_kimi(text: str, use_cache: bool = True) -> Iterator[str]:
+    """Streaming form of extract_table_from_kimi (see iter_rubric_rows). Raises if the stream fails."""
+    try:
+        yield from _chat_completion_stream(_rubric_messages(text), temperature=0.2, use_cache=use_cache)
+    except Exception as e:
+        print(f"❌ Kimi error during table extraction: {e}")
+        raise
+
+def build_scoring_messages(criterion: str, rubric: str, proposal_contexts: Dict[str, str]) -> List[Dict[str, str]]:
+    """Builds the chat messages score_proposals sends, so callers can size the prompt first."""
+    proposal_ids = list(proposal_contexts)
+    context_blocks = "\n    ---\n    ".join(
+        f"**PROPOSAL {p_id} CONTEXT:**\n{text}" for p_id, text in proposal_contexts.items()
+    )
 
     # Generate an evaluation prompt
     prompt = f"""
-    You are a proposal scoring expert. Your task is to evaluate {num_proposals} proposals based on a specific criterion and rubric.
+    You are a proposal scoring expert. Your task is to evaluate {len(proposal_ids)} proposals based on a specific criterion and rubric.
 
     **Evaluation Criterion:** {criterion}
 
@@ -84,17 +156,15 @@ def score_proposals_with_rag(
     {rubric}
 
     **--- Proposal Contexts ---**
-    {proposal_contexts[1]}
-    
-    ---
-    {proposal_contexts[2]}
+    {context_blocks}
     **--- End of Contexts ---**
 
-    Analyze the provided context from Proposal 1 and Proposal 2 against the Required Rubric. 
+    Analyze the provided context from {", ".join(proposal_ids)} against the Required Rubric.
+    Score every proposal on its own merits against the rubric.
     
-    Generate your output as a single, clean **markdown table** with exactly these columns:
+    Generate your output as a single, clean **markdown table** with exactly these columns and one row per proposal:
     
-    1. **Proposal** (e.g., Proposal 1, Proposal 2)
+    1. **Proposal** (the proposal id exactly as given: {", ".join(proposal_ids)})
     2. **Score (0-5)** (A numerical score from 0 to 5, where 5 is Excellent and 0 is Insufficient)
     3. **Reasoning (Arabic)** (A detailed justification in **Arabic**)
     4. **Reasoning (English)** (The same justification in clear English)
@@ -102,18 +172,133 @@ def score_proposals_with_rag(
     Do NOT include any text, headers, or explanations outside the markdown table. The table is the only output.
     """
 
+    return [
+        {"role": "system", "content": "You are an expert bilingual analyst who compares and scores documents against a formal rubric."},
+        {"role": "user", "content": prompt}
+    ]
+
+def score_proposals(
+    criterion: str,
+    rubric: str,
+    proposal_contexts: Dict[str, str],
+    use_cache: bool = True
+) -> str:
+    """
+    Uses the Kimi model to score any number of proposals against one rubric in
+    a single call. proposal_contexts maps proposal ids (e.g. "Prop_3") to their
+    retrieved context; the returned markdown table names proposals by these ids.
+    """
     try:
-        completion = client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are an expert bilingual analyst who compares and scores documents against a formal rubric."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1 # Low temperature for factual scoring
+        return _chat_completion(
+            messages=build_scoring_messages(criterion, rubric, proposal_contexts),
+            temperature=0.1, # Low temperature for factual scoring
+            use_cache=use_cache,
         )
-
-        return completion.choices[0].message.content
         
     except Exception as e:
         print(f"❌ Kimi scoring error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def build_batch_scoring_messages(criteria: List[Dict[str, Any]], excerpts: Dict[str, List[str]]) -> List[Dict[str, str]]:
+    """
+    Builds the JSON scoring request for several criteria at once. Each criteria
+    item carries "id", "criterion", "rubric" and "excerpts" ({proposal id:
+    [excerpt numbers]}); excerpts holds each proposal's numbered excerpt texts,
+    shared by all criteria so chunks retrieved for several of them are sent once.
+    """
+    proposal_ids = list(excerpts)
+    criterion_ids = [c["id"] for c in criteria]
+    excerpt_blocks = "\n    ---\n    ".join(
+        f"**PROPOSAL {p_id} EXCERPTS:**\n" + ("\n".join(f"[E{n}] {text}" for n, text in enumerate(texts, start=1)) or "No relevant content found.")
+        for p_id, texts in excerpts.items()
+    )
+    criteria_blocks = "\n\n    ".join(
+        f"[{c['id']}] **Criterion:** {c['criterion']}\n"
+        f"    **Rubric:** {c['rubric']}\n"
+        f"    **Relevant excerpts:** " + "; ".join(
+            f"{p_id}: " + (", ".join(f"E{n}" for n in c["excerpts"].get(p_id, [])) or "none")
+            for p_id in proposal_ids
+        )
+        for c in criteria
+    )
+
+    prompt = f"""
+    You are a proposal scoring expert. Your task is to evaluate {len(proposal_ids)} proposals against {len(criteria)} criteria, each with its own rubric.
+
+    **--- Proposal Excerpts ---**
+    {excerpt_blocks}
+    **--- End of Excerpts ---**
+
+    **--- Criteria ---**
+    {criteria_blocks}
+    **--- End of Criteria ---**
+
+    Score every proposal on every criterion on its own merits, using the excerpts listed for that criterion.
+
+    Return ONLY a JSON object, without markdown fences or any other text, of this form:
+    {{"scores": [{{"criterion": "C1", "proposal": "Prop_1", "score": 4, "reasoning_ar": "...", "reasoning_en": "..."}}]}}
+
+    - one entry for every criterion and proposal pair ({len(criteria) * len(proposal_ids)} entries)
+    - "criterion": the criterion id exactly as given ({", ".join(criterion_ids)})
+    - "proposal": the proposal id exactly as given ({", ".join(proposal_ids)})
+    - "score": an integer from 0 to 5, where 5 is Excellent and 0 is Insufficient
+    - "reasoning_ar": a detailed justification in Arabic
+    - "reasoning_en": the same justification in clear English
+    """
+
+    return [
+        {"role": "system", "content": "You are an expert bilingual analyst who compares and scores documents against a formal rubric. You answer with valid JSON only."},
+        {"role": "user", "content": prompt}
+    ]
+
+def score_criteria_batch(
+    criteria: List[Dict[str, Any]],
+    excerpts: Dict[str, List[str]],
+    use_cache: bool = True
+) -> str:
+    """
+    Uses the Kimi model to score proposals against several criteria in one
+    call (see build_batch_scoring_messages) and returns the raw JSON answer.
+    """
+    try:
+        return _chat_completion(
+            messages=build_batch_scoring_messages(criteria, excerpts),
+            temperature=0.1, # Low temperature for factual scoring
+            use_cache=use_cache,
+        )
+
+    except Exception as e:
+        print(f"❌ Kimi batch scoring error: {e}")
+        return None
+
+def stream_criteria_batch(
+    criteria: List[Dict[str, Any]],
+    excerpts: Dict[str, List[str]],
+    use_cache: bool = True
+) -> Iterator[str]:
+    """Streaming form of score_criteria_batch (see JsonItemStream). Raises if the stream fails."""
+    try:
+        yield from _chat_completion_stream(
+            build_batch_scoring_messages(criteria, excerpts),
+            temperature=0.1, # Low temperature for factual scoring
+            use_cache=use_cache,
+        )
+    except Exception as e:
+        print(f"❌ Kimi batch scoring error: {e}")
+        raise
+
+def score_proposals_with_rag(
+    criterion: str, 
+    rubric: str, 
+    proposal_1_context: str, 
+    proposal_2_context: str, 
+    num_proposals: int = 2,
+    use_cache: bool = True
+) -> str:
+    """Two-proposal form of score_proposals, kept for existing callers."""
+    return score_proposals(
+        criterion,
+        rubric,
+        {"Prop_1": proposal_1_context, "Prop_2": proposal_2_context},
+        use_cache=use_cache,
+    )
@@ -0,0 +1,304 @@
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Per-document BM25 indexes, persisted as one .npz per doc_hash; empty keeps them in memory only
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(".cache", "lexical"))
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX", "1").lower() not in ("0", "false", "no")
+LEXICAL_INDEX_CACHE_DOCS = int(os.getenv("LEXICAL_INDEX_CACHE_DOCS", "32"))  # loaded indexes kept in memory
+
+# BM25 parameters (Robertson/Lucene defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant: a hit ranked r in one list contributes 1 / (RRF_K + r)
+RRF_K = 60
+
+# Tokens longer than this are ids, hashes or extraction noise rather than words
+LEXICAL_MAX_TOKEN_CHARS = 40
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+# Harakat, superscript alef and Quranic marks; tatweel is a pure stretching character
+_ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_LETTERS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",  # hamza/madda/wasla alef -> alef
+    "ى": "ي",  # alef maqsura -> ya
+    "ة": "ه",  # ta marbuta -> ha
+    "ؤ": "و",  # hamza on waw -> waw
+    "ئ": "ي",  # hamza on ya -> ya
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + d): str(d) for d in range(10)},  # Extended (Persian) digits
+})
+# Definite article with its attached conjunctions/prepositions (after normalization), longest first
+_ARABIC_ARTICLES = ("وال", "بال", "كال", "فال", "ال", "لل")
+
+def normalize_arabic(text: str) -> str:
+    """
+    Folds the spelling variants that split one Arabic word into several
+    index terms: diacritics and tatweel are removed, alef/ya/ta marbuta/hamza
+    forms are unified and Arabic-Indic digits become ASCII. Latin text is
+    lowercased.
+    """
+    return _ARABIC_MARKS.sub("", text).translate(_ARABIC_LETTERS).lower()
+
+def tokenize(text: str) -> List[str]:
+    """Normalized index terms of a text; the Arabic definite article is stripped (light stemming)."""
+    tokens = []
+    for token in _TOKEN.findall(normalize_arabic(text)):
+        if len(token) > LEXICAL_MAX_TOKEN_CHARS:
+            continue
+        for article in _ARABIC_ARTICLES:
+            if token.startswith(article) and len(token) - len(article) >= 2:
+                token = token[len(article):]
+                break
+        tokens.append(token)
+    return tokens
+
+class LexicalIndex:
+    """
+    Immutable BM25 index over one document's chunks, held as flat NumPy
+    arrays: a postings list per term in CSR form (term_ptr into postings/tfs),
+    chunk lengths, and the chunk texts and page metadata needed to return
+    hits without a vector store round-trip. Term weights are precomputed on
+    load, so a query is a few slice additions per term.
+    """
+
+    _ARRAYS = ("vocab", "term_ptr", "postings", "tfs", "doc_len", "text_bytes", "text_ptr",
+               "page_number", "page_end", "chunk_index", "refs", "refs_ptr")
+
+    def __init__(self, arrays: Dict[str, "np.ndarray"]):
+        import numpy as np
+        for name in self._ARRAYS:
+            setattr(self, name, arrays[name])
+        self._terms = {term: i for i, term in enumerate(self.vocab.tolist())}
+        n_chunks = len(self.doc_len)
+        df = np.diff(self.term_ptr)
+        idf = np.log1p((n_chunks - df + 0.5) / (df + 0.5))
+        avg_len = float(self.doc_len.mean()) if n_chunks else 0.0
+        tf = self.tfs.astype(np.float32)
+        dl = self.doc_len[self.postings].astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / (avg_len or 1.0))
+        self._weights = (np.repeat(idf, df) * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        import numpy as np
+        with np.load(path, allow_pickle=False) as data:
+            return cls({name: data[name] for name in cls._ARRAYS})
+
+    def save(self, path: str):
+        """Writes the arrays to path atomically."""
+        import numpy as np
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **{name: getattr(self, name) for name in self._ARRAYS})
+        os.replace(tmp_path, path)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Returns up to k (chunk row, BM25 score) pairs, best first; chunks sharing no term are left out."""
+        term_ids = {self._terms[t] for t in tokenize(query) if t in self._terms}
+        if not term_ids or k <= 0:
+            return []
+        import numpy as np
+        scores = np.zeros(len(self), dtype=np.float32)
+        for t in term_ids:
+            start, end = self.term_ptr[t], self.term_ptr[t + 1]
+            # A term's postings are distinct chunks, so plain fancy-index addition is safe
+            scores[self.postings[start:end]] += self._weights[start:end]
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(row), float(scores[row])) for row in matched]
+
+    def hit(self, row: int, proposal_id: str, score: float) -> Dict[str, Any]:
+        """Builds a hit in the vector store's format for one chunk row."""
+        text = bytes(self.text_bytes[self.text_ptr[row]:self.text_ptr[row + 1]]).decode("utf-8")
+        return {
+            "proposal_id": proposal_id,
+            "page_number": int(self.page_number[row]),
+            "page_end": int(self.page_end[row]),
+            "page_refs": self.refs[self.refs_ptr[row]:self.refs_ptr[row + 1]].tolist(),
+            "text": text,
+            "score": score,
+        }
+
+class LexicalIndexBuilder:
+    """
+    Accumulates one document's chunks window by window during ingestion
+    (see ingest_proposal) as compact per-chunk term counts, then inverts them
+    into a LexicalIndex.
+    """
+
+    def __init__(self):
+        self._vocab: Dict[str, int] = {}
+        self._chunk_terms = array("i")
+        self._chunk_tfs = array("i")
+        self._chunk_ptr = array("q", [0])
+        self._doc_len = array("i")
+        self._texts = bytearray()
+        self._text_ptr = array("q", [0])
+        self._page_number = array("i")
+        self._page_end = array("i")
+        self._chunk_index = array("i")
+        self._refs: List[List[int]] = []
+
+    def add(self, chunks: Iterable[Dict[str, Any]]):
+        for chunk in chunks:
+            tokens = tokenize(chunk["text"])
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term = self._vocab.setdefault(token, len(self._vocab))
+                counts[term] = counts.get(term, 0) + 1
+            self._chunk_terms.extend(counts.keys())
+            self._chunk_tfs.extend(counts.values())
+            self._chunk_ptr.append(len(self._chunk_terms))
+            self._doc_len.append(len(tokens))
+            self._texts.extend(chunk["text"].encode("utf-8"))
+            self._text_ptr.append(len(self._texts))
+            self._page_number.append(chunk["page_number"])
+            self._page_end.append(chunk.get("page_end", chunk["page_number"]))
+            self._chunk_index.append(chunk["chunk_index"])
+            self._refs.append(list(chunk.get("page_refs", [chunk["page_number"]])))
+
+    def update_page_refs(self, refs: Dict[Tuple[int, int], List[int]]):
+        """Same as VectorStore.update_page_refs, for chunks already added."""
+        for row, key in enumerate(zip(self._page_number, self._chunk_index)):
+            if key in refs:
+                self._refs[row] = sorted(refs[key])
+
+    def build(self) -> LexicalIndex:
+        import numpy as np
+        n_terms = len(self._vocab)
+        terms = np.frombuffer(self._chunk_terms, dtype=np.int32) if self._chunk_terms else np.zeros(0, dtype=np.int32)
+        tfs = np.frombuffer(self._chunk_tfs, dtype=np.int32) if self._chunk_tfs else np.zeros(0, dtype=np.int32)
+        rows = np.repeat(np.arange(len(self._doc_len), dtype=np.int32), np.diff(np.asarray(self._chunk_ptr, dtype=np.int64)))
+        # Invert chunk -> terms into term -> chunks; a stable sort keeps each postings list in chunk order
+        order = np.argsort(terms, kind="stable")
+        vocab = sorted(self._vocab, key=self._vocab.get)
+        return LexicalIndex({
+            "vocab": np.asarray(vocab, dtype=str) if vocab else np.zeros(0, dtype="<U1"),
+            "term_ptr": np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=n_terms))]).astype(np.int64),
+            "postings": rows[order],
+            "tfs": np.minimum(tfs[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            "doc_len": np.asarray(self._doc_len, dtype=np.int32),
+            "text_bytes": np.frombuffer(bytes(self._texts), dtype=np.uint8),
+            "text_ptr": np.asarray(self._text_ptr, dtype=np.int64),
+            "page_number": np.asarray(self._page_number, dtype=np.int32),
+            "page_end": np.asarray(self._page_end, dtype=np.int32),
+            "chunk_index": np.asarray(self._chunk_index, dtype=np.int32),
+            "refs": np.asarray([p for refs in self._refs for p in refs], dtype=np.int32),
+            "refs_ptr": np.concatenate([[0], np.cumsum([len(refs) for refs in self._refs])]).astype(np.int64),
+        })
+
+# Loaded indexes by doc_hash (least recently used first) and the doc_hash ingested for each stored proposal id
+_indexes: "OrderedDict[str, LexicalIndex]" = OrderedDict()
+_documents: Dict[str, str] = {}
+_lock = threading.Lock()
+
+def _index_path(doc_hash: str) -> Optional[str]:
+    return os.path.join(LEXICAL_INDEX_PATH, f"{doc_hash}.npz") if LEXICAL_INDEX_PATH else None
+
+def _remember(doc_hash: str, index: LexicalIndex):
+    _indexes[doc_hash] = index
+    _indexes.move_to_end(doc_hash)
+    while len(_indexes) > max(1, LEXICAL_INDEX_CACHE_DOCS):
+        _indexes.popitem(last=False)
+
+def save_lexical_index(doc_hash: str, index: LexicalIndex):
+    """Keeps the index for doc_hash in memory and, with LEXICAL_INDEX_PATH set, on disk."""
+    path = _index_path(doc_hash)
+    if path:
+        os.makedirs(LEXICAL_INDEX_PATH, exist_ok=True)
+        index.save(path)
+    with _lock:
+        _remember(doc_hash, index)
+
+def has_lexical_index(doc_hash: str) -> bool:
+    path = _index_path(doc_hash)
+    with _lock:
+        return doc_hash in _indexes or bool(path and os.path.exists(path))
+
+def get_lexical_index(doc_hash: str) -> Optional[LexicalIndex]:
+    """Returns the index built for doc_hash, loading it from disk on first use; None if there is none."""
+    with _lock:
+        index = _indexes.get(doc_hash)
+        if index is not None:
+            _indexes.move_to_end(doc_hash)
+            return index
+        path = _index_path(doc_hash)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            index = LexicalIndex.load(path)
+        except Exception as e:
+            print(f"⚠️ Unreadable lexical index {path}: {e}")
+            return None
+        _remember(doc_hash, index)
+        return index
+
+def delete_lexical_index(doc_hash: str):
+    """Drops the index for doc_hash from memory and disk."""
+    path = _index_path(doc_hash)
+    with _lock:
+        _indexes.pop(doc_hash, None)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def discard_document(proposal_id: str, doc_hash: Optional[str]):
+    """
+    Unregisters a stored proposal id whose chunks were deleted, and deletes
+    the index of doc_hash unless another registered id still holds it. A
+    document whose index was deleted anyway is re-ingested on its next run.
+    """
+    with _lock:
+        _documents.pop(proposal_id, None)
+        in_use = doc_hash in _documents.values()
+    if doc_hash and not in_use:
+        delete_lexical_index(doc_hash)
+
+def register_document(proposal_id: str, doc_hash: Optional[str]):
+    """Records which document a stored proposal id holds, so searches skip the store lookup."""
+    with _lock:
+        if doc_hash is None:
+            _documents.pop(proposal_id, None)
+        else:
+            _documents[proposal_id] = doc_hash
+
+def document_hash(proposal_id: str, vector_store=None) -> Optional[str]:
+    """doc_hash registered for a stored proposal id, asking the vector store once if this process didn't ingest it."""
+    with _lock:
+        if proposal_id in _documents:
+            return _documents[proposal_id]
+    if vector_store is None:
+        return None
+    doc_hash = vector_store.get_document_hash(proposal_id)
+    register_document(proposal_id, doc_hash)
+    return doc_hash
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Merges ranked hit lists of the same proposal (e.g. vector and BM25) by
+    reciprocal rank: each hit scores the sum of 1 / (k + rank) over the lists
+    it appears in, so rankings on different scales combine without
+    calibration. Hits are matched by text; each keeps the first list's fields
+    and gets the fused score.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    scores: Dict[str, float] = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            key = hit.get("text") or ""
+            fused.setdefault(key, hit)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(fused, key=lambda key: -scores[key])
+    return [{**fused[key], "score": scores[key]} for key in ordered]
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+# On-disk cache for deterministic LLM calls, keyed by hash(model, messages, temperature)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite3"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))  # one week
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    """Returns a stable sha256 key for one chat completion request."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """
+    Persistent LLM response cache backed by SQLite. Entries expire after
+    ttl_seconds; once max_entries is exceeded the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: int = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, cache_key: str) -> Optional[str]:
+        """Returns the cached response, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE cache_key = ?", (cache_key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, cache_key: str, model: str, response: str):
+        """Stores a response and enforces the TTL and size bounds."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (cache_key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (cache_key, model, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                """DELETE FROM responses WHERE cache_key IN (
+                    SELECT cache_key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters for this process plus the number of stored entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Returns the process-wide LLM response cache, or None when caching is disabled."""
+    global _cache
+    if LLM_CACHE_DISABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = LLMResponseCache()
+            except Exception as e:
+                print(f"⚠️ LLM response cache unavailable ({e}); continuing without it.")
+                return None
+        return _cache
@@ -0,0 +1,387 @@
+import os
+import json
+import math
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pymilvus import connections, utility, Collection, FieldSchema, CollectionSchema, DataType
+from pymilvus.client.types import LoadState
+from .utils import EMBEDDING_DIM
+from .vector_store import VectorStore
+
+load_dotenv()
+
+# Milvus/Zilliz Cloud Connection
+COLLECTION_NAME = "proposal_chunks"
+MILVUS_ALIAS = "default"
+HEALTH_CHECK_TIMEOUT = 5  # seconds
+
+# Vector index selection by collection size (see choose_index_params)
+FLAT_MAX_CHUNKS = 20_000        # brute force is exact and fast enough below this
+IVF_MAX_CHUNKS = 2_000_000      # IVF_FLAT up to here, HNSW beyond
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+# The index type only changes once the size is this fraction past a boundary, so a
+# collection hovering around FLAT_MAX_CHUNKS doesn't flip between index types
+INDEX_HYSTERESIS = 0.25
+
+PAGE_REFS_MAX_LENGTH = 8192
+
+def encode_page_refs(pages: List[int]) -> str:
+    """Serializes page_refs as a JSON list that fits the VARCHAR field."""
+    pages = sorted(set(pages))
+    encoded = json.dumps(pages)
+    while len(encoded) > PAGE_REFS_MAX_LENGTH:
+        pages = pages[: len(pages) // 2]
+        encoded = json.dumps(pages)
+    return encoded
+
+def quote_milvus_str(value: str) -> str:
+    """Quotes a string literal for use in a Milvus boolean expression."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _index_type_for(num_chunks: float) -> str:
+    if num_chunks <= FLAT_MAX_CHUNKS:
+        return "FLAT"
+    return "IVF_FLAT" if num_chunks <= IVF_MAX_CHUNKS else "HNSW"
+
+def choose_index_params(num_chunks: int, current_type: Optional[str] = None) -> dict:
+    """
+    Picks the vector index for a collection of num_chunks vectors:
+    FLAT for small collections, IVF_FLAT with nlist ~ 4*sqrt(n) (rounded to a
+    power of two) for medium ones and HNSW for very large ones. The
+    current_type is kept while num_chunks is within INDEX_HYSTERESIS of its
+    size class.
+    """
+    index_type = _index_type_for(num_chunks)
+    if current_type and index_type != current_type and current_type in (
+        _index_type_for(num_chunks * (1 - INDEX_HYSTERESIS)),
+        _index_type_for(num_chunks * (1 + INDEX_HYSTERESIS)),
+    ):
+        index_type = current_type
+    if index_type == "FLAT":
+        return {"index_type": "FLAT", "metric_type": "COSINE", "params": {}}
+    if index_type == "IVF_FLAT":
+        nlist = 2 ** round(math.log2(4 * math.sqrt(num_chunks)))
+        nlist = int(min(65536, max(64, nlist)))
+        return {"index_type": "IVF_FLAT", "metric_type": "COSINE", "params": {"nlist": nlist}}
+    return {
+        "index_type": "HNSW",
+        "metric_type": "COSINE",
+        "params": {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION}
+    }
+
+def search_params_for_index(index_params: dict, k: int) -> dict:
+    """Returns search parameters matching the index the collection was built with."""
+    index_type = index_params.get("index_type", "FLAT")
+    params = index_params.get("params") or {}
+    if isinstance(params, str):
+        params = json.loads(params)
+    if index_type.startswith("IVF"):
+        nlist = int(params.get("nlist", 1024))
+        # Probe ~1/16th of the clusters, enough for high recall at this scale
+        return {"metric_type": "COSINE", "params": {"nprobe": max(8, min(nlist, nlist // 16))}}
+    if index_type == "HNSW":
+        return {"metric_type": "COSINE", "params": {"ef": max(64, 2 * k)}}
+    return {"metric_type": "COSINE", "params": {}}
+
+def get_index_params(milvus_collection: Collection) -> dict:
+    """Returns the parameters of the collection's vector index ({} if there is none)."""
+    for index in milvus_collection.indexes:
+        if index.field_name == "embedding":
+            return dict(index.params)
+    return {}
+
+class _RebuildLock:
+    """Lets searches run concurrently but never while the index is being rebuilt."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._searches = 0
+        self._rebuilding = False
+
+    @contextmanager
+    def searching(self):
+        with self._cond:
+            while self._rebuilding:
+                self._cond.wait()
+            self._searches += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._searches -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def rebuilding(self):
+        # New searches wait from here on; the rebuild starts once running ones are done
+        with self._cond:
+            while self._rebuilding:
+                self._cond.wait()
+            self._rebuilding = True
+            while self._searches:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._rebuilding = False
+                self._cond.notify_all()
+
+# Jobs share the collection within this process: one index check at a time, rebuilds exclusive of searches
+_index_lock = _RebuildLock()
+_ensure_lock = threading.Lock()
+_index_generation = 0  # bumped on every rebuild so stores refresh their recorded index
+
+def ensure_vector_index(milvus_collection: Collection) -> dict:
+    """
+    Rebuilds the vector index if the collection has grown or shrunk into a
+    different index type (see choose_index_params). Call after ingestion.
+    Returns the parameters of the index now in place.
+    """
+    global _index_generation
+    with _ensure_lock:
+        current = {}
+        try:
+            milvus_collection.flush()
+            num_chunks = milvus_collection.num_entities
+            current = get_index_params(milvus_collection)
+            desired = choose_index_params(num_chunks, current.get("index_type"))
+            if current.get("index_type") == desired["index_type"]:
+                print(f"✅ Vector index {desired['index_type']} kept for {num_chunks} chunks.")
+                return current
+
+            print(f"⏳ Rebuilding vector index as {desired['index_type']} {desired['params']} for {num_chunks} chunks...")
+            with _index_lock.rebuilding():
+                milvus_collection.release()
+                if current:
+                    milvus_collection.drop_index()
+                milvus_collection.create_index(field_name="embedding", index_params=desired)
+                milvus_collection.load()
+                _index_generation += 1
+            print("✅ Vector index rebuilt and collection reloaded.")
+            return desired
+        except Exception as e:
+            print(f"❌ Error rebuilding vector index: {e}")
+            return current
+
+def connect_milvus(force: bool = False):
+    """Opens the Zilliz Cloud connection unless one is already open (force reconnects)."""
+    if force:
+        try:
+            connections.disconnect(MILVUS_ALIAS)
+        except Exception:
+            pass
+    elif connections.has_connection(MILVUS_ALIAS):
+        return
+    connections.connect(
+        alias=MILVUS_ALIAS,
+        uri=os.getenv("ZILLIZ_ENDPOINT"),
+        token=os.getenv("ZILLIZ_TOKEN"),
+        secure=True
+    )
+
+def initialize_milvus(reset: bool = False):
+    """
+    Connects to Milvus/Zilliz Cloud and ensures the collection exists.
+    An existing collection with the current schema is reused so documents that
+    were already ingested can be skipped; pass reset=True to drop it first.
+    """
+    print("⏳ Connecting to Zilliz Cloud...")
+    try:
+        connect_milvus()
+        print("✅ Zilliz Cloud connection established.")
+        
+        # Define Collection Schema
+        fields = [
+            FieldSchema(name="pk", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="proposal_id", dtype=DataType.VARCHAR, max_length=256),
+            FieldSchema(name="doc_hash", dtype=DataType.VARCHAR, max_length=64), # sha256 of the source PDF
+            FieldSchema(name="page_number", dtype=DataType.INT64),
+            FieldSchema(name="page_end", dtype=DataType.INT64), # last page a chunk spans
+            FieldSchema(name="chunk_index", dtype=DataType.INT64),
+            FieldSchema(name="page_refs", dtype=DataType.VARCHAR, max_length=PAGE_REFS_MAX_LENGTH), # JSON list of pages with the same content
+            FieldSchema(name="text_content", dtype=DataType.VARCHAR, max_length=65535), # Use a large max_length for text
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBEDDING_DIM)
+        ]
+        schema = CollectionSchema(fields, description="Proposal chunks for RAG")
+        
+        if utility.has_collection(COLLECTION_NAME):
+            existing = Collection(COLLECTION_NAME)
+            existing_fields = {f.name for f in existing.schema.fields}
+            if reset or existing_fields != {f.name for f in fields}:
+                # Collections created with an older schema can't be reused
+                utility.drop_collection(COLLECTION_NAME)
+                print(f"⚠️ Dropped existing collection: {COLLECTION_NAME}")
+            else:
+                if utility.load_state(COLLECTION_NAME) != LoadState.Loaded:
+                    existing.load()
+                print(f"✅ Reusing existing collection '{COLLECTION_NAME}' ({existing.num_entities} chunks).")
+                return existing
+
+        collection = Collection(name=COLLECTION_NAME, schema=schema)
+        
+        # Create an index on the vector field; ensure_vector_index resizes it after ingestion
+        index_params = choose_index_params(0)
+        collection.create_index(field_name="embedding", index_params=index_params)
+        collection.load()
+        
+        print(f"✅ Collection '{COLLECTION_NAME}' created and loaded.")
+        return collection
+        
+    except Exception as e:
+        print(f"❌ Error connecting or setting up Milvus/Zilliz: {e}")
+        return None
+
+def get_ingested_hash(proposal_id: str, milvus_collection: Collection):
+    """Returns the doc_hash stored for a proposal, or None if it has no chunks."""
+    rows = milvus_collection.query(
+        expr=f"proposal_id == {quote_milvus_str(proposal_id)}",
+        output_fields=["doc_hash"],
+        limit=1
+    )
+    return rows[0]["doc_hash"] if rows else None
+
+def get_milvus_collection() -> Collection:
+    """Connects (reusing an open connection) and returns the loaded Milvus collection."""
+    try:
+        connect_milvus()
+        collection = Collection(COLLECTION_NAME)
+        if utility.load_state(COLLECTION_NAME) != LoadState.Loaded:
+            collection.load()
+        return collection
+    except Exception as e:
+        print(f"❌ Failed to connect to or load Milvus collection: {e}")
+        return None
+
+class MilvusVectorStore(VectorStore):
+    """VectorStore backed by the Milvus/Zilliz Cloud proposal_chunks collection."""
+
+    name = "milvus"
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        # Index parameters recorded by finalize(), read from Milvus once otherwise
+        self.index_params: Optional[dict] = None
+        self._index_generation = _index_generation
+
+    def get_document_hash(self, proposal_id: str) -> Optional[str]:
+        return get_ingested_hash(proposal_id, self.collection)
+
+    def delete_document(self, proposal_id: str):
+        self.collection.delete(expr=f"proposal_id == {quote_milvus_str(proposal_id)}")
+
+    def insert_chunks(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]) -> int:
+        entities = [
+            [item['proposal_id'] for item in chunks], # proposal_id
+            [item['doc_hash'] for item in chunks],    # doc_hash
+            [item['page_number'] for item in chunks], # page_number
+            [item.get('page_end', item['page_number']) for item in chunks], # page_end
+            [item['chunk_index'] for item in chunks], # chunk_index
+            [encode_page_refs(item.get('page_refs', [item['page_number']])) for item in chunks], # page_refs
+            [item['text'] for item in chunks],        # text_content
+            embeddings                                # embedding
+        ]
+        result = self.collection.insert(entities)
+        return len(result.primary_keys)
+
+    def update_page_refs(self, proposal_id: str, refs: Dict[Tuple[int, int], List[int]]):
+        # Milvus rows can't be patched in place: read them back, delete, re-insert
+        fields = ["pk", "proposal_id", "doc_hash", "page_number", "page_end", "chunk_index", "text_content", "embedding"]
+        keys = list(refs)
+        for start in range(0, len(keys), 100):
+            part = keys[start:start + 100]
+            chunk_indexes = sorted({chunk_index for _, chunk_index in part})
+            rows = self.collection.query(
+                expr=f"proposal_id == {quote_milvus_str(proposal_id)} and chunk_index in {chunk_indexes}",
+                output_fields=fields
+            )
+            rows = [r for r in rows if (r["page_number"], r["chunk_index"]) in refs]
+            if not rows:
+                continue
+            self.collection.delete(expr=f"pk in {[r['pk'] for r in rows]}")
+            chunks = [
+                {
+                    "proposal_id": r["proposal_id"],
+                    "doc_hash": r["doc_hash"],
+                    "page_number": r["page_number"],
+                    "page_end": r["page_end"],
+                    "chunk_index": r["chunk_index"],
+                    "page_refs": refs[(r["page_number"], r["chunk_index"])],
+                    "text": r["text_content"],
+                }
+                for r in rows
+            ]
+            self.insert_chunks(chunks, [r["embedding"] for r in rows])
+
+    def finalize(self):
+        # Size the vector index to the number of chunks now in the collection
+        self.index_params = ensure_vector_index(self.collection)
+        self._index_generation = _index_generation
+
+    def health_check(self) -> bool:
+        try:
+            return utility.load_state(COLLECTION_NAME, using=MILVUS_ALIAS, timeout=HEALTH_CHECK_TIMEOUT) == LoadState.Loaded
+        except Exception as e:
+            print(f"⚠️ Milvus health check failed: {e}")
+            return False
+
+    def reconnect(self) -> bool:
+        try:
+            connect_milvus(force=True)
+        except Exception as e:
+            print(f"❌ Failed to reconnect to Zilliz Cloud: {e}")
+            return False
+        collection = initialize_milvus()
+        if collection is None:
+            return False
+        self.collection = collection
+        self.index_params = None
+        return True
+
+    def _search_proposal(self, query_vectors: List[List[float]], proposal_id: str, k: int, search_params: Dict[str, Any]):
+        """Runs one Milvus search with nq = len(query_vectors), restricted to a single proposal."""
+        return self.collection.search(
+            data=query_vectors, 
+            anns_field="embedding", 
+            param=search_params, 
+            limit=k,
+            expr=f"proposal_id == {quote_milvus_str(proposal_id)}",
+            output_fields=["proposal_id", "text_content", "page_number", "page_end", "page_refs"]
+        )
+
+    def search(self, query_vectors: List[List[float]], proposal_ids: List[str], k: int) -> List[Dict[str, List[Dict[str, Any]]]]:
+        with _index_lock.searching():
+            # Match search parameters to the index chosen at ingestion time
+            if self.index_params is None or self._index_generation != _index_generation:
+                self.index_params = get_index_params(self.collection)
+                self._index_generation = _index_generation
+            search_params = search_params_for_index(self.index_params, k)
+            # One filtered search per proposal, run in parallel
+            with ThreadPoolExecutor(max_workers=max(1, len(proposal_ids))) as executor:
+                futures = {
+                    p_id: executor.submit(self._search_proposal, query_vectors, p_id, k, search_params)
+                    for p_id in proposal_ids
+                }
+                results = {p_id: future.result() for p_id, future in futures.items()}
+
+        hits: List[Dict[str, List[Dict[str, Any]]]] = []
+        for q in range(len(query_vectors)):
+            per_proposal = {}
+            for p_id in proposal_ids:
+                per_proposal[p_id] = [
+                    {
+                        "proposal_id": p_id,
+                        "page_number": hit.entity.get('page_number'),
+                        "page_end": hit.entity.get('page_end'),
+                        "page_refs": json.loads(hit.entity.get('page_refs') or "[]"),
+                        "text": hit.entity.get('text_content') or "",
+                        "score": float(hit.distance),  # COSINE similarity, higher is better
+                    }
+                    for hit in results[p_id][q]
+                ]
+            hits.append(per_proposal)
+        return hits
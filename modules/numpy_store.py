@@ -0,0 +1,188 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from .utils import EMBEDDING_DIM
+from .vector_store import VectorStore
+
+# Directory for the persisted matrix + metadata; empty keeps the store in memory only
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", os.path.join(".cache", "numpy_store"))
+
+_instances: Dict[str, "NumpyVectorStore"] = {}
+_instances_lock = threading.Lock()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalizes rows so a dot product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process VectorStore: normalized float32 embeddings in one NumPy matrix
+    (memory-mapped from disk when a path is set) plus a parallel metadata list.
+    Search scores every query against every chunk with a single matrix
+    multiply and takes a per-proposal top k with argpartition.
+    """
+
+    name = "numpy"
+
+    def __init__(self, path: Optional[str] = None, dim: int = EMBEDDING_DIM):
+        self.path = path or None
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._pending: List[np.ndarray] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._rows_by_proposal: Dict[str, np.ndarray] = {}
+        self._dirty = False
+        if self.path and os.path.exists(self._matrix_path()):
+            self._load()
+
+    @classmethod
+    def open(cls, path: Optional[str] = NUMPY_STORE_PATH, reset: bool = False) -> "NumpyVectorStore":
+        """Returns the process-wide store for path, optionally wiping it first."""
+        key = path or ":memory:"
+        with _instances_lock:
+            store = _instances.get(key)
+            if store is None or reset:
+                if reset and path and os.path.isdir(path):
+                    shutil.rmtree(path)
+                store = cls(path)
+                _instances[key] = store
+        print(f"✅ NumPy vector store ready ({len(store._meta)} chunks, {'disk: ' + path if path else 'in-memory'}).")
+        return store
+
+    def _matrix_path(self) -> str:
+        return os.path.join(self.path, "embeddings.npy")
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, "metadata.json")
+
+    def _load(self):
+        self._matrix = np.load(self._matrix_path(), mmap_mode="r")
+        with open(self._meta_path(), "r", encoding="utf-8") as f:
+            self._meta = json.load(f)
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuilds the proposal_id -> row indices lookup."""
+        rows: Dict[str, List[int]] = {}
+        for i, item in enumerate(self._meta):
+            rows.setdefault(item["proposal_id"], []).append(i)
+        self._rows_by_proposal = {p_id: np.asarray(idx, dtype=np.int64) for p_id, idx in rows.items()}
+
+    def _consolidate(self):
+        """Appends vectors inserted since the last search/persist to the matrix."""
+        if self._pending:
+            self._matrix = np.vstack([np.asarray(self._matrix), *self._pending])
+            self._pending = []
+
+    def get_document_hash(self, proposal_id: str) -> Optional[str]:
+        with self._lock:
+            rows = self._rows_by_proposal.get(proposal_id)
+            if rows is None or len(rows) == 0:
+                return None
+            return self._meta[int(rows[0])]["doc_hash"]
+
+    def delete_document(self, proposal_id: str):
+        with self._lock:
+            if proposal_id not in self._rows_by_proposal:
+                return
+            self._consolidate()
+            keep = np.ones(len(self._meta), dtype=bool)
+            keep[self._rows_by_proposal[proposal_id]] = False
+            self._matrix = np.asarray(self._matrix)[keep]
+            self._meta = [item for item, k in zip(self._meta, keep) if k]
+            self._reindex()
+            self._dirty = True
+
+    def insert_chunks(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]) -> int:
+        if not chunks:
+            return 0
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            start = len(self._meta)
+            self._pending.append(vectors)
+            self._dirty = True
+            for item in chunks:
+                self._meta.append({
+                    "proposal_id": item["proposal_id"],
+                    "doc_hash": item["doc_hash"],
+                    "page_number": item["page_number"],
+                    "page_end": item.get("page_end", item["page_number"]),
+                    "chunk_index": item["chunk_index"],
+                    "page_refs": item.get("page_refs", [item["page_number"]]),
+                    "text": item["text"],
+                })
+            for p_id in {item["proposal_id"] for item in chunks}:
+                new_rows = [start + i for i, item in enumerate(chunks) if item["proposal_id"] == p_id]
+                existing = self._rows_by_proposal.get(p_id, np.zeros(0, dtype=np.int64))
+                self._rows_by_proposal[p_id] = np.concatenate([existing, np.asarray(new_rows, dtype=np.int64)])
+        return len(chunks)
+
+    def update_page_refs(self, proposal_id: str, refs: Dict[Tuple[int, int], List[int]]):
+        with self._lock:
+            for row in self._rows_by_proposal.get(proposal_id, []):
+                item = self._meta[int(row)]
+                key = (item["page_number"], item["chunk_index"])
+                if key in refs:
+                    item["page_refs"] = sorted(refs[key])
+                    self._dirty = True
+
+    def finalize(self):
+        """Writes the matrix and metadata to disk (atomically) and re-maps the matrix."""
+        with self._lock:
+            self._consolidate()
+            if not self.path or not self._dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            tmp_matrix = self._matrix_path() + ".tmp.npy"
+            tmp_meta = self._meta_path() + ".tmp"
+            np.save(tmp_matrix, np.asarray(self._matrix, dtype=np.float32))
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(self._meta, f, ensure_ascii=False)
+            os.replace(tmp_matrix, self._matrix_path())
+            os.replace(tmp_meta, self._meta_path())
+            self._matrix = np.load(self._matrix_path(), mmap_mode="r")
+            self._dirty = False
+            print(f"✅ NumPy vector store saved: {len(self._meta)} chunks in {self.path}")
+
+    def search(self, query_vectors: List[List[float]], proposal_ids: List[str], k: int) -> List[Dict[str, List[Dict[str, Any]]]]:
+        with self._lock:
+            self._consolidate()
+            matrix = self._matrix
+            meta = self._meta
+            rows_by_proposal = dict(self._rows_by_proposal)
+
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        # One matrix multiply scores every criterion against every chunk
+        scores = queries @ np.asarray(matrix).T if len(meta) else np.zeros((len(queries), 0), dtype=np.float32)
+
+        hits: List[Dict[str, List[Dict[str, Any]]]] = [{} for _ in range(len(queries))]
+        for p_id in proposal_ids:
+            rows = rows_by_proposal.get(p_id)
+            if rows is None or len(rows) == 0 or k <= 0:
+                for per_query in hits:
+                    per_query[p_id] = []
+                continue
+            sub = scores[:, rows]
+            kk = min(k, len(rows))
+            # Unordered top kk per query, then sort just those kk
+            top = np.argpartition(-sub, kk - 1, axis=1)[:, :kk]
+            for q in range(len(queries)):
+                ordered = top[q][np.argsort(-sub[q, top[q]])]
+                hits[q][p_id] = [
+                    {
+                        "proposal_id": p_id,
+                        "page_number": meta[int(rows[j])]["page_number"],
+                        "page_end": meta[int(rows[j])].get("page_end"),
+                        "page_refs": meta[int(rows[j])].get("page_refs"),
+                        "text": meta[int(rows[j])]["text"],
+                        "score": float(sub[q, j]),
+                    }
+                    for j in ordered
+                ]
+        return hits
@@ -1,115 +1,277 @@
 import os
-import fitz
+import hashlib
 from dotenv import load_dotenv
 from typing import List, Dict
-from pymilvus import connections, utility, Collection, FieldSchema, CollectionSchema, DataType
-from .utils import recursive_chunking, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_DIM, get_jina_embeddings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .utils import recursive_chunking, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_DIM, get_jina_embeddings, compute_file_hash
+from .utils import structure_aware_chunking, CHUNKER, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from .utils import iter_pdf_pages, create_pdf_extraction_pool, PDF_EXTRACT_WORKERS
+from .vector_store import VectorStore
+from .document_registry import get_document_registry, shared_document_id
+from .dedup import ChunkDeduplicator, strip_page_furniture, DEDUP_ENABLED
+from .lexical_index import LexicalIndexBuilder, LEXICAL_INDEX_ENABLED, save_lexical_index, has_lexical_index, register_document, discard_document, document_hash
 
 load_dotenv()
 
 # Jina embeddings will be called via HTTP helper in utils
 
-# Milvus/Zilliz Cloud Connection
-COLLECTION_NAME = "proposal_chunks"
+# Streaming ingestion: chunks per embed/insert window and windows embedded concurrently
+INGEST_WINDOW_CHUNKS = int(os.getenv("INGEST_WINDOW_CHUNKS", "256"))
+INGEST_MAX_PENDING_WINDOWS = int(os.getenv("INGEST_MAX_PENDING_WINDOWS", "2"))
+INGEST_MAX_CONCURRENT_PROPOSALS = int(os.getenv("INGEST_MAX_CONCURRENT_PROPOSALS", "4"))  # proposals ingested at once
 
-def initialize_milvus():
-    """Connects to Milvus/Zilliz Cloud and ensures the collection exists."""
-    print("⏳ Connecting to Zilliz Cloud...")
-    try:
-        connections.connect(
-            alias="default",
-            uri=os.getenv("ZILLIZ_ENDPOINT"),
-            token=os.getenv("ZILLIZ_TOKEN"),
-            secure=True 
-        )
-        print("✅ Zilliz Cloud connection established.")
-        
-        # Define Collection Schema
-        fields = [
-            FieldSchema(name="pk", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="proposal_id", dtype=DataType.VARCHAR, max_length=256),
-            FieldSchema(name="page_number", dtype=DataType.INT64),
-            FieldSchema(name="chunk_index", dtype=DataType.INT64),
-            FieldSchema(name="text_content", dtype=DataType.VARCHAR, max_length=65535), # Use a large max_length for text
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBEDDING_DIM)
-        ]
-        schema = CollectionSchema(fields, description="Proposal chunks for RAG")
-        
-        if utility.has_collection(COLLECTION_NAME):
-            utility.drop_collection(COLLECTION_NAME) # Clear existing data for a clean run
-            print(f"⚠️ Dropped existing collection: {COLLECTION_NAME}")
-
-        collection = Collection(name=COLLECTION_NAME, schema=schema)
-        
-        # Create an index on the vector field
-        index_params = {
-            "index_type": "IVF_FLAT", 
-            "metric_type": "COSINE", 
-            "params": {"nlist": 1024}
-        }
-        collection.create_index(field_name="embedding", index_params=index_params)
-        collection.load()
-        
-        print(f"✅ Collection '{COLLECTION_NAME}' created and loaded.")
-        return collection
-        
-    except Exception as e:
-        print(f"❌ Error connecting or setting up Milvus/Zilliz: {e}")
-        return None
+def ingestion_hash(file_hash: str) -> str:
+    """
+    Combines the PDF's sha256 with the chunking settings, so changing the
+    chunker re-ingests documents instead of keeping chunks cut the old way.
+    """
+    settings = f"{file_hash}:{CHUNKER}:{CHUNK_MAX_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{DEDUP_ENABLED}"
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()
+
+def iter_proposal_chunks(proposal_path: str, proposal_id: str, doc_hash: str, executor=None, chunker: str = CHUNKER, deduplicator: ChunkDeduplicator = None):
+    """
+    Extract → chunk stage: yields chunk dicts in document order. The default
+    "structured" chunker cuts on sentence/paragraph boundaries across pages;
+    "recursive" keeps the original fixed-size per-page slicing.
+
+    With a deduplicator, repeated headers/footers are stripped from pages
+    before chunking and near-duplicate chunks are dropped (their pages are
+    kept in the surviving chunk's page_refs).
+    """
+    pages = iter_pdf_pages(proposal_path, executor=executor)
+    if deduplicator is not None:
+        pages = strip_page_furniture(pages)
+        chunks = _chunk_pages(pages, proposal_id, doc_hash, chunker)
+        yield from deduplicator.filter(chunks)
+    else:
+        yield from _chunk_pages(pages, proposal_id, doc_hash, chunker)
+
+def _chunk_pages(pages, proposal_id: str, doc_hash: str, chunker: str):
+    if chunker == "recursive":
+        for page_num, text in pages:
+            if not text:
+                continue
+            for i, chunk_text in enumerate(recursive_chunking(text)):
+                yield {
+                    "text": chunk_text,
+                    "proposal_id": proposal_id,
+                    "doc_hash": doc_hash,
+                    "page_number": page_num,
+                    "page_end": page_num,
+                    "chunk_index": i
+                }
+        return
 
-def ingest_proposal(proposal_path: str, proposal_id: str, milvus_collection: Collection):
+    for chunk in structure_aware_chunking(pages):
+        chunk.update({"proposal_id": proposal_id, "doc_hash": doc_hash})
+        yield chunk
+
+def iter_windows(items, window_size: int = INGEST_WINDOW_CHUNKS):
+    """Groups a stream into lists of at most window_size items."""
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= window_size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def ingest_proposal(proposal_path: str, proposal_id: str, vector_store: VectorStore, force: bool = False, executor=None, file_hash: str = None):
     """
     Extracts text from PDF, chunks it, embeds it using Jina API, 
-    and inserts the vectors and metadata into Milvus.
+    and inserts the vectors and metadata into the vector store (Milvus or NumPy).
+
+    Ingestion is keyed by the sha256 of the PDF and the chunking settings (see
+    ingestion_hash): if the proposal's chunks were already ingested from
+    identical content, the whole step is skipped; if the content changed, the
+    old chunks are replaced. Pass force=True to re-ingest. Pass file_hash
+    (sha256 of the PDF) when it is already known, e.g. computed while the
+    file was uploaded, to skip re-reading the file.
+    With an executor (see create_pdf_extraction_pool), pages are extracted by
+    worker processes in parallel.
+
+    The stages run as a stream over windows of INGEST_WINDOW_CHUNKS chunks:
+    at most INGEST_MAX_PENDING_WINDOWS windows are being embedded at once, and
+    extraction pauses until the oldest one has been inserted. Memory stays
+    flat regardless of page count and early windows are searchable while
+    later pages are still being processed.
+
+    With LEXICAL_INDEX enabled, a BM25 index of the chunks is built along
+    the way and saved under the doc_hash (see lexical_index); a document
+    whose index is missing is re-ingested, which the embedding cache keeps
+    cheap.
     """
     print(f"\n--- 📄 Starting ingestion for {proposal_id} ({proposal_path}) ---")
-    all_chunks = []
-    
-    # 1. Extract Text
+
+    # 0. Skip documents whose content is already in the store
     try:
-        with fitz.open(proposal_path) as doc:
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text = page.get_text("text").strip()
-                if not text:
-                    continue
-                
-                # 2. Chunk Text
-                chunks = recursive_chunking(text)
-                
-                for i, chunk_text in enumerate(chunks):
-                    all_chunks.append({
-                        "text": chunk_text,
-                        "proposal_id": proposal_id,
-                        "page_number": page_num,
-                        "chunk_index": i
-                    })
-        print(f"✅ Extracted text and generated {len(all_chunks)} chunks.")
-        
+        doc_hash = ingestion_hash(file_hash or compute_file_hash(proposal_path))
+        ingested_hash = vector_store.get_document_hash(proposal_id)
+        if ingested_hash == doc_hash and not force and (has_lexical_index(doc_hash) or not LEXICAL_INDEX_ENABLED):
+            register_document(proposal_id, doc_hash)
+            print(f"✅ {proposal_id} is unchanged (sha256 {doc_hash[:12]}); skipping ingestion.")
+            return True
+        if ingested_hash is not None:
+            vector_store.delete_document(proposal_id)
+            discard_document(proposal_id, ingested_hash if ingested_hash != doc_hash else None)
+            print(f"♻️ Removed previous chunks for {proposal_id} ({'content changed' if ingested_hash != doc_hash else 're-ingesting'}).")
     except Exception as e:
-        print(f"❌ Error during PDF extraction/chunking: {e}")
-        return
+        print(f"❌ Error checking existing chunks for {proposal_id}: {e}")
+        return False
+
+    # 1-4. Extract → chunk → embed → insert, one window at a time
+    total_inserted = 0
+    deduplicator = ChunkDeduplicator() if DEDUP_ENABLED else None
+    lexical = LexicalIndexBuilder() if LEXICAL_INDEX_ENABLED else None
+
+    def store(window, future):
+        inserted = vector_store.insert_chunks(window, future.result())
+        if lexical is not None:
+            lexical.add(window)
+        if deduplicator is not None:
+            deduplicator.mark_stored(window)
+        return inserted
 
-    # 3. Embed Chunks using Jina API
     try:
-        texts_to_embed = [item['text'] for item in all_chunks]
-        print(f"⏳ Calling Jina API to embed {len(texts_to_embed)} chunks...")
-        embeddings = get_jina_embeddings(texts_to_embed, model="jina-embeddings-v2-base-en")
-        
-        # 4. Prepare data for Milvus insertion
-        entities = [
-            [item['proposal_id'] for item in all_chunks], # proposal_id
-            [item['page_number'] for item in all_chunks], # page_number
-            [item['chunk_index'] for item in all_chunks], # chunk_index
-            [item['text'] for item in all_chunks],        # text_content
-            embeddings                                    # embedding
-        ]
-        
-        # 5. Insert into Milvus
-        result = milvus_collection.insert(entities)
-        milvus_collection.flush()
-        
-        print(f"✅ Successfully inserted {len(result.primary_keys)} vectors into Milvus.")
-        
+        chunks = iter_proposal_chunks(proposal_path, proposal_id, doc_hash, executor=executor, deduplicator=deduplicator)
+        with ThreadPoolExecutor(max_workers=INGEST_MAX_PENDING_WINDOWS) as embedder:
+            pending = deque()
+            for window in iter_windows(chunks):
+                texts_to_embed = [item['text'] for item in window]
+                pending.append((window, embedder.submit(get_jina_embeddings, texts_to_embed, "jina-embeddings-v2-base-en")))
+                # Backpressure: don't read further pages until the oldest window is stored
+                if len(pending) >= INGEST_MAX_PENDING_WINDOWS:
+                    total_inserted += store(*pending.popleft())
+                    print(f"  - ✅ {proposal_id}: {total_inserted} chunks embedded and stored so far...")
+            while pending:
+                total_inserted += store(*pending.popleft())
+
+        if deduplicator is not None:
+            if deduplicator.late_refs:
+                vector_store.update_page_refs(proposal_id, deduplicator.late_refs)
+                if lexical is not None:
+                    lexical.update_page_refs(deduplicator.late_refs)
+            print(f"  - 🧹 Skipped {deduplicator.dropped} duplicate chunks (kept as page references).")
+        print(f"✅ Successfully inserted {total_inserted} vectors into the {vector_store.name} store.")
+        register_document(proposal_id, doc_hash)
+
+        if lexical is not None:
+            # Retrieval falls back to vector search alone for documents without an index
+            try:
+                index = lexical.build()
+                save_lexical_index(doc_hash, index)
+                print(f"  - 🔤 {proposal_id}: lexical index of {len(index)} chunks, {len(index.vocab)} terms.")
+            except Exception as e:
+                print(f"  - ⚠️ Failed to build the lexical index for {proposal_id}: {e}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error during extraction, Jina API call or vector store insertion: {e}")
+        # Don't leave a partial document behind that would be mistaken for a complete one
+        if total_inserted:
+            try:
+                vector_store.delete_document(proposal_id)
+                print(f"♻️ Removed {total_inserted} partially ingested chunks for {proposal_id}.")
+            except Exception as cleanup_error:
+                print(f"❌ Failed to remove partial chunks for {proposal_id}: {cleanup_error}")
+        return False
+
+def ingest_shared_proposal(proposal_path: str, proposal_id: str, namespace: str, vector_store: VectorStore, executor=None, file_hash: str = None) -> bool:
+    """
+    Ingests a namespaced proposal as a shared document: chunks are stored
+    once under shared_document_id(doc_hash), and the namespace only records
+    which document its proposal_id maps to, so jobs uploading the same PDF
+    reuse one copy. Returns True when the document is available.
+    """
+    try:
+        doc_hash = ingestion_hash(file_hash or compute_file_hash(proposal_path))
     except Exception as e:
-        print(f"❌ Error during Jina API call or Milvus insertion: {e}")
\ No newline at end of file
+        print(f"❌ Error hashing {proposal_path}: {e}")
+        return False
+    store_id = shared_document_id(doc_hash)
+    registry = get_document_registry()
+    with registry.document_lock(store_id):
+        # Chunks of a document that never completed are left over from a crash; replace them
+        if not ingest_proposal(proposal_path, store_id, vector_store, force=not registry.is_complete(store_id), executor=executor, file_hash=file_hash):
+            return False
+        registry.mark_complete(store_id, doc_hash)
+        registry.assign(namespace, proposal_id, store_id)
+    return True
+
+def ingest_proposals(proposals_paths: Dict[str, str], vector_store: VectorStore, force: bool = False, workers: int = PDF_EXTRACT_WORKERS, progress_callback=None, namespace: str = None, file_hashes: Dict[str, str] = None) -> List[str]:
+    """
+    Ingests several proposals concurrently. All documents share one process
+    pool for page extraction, so pages of different proposals are extracted
+    in parallel; each proposal keeps its own page order. progress_callback,
+    if given, gets an "ingestion" progress event as each proposal finishes.
+    With a namespace, proposals are ingested as shared documents (see
+    ingest_shared_proposal) and force is ignored, as only completed
+    documents are reused. file_hashes maps proposal ids to already known
+    sha256 digests of their PDFs. Returns the ids of the proposals whose
+    ingestion failed (their chunks were rolled back).
+    """
+    file_hashes = file_hashes or {}
+    total = len(proposals_paths)
+
+    def ingest(prop_id: str, prop_path: str, executor=None):
+        if namespace:
+            return ingest_shared_proposal(prop_path, prop_id, namespace, vector_store, executor=executor, file_hash=file_hashes.get(prop_id))
+        return ingest_proposal(prop_path, prop_id, vector_store, force=force, executor=executor, file_hash=file_hashes.get(prop_id))
+
+    def report(done: int):
+        if progress_callback is not None:
+            progress_callback({"type": "progress", "stage": "ingestion", "done": done, "total": total})
+
+    report(0)
+    succeeded = set()
+    if workers <= 1:
+        for done, (prop_id, prop_path) in enumerate(proposals_paths.items(), start=1):
+            if ingest(prop_id, prop_path):
+                succeeded.add(prop_id)
+            report(done)
+    else:
+        with create_pdf_extraction_pool(workers) as executor:
+            with ThreadPoolExecutor(max_workers=max(1, min(INGEST_MAX_CONCURRENT_PROPOSALS, total))) as threads:
+                futures = {
+                    threads.submit(ingest, prop_id, prop_path, executor): prop_id
+                    for prop_id, prop_path in proposals_paths.items()
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    try:
+                        if future.result():
+                            succeeded.add(futures[future])
+                    except Exception as e:
+                        print(f"❌ Ingestion of {futures[future]} failed: {e}")
+                    report(done)
+    return [prop_id for prop_id in proposals_paths if prop_id not in succeeded]
+
+def _delete_document(store_id: str, vector_store: VectorStore) -> bool:
+    try:
+        doc_hash = document_hash(store_id, vector_store)
+        vector_store.delete_document(store_id)
+        discard_document(store_id, doc_hash)
+        return True
+    except Exception as e:
+        print(f"❌ Failed to remove chunks for {store_id}: {e}")
+        return False
+
+def remove_proposals(proposal_ids: List[str], vector_store: VectorStore, namespace: str = None):
+    """
+    Deletes the stored chunks of the given proposals. For a namespace (e.g. a
+    finished job), releases its shared documents instead and deletes those no
+    other namespace still uses.
+    """
+    if not namespace:
+        removed = sum(_delete_document(prop_id, vector_store) for prop_id in proposal_ids)
+    else:
+        registry = get_document_registry()
+        removed = 0
+        for store_id in registry.mapped_documents(namespace):
+            with registry.document_lock(store_id):
+                if registry.release(namespace, store_id) and _delete_document(store_id, vector_store):
+                    registry.forget(store_id)
+                    removed += 1
+    vector_store.finalize()
+    print(f"♻️ Removed {removed} documents{f' released by namespace {namespace}' if namespace else ''} from the {vector_store.name} store.")
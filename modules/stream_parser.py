@@ -0,0 +1,120 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+# Lines after the header in which the markdown separator row must appear
+MARKDOWN_SEPARATOR_SEARCH_LINES = 3
+
+class MarkdownTableStream:
+    """
+    Incremental parser for the first markdown table in a streamed answer.
+    feed() takes text as it arrives and returns the data rows completed by
+    it as (row_number, cells); close() flushes a last line without newline.
+    The header is the first line starting with "|", the separator must follow
+    within MARKDOWN_SEPARATOR_SEARCH_LINES lines, blank lines are skipped and
+    the table ends at the first non-"|" line after the separator. Cells are
+    padded or truncated to the header's column count.
+    """
+
+    def __init__(self):
+        self.columns: Optional[List[str]] = None
+        self.finished = False
+        self._buffer = ""
+        self._has_separator = False
+        self._lines_since_header = 0
+        self._row_number = 0
+
+    def feed(self, text: str) -> List[Tuple[int, List[str]]]:
+        self._buffer += text
+        rows = []
+        while "\n" in self._buffer and not self.finished:
+            line, self._buffer = self._buffer.split("\n", 1)
+            row = self._line(line)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def close(self) -> List[Tuple[int, List[str]]]:
+        rows = self.feed("\n") if self._buffer else []
+        if self.columns is not None and not self._has_separator:
+            raise ValueError("Markdown table header/separator not found")
+        return rows
+
+    def _line(self, line: str) -> Optional[Tuple[int, List[str]]]:
+        if not line.strip() or self.finished:
+            return None
+        if self.columns is None:
+            if line.strip().startswith('|'):
+                # remove table border empties (first and last are empty because of leading/trailing pipes)
+                self.columns = [c.strip() for c in line.split('|')][1:-1]
+            return None
+        if not self._has_separator:
+            self._lines_since_header += 1
+            if set(line.replace('|', '').strip()) <= set('-: '):
+                self._has_separator = True
+            elif self._lines_since_header >= MARKDOWN_SEPARATOR_SEARCH_LINES:
+                raise ValueError("Markdown table header/separator not found")
+            return None
+        if not line.strip().startswith('|'):
+            # Stop when the table ends
+            self.finished = True
+            return None
+        cells = [c.strip() for c in line.split('|')][1:-1]
+        if len(cells) < len(self.columns):
+            cells = cells + [''] * (len(self.columns) - len(cells))
+        elif len(cells) > len(self.columns):
+            cells = cells[:len(self.columns)]
+        row = (self._row_number, cells)
+        self._row_number += 1
+        return row
+
+class JsonItemStream:
+    """
+    Incremental parser yielding the objects of the first JSON array in a
+    streamed answer (e.g. each entry of {"scores": [...]}) as soon as each
+    one closes. Text around the JSON, such as markdown fences, is ignored;
+    items that fail to decode are counted in .invalid and skipped.
+    """
+
+    def __init__(self):
+        self.invalid = 0
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+        self._item_depth = 0
+
+    def feed(self, text: str) -> List[Any]:
+        self._buffer += text
+        items = []
+        while self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = bool(self._stack)
+            elif ch in '{[':
+                if ch == '{' and self._item_start is None and self._stack and self._stack[-1] == '[':
+                    self._item_start, self._item_depth = self._pos, len(self._stack)
+                self._stack.append(ch)
+            elif ch in '}]' and self._stack:
+                self._stack.pop()
+                if self._item_start is not None and len(self._stack) == self._item_depth:
+                    try:
+                        items.append(json.loads(self._buffer[self._item_start:self._pos + 1]))
+                    except ValueError:
+                        self.invalid += 1
+                    # Drop consumed text so the buffer stays small
+                    self._buffer = self._buffer[self._pos + 1:]
+                    self._pos = -1
+                    self._item_start = None
+            self._pos += 1
+        if self._item_start is None and not self._in_string:
+            self._buffer, self._pos = "", 0
+        return items
@@ -1,13 +1,54 @@
-import pandas as pd
-import fitz
 import os
+import re
+import hashlib
+import random
+import threading
+import time
 import requests
+import requests.adapters
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+from .embedding_cache import get_embedding_cache, text_hash
+from .stream_parser import MarkdownTableStream
+
+# pandas and PyMuPDF are imported where they are used, so importing this module stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Define chunking parameters
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 100
 EMBEDDING_DIM = 768 # Jina-embeddings-v4
 
+# Structure-aware chunking (sentence/paragraph boundaries, may span pages)
+CHUNKER = os.getenv("CHUNKER", "structured").lower()   # "structured" or "recursive" (fixed 512/100 chars per page)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "384"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?؟۔])\s+")
+
+# Parallel PDF extraction settings
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))  # pages handed to a worker at once
+
+# Jina Embeddings API client settings
+JINA_API_URL = "https://api.jina.ai/v1/embeddings"
+JINA_BATCH_SIZE = int(os.getenv("JINA_BATCH_SIZE", "128"))            # max inputs per request
+JINA_MAX_BATCH_TOKENS = int(os.getenv("JINA_MAX_BATCH_TOKENS", "60000"))  # estimated tokens per request
+JINA_MAX_CONCURRENCY = int(os.getenv("JINA_MAX_CONCURRENCY", "4"))   # batches in flight
+JINA_MAX_RETRIES = int(os.getenv("JINA_MAX_RETRIES", "5"))
+JINA_BACKOFF_BASE = 1.0  # seconds; doubled on every retry
+JINA_TIMEOUT = 120
+JINA_MAX_BATCH_SECONDS = float(os.getenv("JINA_MAX_BATCH_SECONDS", "300"))  # total time allowed per batch, retries included
+JINA_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_jina_session = None
+_jina_session_lock = threading.Lock()
+# Process-wide cap on Jina requests in flight, shared by every caller and thread
+_jina_slots = threading.BoundedSemaphore(JINA_MAX_CONCURRENCY)
+
 def recursive_chunking(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
     """Simple, recursive text chunking with overlap."""
     chunks = []
@@ -26,8 +67,115 @@ def recursive_chunking(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: i
             
     return chunks
 
+def _split_units(text: str):
+    """
+    Splits page text into sentence units. Yields (unit, ends_paragraph).
+    PyMuPDF emits one line per visual line, so lines inside a paragraph are
+    re-joined before sentence splitting; blank lines mark paragraph ends.
+    """
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        sentences = [s for s in _SENTENCE_END.split(paragraph) if s.strip()]
+        for i, sentence in enumerate(sentences):
+            yield sentence.strip(), i == len(sentences) - 1
+
+def _split_long_unit(unit: str, max_tokens: int):
+    """
+    Splits a unit that alone exceeds max_tokens on word boundaries. A word
+    that is still too long (broken spacing in extracted Arabic, tables, URLs)
+    is cut into windows of characters that fit max_tokens.
+    """
+    # Longest string estimate_tokens still counts as max_tokens
+    max_chars = max(1, 3 * max_tokens)
+    pieces, current = [], []
+    for word in unit.split(" "):
+        if len(word) > max_chars:
+            if current:
+                pieces.append(" ".join(current))
+                current = []
+            pieces.extend(word[i:i + max_chars] for i in range(0, len(word), max_chars))
+            continue
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def structure_aware_chunking(pages, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Chunks a stream of (page_num, text) pages on sentence and paragraph boundaries.
+
+    Chunks may span pages; each yielded dict carries the text, page_number (first
+    page), page_end (last page) and a chunk_index that runs across the document.
+    A chunk closes early at a paragraph end once it is 3/4 full, and the next
+    chunk repeats whole trailing sentences of up to overlap_tokens.
+    """
+    units = []  # (text, page_num, tokens) of the chunk being built
+    tokens = 0
+    fresh = 0   # units added since the last emitted chunk (excludes carried overlap)
+    chunk_index = 0
+
+    def emit():
+        return {
+            "text": " ".join(u[0] for u in units),
+            "page_number": units[0][1],
+            "page_end": units[-1][1],
+            "chunk_index": chunk_index,
+        }
+
+    def carry_overlap():
+        carried, carried_tokens = [], 0
+        for unit in reversed(units):
+            if carried_tokens + unit[2] > overlap_tokens:
+                break
+            carried.insert(0, unit)
+            carried_tokens += unit[2]
+        return carried, carried_tokens
+
+    for page_num, text in pages:
+        if not text:
+            continue
+        for sentence, ends_paragraph in _split_units(text):
+            parts = [sentence] if estimate_tokens(sentence) <= max_tokens else _split_long_unit(sentence, max_tokens)
+            for part in parts:
+                # Count the space the part is joined with, so the chunk's text stays within max_tokens
+                part_tokens = estimate_tokens(part + " ")
+                if fresh and tokens + part_tokens > max_tokens:
+                    yield emit()
+                    chunk_index += 1
+                    units, tokens = carry_overlap()
+                    fresh = 0
+                    # Drop the overlap if it would push this unit over the limit
+                    if tokens + part_tokens > max_tokens:
+                        units, tokens = [], 0
+                units.append((part, page_num, part_tokens))
+                tokens += part_tokens
+                fresh += 1
+            if ends_paragraph and fresh and tokens >= 0.75 * max_tokens:
+                yield emit()
+                chunk_index += 1
+                units, tokens = carry_overlap()
+                fresh = 0
+
+    # A trailing chunk made only of carried overlap would be a pure duplicate
+    if fresh:
+        yield emit()
+
+def compute_file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """Returns the sha256 hex digest of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 def extract_text_from_pdf_page(pdf_path: str, page_number: int) -> str:
     """Extracts text from a single page of a PDF file using PyMuPDF (fitz)."""
+    import fitz
     try:
         with fitz.open(pdf_path) as doc:
             if page_number < 0 or page_number >= len(doc):
@@ -40,95 +188,270 @@ def extract_text_from_pdf_page(pdf_path: str, page_number: int) -> str:
         print(f"❌ Error extracting text from {pdf_path}: {e}")
         return None
 
-def get_jina_embeddings(texts, model: str = "jina-embeddings-v2-base-en"):
-    """Call Jina Embeddings API via HTTP and return list of embeddings."""
+def _extract_page_range(pdf_path: str, start: int, end: int):
+    """Process-pool worker: opens its own document handle and returns [(page_num, text)] for [start, end)."""
+    import fitz
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(start, min(end, len(doc))):
+            pages.append((page_num, doc[page_num].get_text("text").strip()))
+    return pages
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """Returns the number of pages in a PDF."""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+def create_pdf_extraction_pool(workers: int = PDF_EXTRACT_WORKERS):
+    """
+    Creates a process pool for PDF text extraction. Uses 'spawn' so workers start
+    clean even when the parent process has threads running.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def iter_pdf_pages(pdf_path: str, executor=None, pages_per_task: int = PDF_PAGES_PER_TASK, max_inflight: int = None):
+    """
+    Yields (page_num, text) for every page of a PDF, in page order.
+
+    With an executor (see create_pdf_extraction_pool), page ranges are extracted
+    in parallel by worker processes; at most max_inflight ranges are pending at
+    once so memory stays bounded. Without one, pages are read in-process.
+    """
+    page_count = get_pdf_page_count(pdf_path)
+    if executor is None or page_count <= pages_per_task:
+        for page_num, text in _extract_page_range(pdf_path, 0, page_count):
+            yield page_num, text
+        return
+
+    if max_inflight is None:
+        max_inflight = 2 * PDF_EXTRACT_WORKERS
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    pending = deque()
+    next_range = 0
+    while next_range < len(ranges) or pending:
+        while next_range < len(ranges) and len(pending) < max_inflight:
+            start, end = ranges[next_range]
+            pending.append(executor.submit(_extract_page_range, pdf_path, start, end))
+            next_range += 1
+        # Consume in submission order so pages come out in order
+        for page_num, text in pending.popleft().result():
+            yield page_num, text
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~3 characters per token) used to size API payloads."""
+    return max(1, (len(text) + 2) // 3)
+
+def _get_jina_session() -> requests.Session:
+    """Returns the shared keep-alive session used for all Jina calls."""
+    global _jina_session
+    with _jina_session_lock:
+        if _jina_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=JINA_MAX_CONCURRENCY,
+                pool_maxsize=JINA_MAX_CONCURRENCY,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _jina_session = session
+        return _jina_session
+
+def make_embedding_batches(texts, max_batch_size: int = JINA_BATCH_SIZE, max_batch_tokens: int = JINA_MAX_BATCH_TOKENS):
+    """
+    Splits texts into (start, end) index ranges that respect both the
+    per-request item limit and the estimated token budget.
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        batch_full = (i - start) >= max_batch_size or (batch_tokens + tokens) > max_batch_tokens
+        if i > start and batch_full:
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+def _retry_delay(attempt: int, deadline: float, retry_after=None):
+    """
+    Jittered backoff before the next attempt, or None when waiting would
+    run past the batch deadline.
+    """
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = JINA_BACKOFF_BASE * (2 ** attempt)
+    delay += random.uniform(0, JINA_BACKOFF_BASE)
+    return delay if time.monotonic() + delay < deadline else None
+
+def _post_jina_batch(texts, model: str, api_key: str):
+    """
+    Embeds one batch, retrying on 429/5xx and transient network errors.
+    Gives up once JINA_MAX_BATCH_SECONDS have passed, retries included.
+    At most JINA_MAX_CONCURRENCY requests are in flight per process.
+    """
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = {"input": texts, "model": model}
+    session = _get_jina_session()
+    deadline = time.monotonic() + JINA_MAX_BATCH_SECONDS
+
+    for attempt in range(JINA_MAX_RETRIES + 1):
+        timeout = min(JINA_TIMEOUT, max(1.0, deadline - time.monotonic()))
+        try:
+            with _jina_slots:
+                resp = session.post(JINA_API_URL, headers=headers, json=payload, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            delay = _retry_delay(attempt, deadline) if attempt < JINA_MAX_RETRIES else None
+            if delay is None:
+                raise
+            print(f"⚠️ Jina request failed ({e}). Retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            continue
+
+        if resp.status_code in JINA_RETRY_STATUSES and attempt < JINA_MAX_RETRIES:
+            delay = _retry_delay(attempt, deadline, resp.headers.get("Retry-After"))
+            if delay is not None:
+                print(f"⚠️ Jina returned {resp.status_code}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
+        resp.raise_for_status()
+        data = resp.json().get("data", [])
+        # Jina tags each item with its position in the request; don't rely on response order
+        data = sorted(data, key=lambda item: item.get("index", 0))
+        if len(data) != len(texts):
+            raise RuntimeError(f"Jina returned {len(data)} embeddings for {len(texts)} inputs.")
+        return [item["embedding"] for item in data]
+
+def _fetch_jina_embeddings(texts, model: str):
+    """
+    Calls the Jina API for texts. Large inputs are split into size/token-bounded
+    batches that are sent concurrently over a pooled session; results are
+    returned in input order.
+    """
     api_key = os.getenv("JINA_API_KEY")
     if not api_key:
         raise RuntimeError("JINA_API_KEY is not set in environment.")
-    url = "https://api.jina.ai/v1/embeddings"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {"input": texts, "model": model}
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-    resp.raise_for_status()
-    data = resp.json()
-    return [item["embedding"] for item in data.get("data", [])]
 
-def extract_criteria_from_rubric(markdown_table: str) -> pd.DataFrame:
+    batches = make_embedding_batches(texts)
+    if len(batches) == 1:
+        return _post_jina_batch(texts, model, api_key)
+
+    embeddings = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=min(JINA_MAX_CONCURRENCY, len(batches))) as executor:
+        futures = {
+            executor.submit(_post_jina_batch, texts[start:end], model, api_key): (start, end)
+            for start, end in batches
+        }
+        for future in as_completed(futures):
+            start, end = futures[future]
+            embeddings[start:end] = future.result()
+    return embeddings
+
+def get_jina_embeddings(texts, model: str = "jina-embeddings-v2-base-en", use_cache: bool = True):
     """
-    Parses the markdown table generated by Kimi into a DataFrame.
-    This DataFrame is used to drive the evaluation loop.
+    Call Jina Embeddings API via HTTP and return list of embeddings.
+
+    Texts already present in the on-disk embedding cache are served locally;
+    only distinct cache misses are sent to Jina.
     """
-    try:
-        # Robust parsing logic for markdown tables that may contain blank cells
-        lines = [ln for ln in markdown_table.strip().split('\n') if ln.strip()]
-        if len(lines) < 3:
-            raise ValueError("Table is too short to be a markdown table.")
-
-        # Find header and separator lines
-        header_idx = next((i for i, ln in enumerate(lines) if ln.strip().startswith('|')), None)
-        sep_idx = None
-        if header_idx is not None:
-            for j in range(header_idx + 1, min(header_idx + 4, len(lines))):
-                if set(lines[j].replace('|', '').strip()) <= set('-: '):
-                    sep_idx = j
-                    break
-        if header_idx is None or sep_idx is None:
-            raise ValueError("Markdown table header/separator not found")
-
-        # Parse header (keep empty columns)
-        raw_header_cells = [c.strip() for c in lines[header_idx].split('|')]
-        # remove table border empties (first and last are empty because of leading/trailing pipes)
-        columns = raw_header_cells[1:-1]
-
-        # Parse rows; keep empty cells and pad/truncate to match columns
-        data = []
-        for ln in lines[sep_idx + 1:]:
-            if not ln.strip().startswith('|'):
-                # Stop when the table ends
-                break
-            cells = [c.strip() for c in ln.split('|')][1:-1]
-            if len(cells) < len(columns):
-                cells = cells + [''] * (len(columns) - len(cells))
-            elif len(cells) > len(columns):
-                cells = cells[:len(columns)]
-            data.append(cells)
-
-        if not data:
-            return pd.DataFrame()
+    texts = list(texts)
+    if not texts:
+        return []
 
-        df = pd.DataFrame(data, columns=columns)
+    cache = get_embedding_cache() if use_cache else None
+    if cache is None:
+        return _fetch_jina_embeddings(texts, model)
 
-        # Forward-fill Main/Weight columns in case Kimi leaves them blank for subsequent sub-rows
-        main_col_candidates = [
-            'Main Criterion (with English translation in brackets)',
-            'Main Criterion',
-        ]
-        for col in main_col_candidates:
-            if col in df.columns:
-                df[col] = df[col].replace('', pd.NA).ffill()
-                break
+    hashes = [text_hash(t) for t in texts]
+    cached = cache.get_many(model, hashes)
 
-        # Normalize/rename columns used by the evaluation loop
-        rename_map = {
-            'Main Criterion (with English translation in brackets)': 'Main_Criterion',
-            'Main Criterion': 'Main_Criterion',
-            'Sub-Criterion (with English translation in brackets)': 'Sub_Criterion',
-            'Sub-Criterion': 'Sub_Criterion',
-            'Expectation / Evaluation Rubric': 'Rubric',
-            'Expectation': 'Rubric',
-            'Evaluation Rubric': 'Rubric',
-        }
-        df = df.rename(columns=rename_map)
+    # Embed each distinct missing text once
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in cached and h not in missing:
+            missing[h] = t
+    if missing:
+        fresh = _fetch_jina_embeddings(list(missing.values()), model)
+        fetched = dict(zip(missing.keys(), fresh))
+        cache.put_many(model, fetched)
+        cached.update(fetched)
 
-        # Keep only necessary columns; do not drop rows just because some fields were blank before ffill
-        needed_cols = [c for c in ['Main_Criterion', 'Sub_Criterion', 'Rubric'] if c in df.columns]
-        df = df[needed_cols]
+    print(f"  - 🗄️ Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} texts sent to Jina.")
+    return [cached[h] for h in hashes]
 
-        # Drop rows that truly cannot be evaluated (missing sub-criterion or rubric)
-        df = df.dropna(subset=[c for c in ['Sub_Criterion', 'Rubric'] if c in df.columns])
-        df = df[(df['Sub_Criterion'].astype(str).str.strip() != '') & (df['Rubric'].astype(str).str.strip() != '')]
+# Rubric table columns used by the evaluation loop, by the names Kimi may give them
+RUBRIC_MAIN_COLUMNS = [
+    'Main Criterion (with English translation in brackets)',
+    'Main Criterion',
+]
+RUBRIC_COLUMN_MAP = {
+    'Main Criterion (with English translation in brackets)': 'Main_Criterion',
+    'Main Criterion': 'Main_Criterion',
+    'Sub-Criterion (with English translation in brackets)': 'Sub_Criterion',
+    'Sub-Criterion': 'Sub_Criterion',
+    'Expectation / Evaluation Rubric': 'Rubric',
+    'Expectation': 'Rubric',
+    'Evaluation Rubric': 'Rubric',
+}
 
-        return df
+def iter_rubric_rows(chunks):
+    """
+    Parses Kimi's rubric table from an iterable of text chunks (e.g. a
+    streamed completion) and yields (index, row) for every criterion as soon
+    as its line is complete. row holds Main_Criterion (carried down when Kimi
+    leaves it blank for subsequent sub-rows), Sub_Criterion and Rubric; index
+    is the row's position in the table, rows without a sub-criterion or
+    rubric are skipped. Raises ValueError for a malformed table.
+    """
+    table = MarkdownTableStream()
+    main_col = None
+    last_main = None
+
+    def to_row(row_number, cells):
+        nonlocal main_col, last_main
+        if main_col is None:
+            main_col = next((c for c in RUBRIC_MAIN_COLUMNS if c in table.columns), "")
+            renamed = {RUBRIC_COLUMN_MAP.get(c, c) for c in table.columns}
+            if not {'Sub_Criterion', 'Rubric'} <= renamed:
+                raise ValueError(f"Rubric table lacks sub-criterion/rubric columns: {table.columns}")
+        record = {}
+        for column, value in zip(table.columns, cells):
+            # Forward-fill the main criterion in case Kimi leaves it blank for subsequent sub-rows
+            if column == main_col:
+                value = value or last_main
+                last_main = value
+            record.setdefault(RUBRIC_COLUMN_MAP.get(column, column), value)
+        if not (record.get('Sub_Criterion') or "").strip() or not (record.get('Rubric') or "").strip():
+            return None
+        return row_number, {c: record[c] for c in ('Main_Criterion', 'Sub_Criterion', 'Rubric') if c in record}
+
+    for chunk in chunks:
+        for row_number, cells in table.feed(chunk):
+            row = to_row(row_number, cells)
+            if row is not None:
+                yield row
+    for row_number, cells in table.close():
+        row = to_row(row_number, cells)
+        if row is not None:
+            yield row
+
+def extract_criteria_from_rubric(markdown_table: str) -> "pd.DataFrame":
+    """
+    Parses the markdown table generated by Kimi into a DataFrame.
+    This DataFrame is used to drive the evaluation loop.
+    """
+    import pandas as pd
+    try:
+        rows = list(iter_rubric_rows([markdown_table]))
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame([row for _, row in rows], index=[index for index, _ in rows])
     
     except Exception as e:
         print(f"Error parsing Kimi output table: {e}")
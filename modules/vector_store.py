@@ -0,0 +1,105 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# Which vector backend the pipeline uses: "milvus" (Zilliz Cloud) or "numpy" (in-process)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus").lower()
+
+def namespaced_id(proposal_id: str, namespace: Optional[str] = None) -> str:
+    """
+    Returns the id a proposal is stored under. Concurrent evaluations use
+    their own namespace (e.g. the job id) so "Prop_1" of one job never
+    replaces or leaks into "Prop_1" of another; a namespaced proposal
+    resolves to the shared document it was ingested as (see
+    DocumentRegistry), falling back to "<namespace>/<proposal_id>".
+    """
+    if not namespace:
+        return proposal_id
+    from .document_registry import get_document_registry
+    return get_document_registry().lookup(namespace, proposal_id) or f"{namespace}/{proposal_id}"
+
+class VectorStore:
+    """
+    Interface shared by the vector backends. Chunks are dicts with
+    proposal_id, doc_hash, page_number, page_end, chunk_index, text and
+    page_refs (every page the deduplicated content appears on).
+    """
+
+    name = "base"
+
+    def get_document_hash(self, proposal_id: str) -> Optional[str]:
+        """Returns the doc_hash stored for a proposal, or None if it has no chunks."""
+        raise NotImplementedError
+
+    def delete_document(self, proposal_id: str):
+        """Removes every chunk of a proposal."""
+        raise NotImplementedError
+
+    def insert_chunks(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]) -> int:
+        """Stores chunks with their embeddings; returns the number inserted."""
+        raise NotImplementedError
+
+    def update_page_refs(self, proposal_id: str, refs: Dict[Tuple[int, int], List[int]]):
+        """
+        Replaces page_refs of already stored chunks, keyed by
+        (page_number, chunk_index); used when duplicates turn up after the
+        original chunk was inserted.
+        """
+        raise NotImplementedError
+
+    def finalize(self):
+        """Called once ingestion is done (flush, index tuning, persistence)."""
+        pass
+
+    def health_check(self) -> bool:
+        """Returns True if the store is reachable and ready to search."""
+        return True
+
+    def reconnect(self) -> bool:
+        """Re-establishes the backend connection; returns True on success."""
+        return True
+
+    def search(self, query_vectors: List[List[float]], proposal_ids: List[str], k: int) -> List[Dict[str, List[Dict[str, Any]]]]:
+        """
+        Returns, for each query vector, {proposal_id: hits} with up to k hits per
+        proposal ordered best first. Each hit has proposal_id, page_number,
+        page_end, page_refs, text and score (cosine similarity).
+        """
+        raise NotImplementedError
+
+def initialize_vector_store(backend: Optional[str] = None, reset: bool = False) -> Optional[VectorStore]:
+    """Opens (or creates) the configured vector store for ingestion."""
+    backend = (backend or VECTOR_BACKEND).lower()
+    if backend == "numpy":
+        from .numpy_store import NumpyVectorStore
+        print("⏳ Opening local NumPy vector store...")
+        return NumpyVectorStore.open(reset=reset)
+    if backend == "milvus":
+        from .milvus_store import initialize_milvus, MilvusVectorStore
+        collection = initialize_milvus(reset=reset)
+        return MilvusVectorStore(collection) if collection is not None else None
+    print(f"❌ Unknown vector backend: {backend}")
+    return None
+
+def get_vector_store(backend: Optional[str] = None) -> Optional[VectorStore]:
+    """Opens the configured vector store for retrieval without modifying it."""
+    backend = (backend or VECTOR_BACKEND).lower()
+    if backend == "numpy":
+        from .numpy_store import NumpyVectorStore
+        return NumpyVectorStore.open()
+    if backend == "milvus":
+        from .milvus_store import get_milvus_collection, MilvusVectorStore
+        collection = get_milvus_collection()
+        return MilvusVectorStore(collection) if collection is not None else None
+    print(f"❌ Unknown vector backend: {backend}")
+    return None
+
+def ensure_vector_store_ready(vector_store: VectorStore) -> bool:
+    """Health-checks a long-lived store and reconnects it if needed; returns whether it is usable."""
+    if vector_store.health_check():
+        return True
+    print(f"⚠️ {vector_store.name} vector store is unhealthy; reconnecting...")
+    if vector_store.reconnect() and vector_store.health_check():
+        print(f"✅ {vector_store.name} vector store reconnected.")
+        return True
+    print(f"❌ {vector_store.name} vector store is unavailable.")
+    return False
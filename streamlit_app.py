@@ -5,9 +5,85 @@ import sys
 import traceback
 import json
 import os
+import time
 
 # FastAPI Endpoint (Assuming it's running locally on port 8000)
-FASTAPI_URL = "http://localhost:8000/upload_and_evaluate/"
+FASTAPI_BASE_URL = os.getenv("FASTAPI_BASE_URL", "http://localhost:8000")
+POLL_INTERVAL_SECONDS = 2
+
+# Share of the progress bar each pipeline stage fills
+STAGE_WEIGHTS = {"rubric": 10, "ingestion": 30, "evaluation": 55, "output": 5}
+STAGE_LABELS = {
+    "rubric": "Generating the evaluation rubric with Kimi",
+    "ingestion": "Chunking, embedding and storing proposals",
+    "evaluation": "Retrieving context and scoring with Kimi",
+    "output": "Saving results",
+}
+
+def job_progress(job: dict) -> int:
+    """Converts the job's per-stage progress into a 0-100 progress bar value."""
+    value = 0.0
+    for stage, weight in STAGE_WEIGHTS.items():
+        info = job.get("stages", {}).get(stage, {})
+        if info.get("status") == "done":
+            value += weight
+        elif info.get("status") == "running" and info.get("total"):
+            value += weight * min(1.0, info.get("done", 0) / info["total"])
+    return int(min(100, value))
+
+def job_status_text(job: dict) -> str:
+    """Describes the running stage, e.g. 'Retrieving context and scoring with Kimi (12/40)'."""
+    if job.get("status") == "queued":
+        return "Waiting for a free evaluation worker..."
+    for stage, info in job.get("stages", {}).items():
+        if info.get("status") == "running":
+            label = STAGE_LABELS.get(stage, stage)
+            if info.get("total"):
+                return f"{label} ({info.get('done', 0)}/{info['total']})..."
+            return f"{label}..."
+    return f"Job {job.get('status', 'running')}..."
+
+def apply_job_event(job: dict, event: dict) -> dict:
+    """Updates a local copy of the job status with one streamed event (mirrors the server's stage table)."""
+    if event.get("type") == "job":
+        job["status"] = event.get("status")
+        job["error"] = event.get("error")
+    elif event.get("type") == "stage":
+        info = job.setdefault("stages", {}).setdefault(event["stage"], {})
+        info["status"] = {"started": "running", "finished": "done"}.get(event["status"], event["status"])
+    elif event.get("type") == "progress":
+        info = job.setdefault("stages", {}).setdefault(event["stage"], {})
+        info["done"], info["total"] = event.get("done", 0), event.get("total")
+    return job
+
+def iter_job_events(job_id: str, max_reconnects: int = 5):
+    """
+    Yields the job's Server-Sent Events as dicts until it succeeds or fails,
+    reconnecting from the last received event if the stream drops.
+    """
+    last_seq, reconnects = 0, 0
+    while True:
+        try:
+            with requests.get(
+                f"{FASTAPI_BASE_URL}/jobs/{job_id}/events",
+                params={"after": last_seq},
+                stream=True,
+                timeout=(10, 60)  # the server sends a keep-alive at least every 15s
+            ) as stream:
+                stream.raise_for_status()
+                for line in stream.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:"):])
+                    last_seq = event.get("seq", last_seq)
+                    yield event
+                    if event.get("type") == "job" and event.get("status") in ("succeeded", "failed"):
+                        return
+        except requests.exceptions.RequestException:
+            reconnects += 1
+            if reconnects > max_reconnects:
+                raise
+            time.sleep(POLL_INTERVAL_SECONDS)
 
 # Set page config at the very top (before any other Streamlit commands)
 st.set_page_config(
@@ -164,10 +240,8 @@ if 'files_uploaded' not in st.session_state:
     st.session_state.files_uploaded = False
 if 'rfp_file' not in st.session_state:
     st.session_state.rfp_file = None
-if 'proposal1_file' not in st.session_state:
-    st.session_state.proposal1_file = None
-if 'proposal2_file' not in st.session_state:
-    st.session_state.proposal2_file = None
+if 'proposal_files' not in st.session_state:
+    st.session_state.proposal_files = []
 if 'stored_result' not in st.session_state:
     st.session_state.stored_result = None
 if 'stored_df_results' not in st.session_state:
@@ -176,7 +250,7 @@ if 'stored_raw_results' not in st.session_state:
     st.session_state.stored_raw_results = []
 
 st.title("RFP Proposal Evaluation System")
-#st.markdown("Upload your RFP and two proposals to get score and reasoning")
+#st.markdown("Upload your RFP and the proposals to get score and reasoning")
 st.markdown("---")
 
 # --- File Upload Section (Outside form to avoid JS module issues) ---
@@ -189,21 +263,15 @@ rfp_file = st.file_uploader(
     help="Upload the RFP document containing evaluation criteria"
 )
 
-col1, col2 = st.columns(2)
-with col1:
-    proposal1_file = st.file_uploader(
-        "Upload Proposal 1 PDF", 
-        type=["pdf"], 
-        key="prop1_uploader",
-        help="Upload the first proposal PDF"
-    )
-with col2:
-    proposal2_file = st.file_uploader(
-        "Upload Proposal 2 PDF", 
-        type=["pdf"], 
-        key="prop2_uploader",
-        help="Upload the second proposal PDF"
-    )
+proposal_files = st.file_uploader(
+    "Upload Proposal PDFs", 
+    type=["pdf"], 
+    key="proposals_uploader",
+    accept_multiple_files=True,
+    help="Upload every bid to compare; they are scored as Prop_1, Prop_2, ... in upload order"
+)
+if proposal_files:
+    st.caption(" · ".join(f"Prop_{i}: {f.name}" for i, f in enumerate(proposal_files, start=1)))
 
 rfp_page_number = st.number_input(
     "Enter RFP Page Number for evaluation criteria", 
@@ -216,10 +284,8 @@ rfp_page_number = st.number_input(
 # Store files in session state
 if rfp_file is not None:
     st.session_state.rfp_file = rfp_file
-if proposal1_file is not None:
-    st.session_state.proposal1_file = proposal1_file
-if proposal2_file is not None:
-    st.session_state.proposal2_file = proposal2_file
+if proposal_files:
+    st.session_state.proposal_files = proposal_files
 
 # Evaluation button (centered, medium width)
 left_col, mid_col, right_col = st.columns([3, 2, 3])
@@ -230,11 +296,10 @@ with mid_col:
 if submitted:
     # Use files from current upload or session state
     current_rfp = rfp_file if rfp_file is not None else st.session_state.get('rfp_file')
-    current_prop1 = proposal1_file if proposal1_file is not None else st.session_state.get('proposal1_file')
-    current_prop2 = proposal2_file if proposal2_file is not None else st.session_state.get('proposal2_file')
+    current_proposals = proposal_files if proposal_files else st.session_state.get('proposal_files', [])
     
-    if not all([current_rfp, current_prop1, current_prop2]):
-        st.error("Please upload all three required files (RFP, Proposal 1, Proposal 2).")
+    if not current_rfp or not current_proposals:
+        st.error("Please upload the RFP and at least one proposal.")
         st.info("Tip: Make sure all file uploaders show a file name before clicking 'Start Evaluation'.")
     else:
         try:
@@ -243,17 +308,16 @@ if submitted:
             # Reset file pointers to beginning
             if hasattr(current_rfp, 'seek'):
                 current_rfp.seek(0)
-            if hasattr(current_prop1, 'seek'):
-                current_prop1.seek(0)
-            if hasattr(current_prop2, 'seek'):
-                current_prop2.seek(0)
+            for proposal in current_proposals:
+                if hasattr(proposal, 'seek'):
+                    proposal.seek(0)
             
-            # Prepare files for multipart upload
-            files = {
-                'rfp_file': (current_rfp.name, current_rfp.getvalue(), 'application/pdf'),
-                'proposal1_file': (current_prop1.name, current_prop1.getvalue(), 'application/pdf'),
-                'proposal2_file': (current_prop2.name, current_prop2.getvalue(), 'application/pdf'),
-            }
+            # Prepare files for multipart upload (proposal_files repeats once per proposal)
+            files = [('rfp_file', (current_rfp.name, current_rfp.getvalue(), 'application/pdf'))]
+            files += [
+                ('proposal_files', (proposal.name, proposal.getvalue(), 'application/pdf'))
+                for proposal in current_proposals
+            ]
             
             # Prepare form data
             data = {
@@ -266,19 +330,51 @@ if submitted:
                 status_text = st.empty()
                 
                 try:
-                    status_text.text("Connecting to FastAPI backend...")
-                    progress_bar.progress(10)
+                    status_text.text("Uploading documents to FastAPI backend...")
+                    progress_bar.progress(0)
                     
+                    # Queue the evaluation as a background job, then follow its event
+                    # stream; scores are shown as soon as each criterion is done
                     response = requests.post(
-                        FASTAPI_URL, 
+                        f"{FASTAPI_BASE_URL}/jobs",
                         files=files, 
                         data=data, 
-                        timeout=600,  # 10 minute timeout
-                        stream=False
+                        timeout=120
                     )
                     
-                    progress_bar.progress(50)
-                    status_text.text("Processing response...")
+                    if response.status_code == 202:
+                        job_id = response.json()["job_id"]
+                        job = {"status": "queued", "stages": {}}
+                        live_header = st.empty()
+                        live_table = st.empty()
+                        # Rows arrive one by one as Kimi streams them ("score") and again
+                        # once their criterion is complete ("criterion")
+                        live_rows = {}
+                        try:
+                            for event in iter_job_events(job_id):
+                                apply_job_event(job, event)
+                                if event.get("type") == "score":
+                                    live_rows[(event.get("index"), event["row"].get("Proposal"))] = event["row"]
+                                elif event.get("type") == "criterion" and event.get("rows"):
+                                    for row in event["rows"]:
+                                        live_rows[(event.get("index"), row.get("Proposal"))] = row
+                                if event.get("type") in ("score", "criterion") and live_rows:
+                                    live_header.markdown(f"### Scores so far ({len(live_rows)} rows)")
+                                    live_table.dataframe(pd.DataFrame(list(live_rows.values())), use_container_width=True, height=300)
+                                progress_bar.progress(job_progress(job))
+                                status_text.text(job_status_text(job))
+                        except requests.exceptions.RequestException:
+                            # Event stream unavailable: fall back to polling the job status
+                            while True:
+                                job = requests.get(f"{FASTAPI_BASE_URL}/jobs/{job_id}", timeout=30).json()
+                                progress_bar.progress(job_progress(job))
+                                status_text.text(job_status_text(job))
+                                if job.get("status") in ("succeeded", "failed"):
+                                    break
+                                time.sleep(POLL_INTERVAL_SECONDS)
+                        live_header.empty()
+                        live_table.empty()
+                        response = requests.get(f"{FASTAPI_BASE_URL}/jobs/{job_id}/result", timeout=120)
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -286,7 +382,9 @@ if submitted:
                         status_text.text("Complete!")
                         
                         st.success("Evaluation Complete!")
-                        
+                        if result.get('run_status') == "incomplete":
+                            st.warning(f"Some criteria could not be scored. Resume the job with `POST /jobs/{job_id}/resume` to score only the missing ones.")
+
                         # Display output directory info if available
                         if 'output_directory' in result:
                             st.info(f"Results saved to: `{result['output_directory']}`")
@@ -328,7 +426,7 @@ if submitted:
                             #                         with open(references_file, "r", encoding="utf-8") as rf:
                             #                             refs = json.load(rf)
                             #
-                            #                         for prop_key in ['Prop_1', 'Prop_2']:
+                            #                         for prop_key in [k for k in refs if k.startswith('Prop_')]:
                             #                             chunks = refs.get(prop_key, [])
                             #                             if not chunks:
                             #                                 continue
@@ -464,7 +562,7 @@ if submitted:
 #                             with open(references_file, "r", encoding="utf-8") as rf:
 #                                 refs = json.load(rf)
 
-#                             for prop_key in ['Prop_1', 'Prop_2']:
+#                             for prop_key in [k for k in refs if k.startswith('Prop_')]:
 #                                 chunks = refs.get(prop_key, [])
 #                                 if not chunks:
 #                                     continue
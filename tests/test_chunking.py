@@ -0,0 +1,14 @@
+from modules.utils import structure_aware_chunking, estimate_tokens
+
+def test_whitespace_free_run_respects_max_tokens():
+    text = "Scope of work. " + "ب" * 5000 + " end of section."
+    chunks = list(structure_aware_chunking([(1, text)], max_tokens=50, overlap_tokens=10))
+    assert max(estimate_tokens(c["text"]) for c in chunks) <= 50
+    assert "".join(c["text"] for c in chunks).count("ب") == 5000
+
+def test_chunks_span_pages_and_keep_page_range():
+    pages = [(1, "First page sentence. " * 20), (2, "Second page sentence. " * 20)]
+    chunks = list(structure_aware_chunking(pages, max_tokens=100, overlap_tokens=10))
+    assert all(estimate_tokens(c["text"]) <= 100 for c in chunks)
+    assert chunks[0]["page_number"] == 1 and chunks[-1]["page_end"] == 2
+    assert [c["chunk_index"] for c in chunks] == list(range(len(chunks)))
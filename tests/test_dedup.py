@@ -0,0 +1,52 @@
+from modules.dedup import ChunkDeduplicator, simhash, strip_page_furniture, SIMHASH_MAX_DISTANCE
+
+CLAUSE = (
+    "The contractor shall deliver all equipment within {days} days of the purchase order, "
+    "a delay penalty of {penalty}% of the contract value applies per week, and every device "
+    "carries a warranty of {months} months from the date of acceptance by the ministry."
+)
+
+def _chunk(text, page, index=0):
+    return {"text": text, "page_number": page, "chunk_index": index}
+
+def test_chunks_differing_only_in_numbers_are_kept():
+    first = CLAUSE.format(days=30, penalty=1, months=12)
+    second = CLAUSE.format(days=18, penalty=1, months=12)
+    # Close enough for SimHash alone to call them duplicates
+    assert bin(simhash(first) ^ simhash(second)).count("1") <= SIMHASH_MAX_DISTANCE
+
+    dedup = ChunkDeduplicator()
+    kept = list(dedup.filter([_chunk(first, 1), _chunk(second, 2)]))
+    assert len(kept) == 2
+    assert dedup.dropped == 0
+
+def test_repeated_chunk_is_dropped_with_page_refs():
+    dedup = ChunkDeduplicator()
+    text = CLAUSE.format(days=30, penalty=1, months=12)
+    kept = list(dedup.filter([_chunk(text, 1), _chunk(text.upper(), 2)]))
+    assert len(kept) == 1
+    assert kept[0]["page_refs"] == [1, 2]
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf"]
+
+def _page(n, footer, page_line=None):
+    """A page with a two-line header, distinct body text, a footer and a page line."""
+    body = [f"Section {WORDS[n]} describes the {WORDS[n]} deliverables." for _ in range(4)]
+    lines = ["Ministry of Finance", "Tender 12/2024", *body, footer, page_line or f"Page {n} of 6"]
+    return n, "\n".join(lines)
+
+def test_running_headers_and_page_numbers_are_stripped():
+    pages = dict(strip_page_furniture(_page(n, f"Clause {WORDS[n]}") for n in range(1, 7)))
+    lines = pages[3].split("\n")
+    assert "Ministry of Finance" not in lines and "Page 3 of 6" not in lines
+    assert "Clause delta" in lines
+
+def test_differing_numeric_edge_lines_are_kept():
+    footers = ["Total 1,250", "Total 3,400", "Total 5,125", "7", "12", "30"]
+    pages = dict(strip_page_furniture(_page(n, footer) for n, footer in enumerate(footers, start=1)))
+    for n, footer in enumerate(footers, start=1):
+        assert footer in pages[n].split("\n")
+
+def test_bare_page_numbers_are_stripped():
+    pages = dict(strip_page_furniture(_page(n, f"Clause {WORDS[n]}", page_line=f"- {n + 2} -") for n in range(1, 7)))
+    assert pages[4].split("\n")[-1] == "Clause echo"